@@ -0,0 +1,213 @@
+# backend/api/answer_cache.py
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# --- Configuration ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# How long a cached answer stays valid
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "900"))
+# Most answers kept per classroom (least recently used are dropped first)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+# Cosine similarity above which two questions count as the same question (0 disables near-duplicate hits)
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+# Expired answers are kept this much longer, to be served only while the LLM is unavailable
+ANSWER_CACHE_STALE_SECONDS = float(os.getenv("ANSWER_CACHE_STALE_SECONDS", "86400"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a question for exact matching: case-folded, punctuation removed,
+    whitespace collapsed. Works for Tamil as well as English text.
+    """
+    text = unicodedata.normalize("NFC", query).casefold()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class _CachedAnswer:
+    def __init__(self, answer: str, embedding):
+        self.answer = answer
+        self.embedding = None if embedding is None else np.asarray(embedding, dtype=np.float32)
+        if self.embedding is not None:
+            norm = np.linalg.norm(self.embedding)
+            if norm > 0:
+                self.embedding = self.embedding / norm
+        self.created_at = time.monotonic()
+
+
+class _ClassroomAnswers:
+    def __init__(self, version):
+        self.version = version
+        self.entries: "OrderedDict[str, _CachedAnswer]" = OrderedDict()
+
+
+class AnswerCache:
+    """
+    Per-classroom cache of generated answers.
+    Hits on the exact normalized question, or on a near-duplicate whose query
+    embedding has cosine similarity >= similarity_threshold. Entries expire after
+    ttl_seconds, each classroom keeps at most max_entries, and all of a classroom's
+    entries are dropped when its index version changes or invalidate() is called.
+    Expired entries linger for stale_seconds for lookup_stale() (degraded mode).
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, similarity_threshold: float,
+                 stale_seconds: float = 0.0):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._classrooms: dict[str, _ClassroomAnswers] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.invalidations = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.similarity_threshold > 0
+
+    def _classroom_locked(self, classroom_id: str, version) -> _ClassroomAnswers:
+        answers = self._classrooms.get(classroom_id)
+        if answers is None or answers.version != version:
+            if answers is not None:
+                self.invalidations += 1
+            answers = _ClassroomAnswers(version)
+            self._classrooms[classroom_id] = answers
+        return answers
+
+    def _is_fresh(self, entry: _CachedAnswer) -> bool:
+        return not self.ttl_seconds or time.monotonic() - entry.created_at <= self.ttl_seconds
+
+    def _drop_expired_locked(self, answers: _ClassroomAnswers) -> None:
+        if not self.ttl_seconds:
+            return
+        now = time.monotonic()
+        max_age = self.ttl_seconds + self.stale_seconds
+        for key in [k for k, e in answers.entries.items() if now - e.created_at > max_age]:
+            del answers.entries[key]
+
+    def lookup_exact(self, classroom_id: str, query: str, version):
+        """Returns a cached answer for the exact normalized question, or None."""
+        key = normalize_query(query)
+        with self._lock:
+            answers = self._classroom_locked(classroom_id, version)
+            self._drop_expired_locked(answers)
+            entry = answers.entries.get(key)
+            if entry is None or not self._is_fresh(entry):
+                return None
+            answers.entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry.answer
+
+    def lookup_similar(self, classroom_id: str, query_embedding, version):
+        """Returns the cached answer of the most similar previous question above the threshold, or None."""
+        with self._lock:
+            entry = self._most_similar_locked(classroom_id, query_embedding, version, stale=False)
+            if entry is None:
+                return None
+            self.semantic_hits += 1
+            return entry.answer
+
+    def lookup_stale(self, classroom_id: str, query: str, query_embedding, version):
+        """
+        Like lookup_exact then lookup_similar, but expired answers count too.
+        Only for degraded mode, when an old answer beats no answer.
+        """
+        key = normalize_query(query)
+        with self._lock:
+            answers = self._classroom_locked(classroom_id, version)
+            self._drop_expired_locked(answers)
+            entry = answers.entries.get(key)
+            if entry is None:
+                entry = self._most_similar_locked(classroom_id, query_embedding, version, stale=True)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry.answer
+
+    def _most_similar_locked(self, classroom_id: str, query_embedding, version, stale: bool):
+        if not self.semantic_enabled or query_embedding is None:
+            return None
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return None
+        query_vector = query_vector / norm
+
+        answers = self._classroom_locked(classroom_id, version)
+        self._drop_expired_locked(answers)
+        candidates = [
+            (k, e) for k, e in answers.entries.items()
+            if e.embedding is not None and (stale or self._is_fresh(e))
+        ]
+        if not candidates:
+            return None
+        matrix = np.stack([e.embedding for _, e in candidates])
+        scores = matrix @ query_vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        key, entry = candidates[best]
+        answers.entries.move_to_end(key)
+        return entry
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def store(self, classroom_id: str, query: str, answer: str, version, query_embedding=None) -> None:
+        key = normalize_query(query)
+        with self._lock:
+            current = self._classrooms.get(classroom_id)
+            if current is not None and current.version != version:
+                # Answered against an index version lookups have already moved past (a note was
+                # indexed meanwhile): drop it instead of resetting the classroom to that version
+                return
+            answers = self._classroom_locked(classroom_id, version)
+            answers.entries[key] = _CachedAnswer(answer, query_embedding)
+            answers.entries.move_to_end(key)
+            while self.max_entries and len(answers.entries) > self.max_entries:
+                answers.entries.popitem(last=False)
+
+    def invalidate(self, classroom_id: str | None = None) -> None:
+        """Drops cached answers for one classroom, or all classrooms."""
+        with self._lock:
+            if classroom_id is None:
+                self._classrooms.clear()
+            else:
+                self._classrooms.pop(classroom_id, None)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 3) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": sum(len(a.entries) for a in self._classrooms.values()),
+            }
+
+
+# --- Process-wide answer cache ---
+answer_cache = AnswerCache(
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    stale_seconds=ANSWER_CACHE_STALE_SECONDS,
+)
@@ -0,0 +1,84 @@
+# backend/api/batching.py
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Gathers items submitted from many threads within a short window and processes
+    them with a single batch_fn(items) -> results call.
+
+    The first caller in a window waits max_wait_ms, then runs the batch for everyone
+    who joined; a batch that reaches max_batch_size is run straight away. Callers
+    block until their own result is ready. Several batches may run at once.
+    """
+
+    def __init__(self, batch_fn, max_wait_ms: float, max_batch_size: int, name: str = "batcher"):
+        self.batch_fn = batch_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.name = name
+        self._pending = []
+        self._window_open = False
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item):
+        """Adds an item to the current batch and returns its result (or raises its error)."""
+        if self.max_wait <= 0 or self.max_batch_size == 1:
+            # Batching disabled: run this item on its own
+            return self._run_batch([(item, None)])[0]
+
+        future = Future()
+        batch = None
+        is_leader = False
+        with self._lock:
+            self._pending.append((item, future))
+            if len(self._pending) >= self.max_batch_size:
+                batch, self._pending = self._pending, []
+                self._window_open = False
+            elif not self._window_open:
+                self._window_open = True
+                is_leader = True
+
+        if batch is not None:
+            self._run_batch(batch)
+        elif is_leader:
+            time.sleep(self.max_wait)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._window_open = False
+            if batch:
+                self._run_batch(batch)
+        return future.result()
+
+    def _run_batch(self, batch: list) -> list:
+        items = [item for item, _ in batch]
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+        try:
+            results = self.batch_fn(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name}: batch function returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            for _, future in batch:
+                if future is not None:
+                    future.set_exception(e)
+            if batch[0][1] is None:
+                raise
+            return []
+        for (_, future), result in zip(batch, results):
+            if future is not None:
+                future.set_result(result)
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            }
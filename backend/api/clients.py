@@ -0,0 +1,131 @@
+# backend/api/clients.py
+import os
+import logging
+import threading
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+
+# The Vertex AI SDK and LangChain take seconds to import; they are loaded when the
+# first client is created, so routes that don't need them start serving right away
+if TYPE_CHECKING:
+    from langchain_google_vertexai import VertexAIEmbeddings, VertexAI
+    from .retrieval import CachedQueryEmbeddings
+
+logger = logging.getLogger(__name__)
+
+# Loaded once per process (it used to be called on every classroom initialization)
+load_dotenv()
+
+# --- Configuration ---
+EMBEDDING_MODEL_NAME = "text-embedding-004" # Must match the model used by populate_db.py
+# Parallel requests each Vertex AI client may have open; tune connection limits here, once
+VERTEX_REQUEST_PARALLELISM = int(os.getenv("VERTEX_REQUEST_PARALLELISM", "8"))
+# The SDK's own retries happen inside each attempt of resilience.py's policies (which
+# add deadlines and circuit breaking), so keep them few
+VERTEX_MAX_RETRIES = int(os.getenv("VERTEX_MAX_RETRIES", "1"))
+
+# --- Process-wide client registry ---
+# { (kind, model config...): client }
+# Every classroom uses the same models and project, so one client per config is shared.
+# Each client keeps its own pooled gRPC channel to Vertex AI, so sharing the client
+# also shares the underlying connections.
+_clients = {}
+_clients_lock = threading.RLock()
+# Optional replacements for the Vertex AI constructors (see set_backend_factories)
+_backend_factories = {"embeddings": None, "llm": None}
+
+
+def get_google_project_id() -> str:
+    google_project_id = os.getenv("GOOGLE_PROJECT_ID")
+    if not google_project_id:
+        raise ValueError("GOOGLE_PROJECT_ID not found in environment variables.")
+    return google_project_id
+
+
+def set_backend_factories(embeddings=None, llm=None) -> None:
+    """
+    Replaces the Vertex AI clients with other implementations, e.g. the offline fakes
+    in bench/fakes.py. embeddings(model_name) and llm(model_name, temperature,
+    max_output_tokens) are called instead of the Vertex AI constructors; pass None
+    to restore Vertex AI. Clears the registry, so call it before serving requests.
+    """
+    with _clients_lock:
+        _backend_factories["embeddings"] = embeddings
+        _backend_factories["llm"] = llm
+        _clients.clear()
+
+
+def _get_or_create(key: tuple, factory):
+    # Re-entrant lock: a factory may fetch another registered client (see get_query_embeddings)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+            logger.info("Created shared client: %s", key)
+        return client
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL_NAME) -> "VertexAIEmbeddings":
+    """Returns the shared embeddings client for a model."""
+    custom_factory = _backend_factories["embeddings"]
+    if custom_factory is not None:
+        return _get_or_create(("embeddings", model_name, "custom"), lambda: custom_factory(model_name))
+    project = get_google_project_id()
+
+    def create():
+        from langchain_google_vertexai import VertexAIEmbeddings
+        return VertexAIEmbeddings(
+            model_name=model_name,
+            project=project,
+            request_parallelism=VERTEX_REQUEST_PARALLELISM,
+            max_retries=VERTEX_MAX_RETRIES,
+        )
+
+    return _get_or_create(("embeddings", model_name, project), create)
+
+
+def get_query_embeddings(model_name: str = EMBEDDING_MODEL_NAME) -> "CachedQueryEmbeddings":
+    """
+    Returns the shared embeddings client wrapped with the query-embedding cache
+    and micro-batching. Use this for anything that embeds user questions.
+    """
+    from .retrieval import CachedQueryEmbeddings
+
+    return _get_or_create(
+        ("query-embeddings", model_name),
+        lambda: CachedQueryEmbeddings(get_embeddings(model_name), model_name),
+    )
+
+
+def get_llm(model_name: str, temperature: float, max_output_tokens: int) -> "VertexAI":
+    """Returns the shared LLM client for a model and generation settings."""
+    custom_factory = _backend_factories["llm"]
+    if custom_factory is not None:
+        return _get_or_create(
+            ("llm", model_name, "custom", temperature, max_output_tokens),
+            lambda: custom_factory(model_name, temperature, max_output_tokens),
+        )
+    project = get_google_project_id()
+
+    def create():
+        from langchain_google_vertexai import VertexAI
+        return VertexAI(
+            model_name=model_name,
+            project=project,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            request_parallelism=VERTEX_REQUEST_PARALLELISM,
+            max_retries=VERTEX_MAX_RETRIES,
+        )
+
+    return _get_or_create(("llm", model_name, project, temperature, max_output_tokens), create)
+
+
+def registry_stats() -> dict:
+    with _clients_lock:
+        stats = {"clients": [" / ".join(str(part) for part in key) for key in _clients]}
+        stats["query_embeddings"] = [
+            client.stats() for key, client in _clients.items() if key[0] == "query-embeddings"
+        ]
+        return stats
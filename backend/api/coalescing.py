@@ -0,0 +1,56 @@
+# backend/api/coalescing.py
+import asyncio
+import os
+
+# --- Configuration ---
+RAG_COALESCE_ENABLED = os.getenv("RAG_COALESCE_ENABLED", "true").lower() == "true"
+
+
+class RequestCoalescer:
+    """
+    Deduplicates identical in-flight work. The first caller for a key (the leader)
+    starts the work as its own task; callers arriving with the same key while it
+    runs (followers) await that task instead of starting their own.
+
+    The work is shielded, so a leader whose client disconnects doesn't cancel the
+    result its followers are waiting for. Meant to be used from one event loop.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._in_flight: dict = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, factory):
+        """Returns (result, coalesced). factory() creates the coroutine doing the work."""
+        if not self.enabled:
+            return await factory(), False
+
+        task = self._in_flight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda done, key=key: self._finished(key, done))
+        return await asyncio.shield(task), coalesced
+
+    def _finished(self, key, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the error as retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / calls, 3) if calls else 0.0,
+        }
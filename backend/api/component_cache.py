@@ -0,0 +1,224 @@
+# backend/api/component_cache.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+    """One cached classroom: its components plus bookkeeping for LRU/TTL/memory."""
+
+    def __init__(self, components: dict, size_bytes: int):
+        self.components = components
+        self.size_bytes = size_bytes
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ComponentCache:
+    """
+    Bounded LRU/TTL cache of initialized classroom components, keyed by classroom_id.
+
+    - max_entries: most classrooms kept at once (0 = unlimited)
+    - ttl_seconds: entries unused for this long are dropped (0 = never)
+    - max_memory_bytes: budget for the estimated size of all entries (0 = unlimited)
+
+    Evicted entries are handed to on_evict(classroom_id, components) so open
+    vector stores can be closed. get_or_create() makes sure only one thread
+    builds a given classroom at a time; concurrent callers wait for that result.
+    """
+
+    def __init__(self, max_entries: int = 0, ttl_seconds: float = 0, max_memory_bytes: int = 0,
+                 size_fn=None, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self._size_fn = size_fn or (lambda components: 0)
+        self._on_evict = on_evict
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        # classroom_id -> [build lock, callers holding or waiting for it]; dropped when none are left
+        self._init_locks: dict[str, list] = {}
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # --- Lookups ---
+
+    def __contains__(self, classroom_id: str) -> bool:
+        with self._lock:
+            return classroom_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def get(self, classroom_id: str):
+        """Returns cached components (marking them recently used), or None."""
+        with self._lock:
+            evicted = self._expire_idle_locked()
+            entry = self._entries.get(classroom_id)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(classroom_id)
+        self._notify_evicted(evicted)
+        return entry.components if entry is not None else None
+
+    def get_or_create(self, classroom_id: str, factory, is_stale=None):
+        """
+        Returns cached components, building them with factory(classroom_id) on a miss.
+        If is_stale(components) is true the entry is rebuilt and replaced.
+        Single-flight: concurrent misses for the same classroom share one build.
+        """
+        def usable(components):
+            return components is not None and not (is_stale and is_stale(components))
+
+        components = self.get(classroom_id)
+        if usable(components):
+            with self._lock:
+                self.hits += 1
+            return components
+
+        with self._lock:
+            slot = self._init_locks.setdefault(classroom_id, [threading.Lock(), 0])
+            slot[1] += 1
+            init_lock = slot[0]
+
+        try:
+            with init_lock:
+                # Another thread may have finished the build while we waited
+                components = self.get(classroom_id)
+                if usable(components):
+                    with self._lock:
+                        self.hits += 1
+                    return components
+                with self._lock:
+                    self.misses += 1
+                components = factory(classroom_id)
+                self.put(classroom_id, components)
+                return components
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._init_locks[classroom_id]
+
+    # --- Updates ---
+
+    def put(self, classroom_id: str, components: dict):
+        """Adds or replaces an entry, then evicts until the cache is within its limits."""
+        size_bytes = self._size_fn(components)
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(classroom_id, None)
+            if old is not None:
+                self._total_bytes -= old.size_bytes
+                if old.components is not components:
+                    evicted.append((classroom_id, old.components))
+            self._entries[classroom_id] = _CacheEntry(components, size_bytes)
+            self._total_bytes += size_bytes
+            evicted.extend(self._expire_idle_locked())
+            evicted.extend(self._enforce_limits_locked(keep=classroom_id))
+        self._notify_evicted(evicted)
+
+    def replace(self, classroom_id: str, current: dict, components: dict) -> bool:
+        """
+        Swaps in an updated copy of an entry that shares its resources (so current is not
+        closed), if the entry still holds current. Returns True if it was replaced.
+        """
+        with self._lock:
+            entry = self._entries.get(classroom_id)
+            if entry is None or entry.components is not current:
+                return False
+            entry.components = components
+            return True
+
+    def pop(self, classroom_id: str):
+        """Removes an entry (closing it) and returns its components, or None."""
+        with self._lock:
+            entry = self._entries.pop(classroom_id, None)
+            if entry is None:
+                return None
+            self._total_bytes -= entry.size_bytes
+        self._notify_evicted([(classroom_id, entry.components)])
+        return entry.components
+
+    def clear(self):
+        """Drops every entry, closing each one."""
+        with self._lock:
+            evicted = [(cid, entry.components) for cid, entry in self._entries.items()]
+            self._entries.clear()
+            self._total_bytes = 0
+        self._notify_evicted(evicted)
+
+    # --- Internals ---
+
+    def _expire_idle_locked(self) -> list:
+        """Removes entries idle for longer than the TTL. Returns them for closing outside the lock."""
+        if not self.ttl_seconds:
+            return []
+        now = time.monotonic()
+        expired = [cid for cid, entry in self._entries.items() if now - entry.last_used > self.ttl_seconds]
+        evicted = []
+        for cid in expired:
+            entry = self._entries.pop(cid)
+            self._total_bytes -= entry.size_bytes
+            evicted.append((cid, entry.components))
+        self.evictions += len(evicted)
+        return evicted
+
+    def _enforce_limits_locked(self, keep: str) -> list:
+        """Evicts least recently used entries until count and memory are within limits."""
+        evicted = []
+        def over_limits():
+            if self.max_entries and len(self._entries) > self.max_entries:
+                return True
+            if self.max_memory_bytes and self._total_bytes > self.max_memory_bytes:
+                return True
+            return False
+
+        while over_limits() and len(self._entries) > 1:
+            # Least recently used entry is first; never evict the one just added
+            cid = next(iter(self._entries))
+            if cid == keep:
+                self._entries.move_to_end(cid)
+                continue
+            entry = self._entries.pop(cid)
+            self._total_bytes -= entry.size_bytes
+            evicted.append((cid, entry.components))
+        self.evictions += len(evicted)
+        return evicted
+
+    def _notify_evicted(self, evicted: list) -> None:
+        if not self._on_evict:
+            return
+        for cid, components in evicted:
+            try:
+                self._on_evict(cid, components)
+            except Exception as e:
+                logger.warning("Failed to close evicted components: %s", e, extra={"classroom_id": cid})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "estimated_bytes": self._total_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "classrooms": {
+                    cid: {"estimated_bytes": entry.size_bytes,
+                          "idle_seconds": round(time.monotonic() - entry.last_used, 1)}
+                    for cid, entry in self._entries.items()
+                },
+            }
@@ -0,0 +1,338 @@
+# backend/api/concurrency.py
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Maximum number of RAG requests allowed to run at the same time in this process
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "8"))
+# Maximum number of RAG requests allowed to wait for a free slot
+RAG_MAX_QUEUE_DEPTH = int(os.getenv("RAG_MAX_QUEUE_DEPTH", "32"))
+# How long a queued request may wait for a slot before it is rejected
+RAG_QUEUE_TIMEOUT_SECONDS = float(os.getenv("RAG_QUEUE_TIMEOUT_SECONDS", "10"))
+# Value sent back in the Retry-After header when the server is overloaded
+RAG_RETRY_AFTER_SECONDS = int(os.getenv("RAG_RETRY_AFTER_SECONDS", "2"))
+
+# --- Fair scheduling between classrooms ---
+# Slots one classroom may hold at once (0 = no cap beyond RAG_MAX_CONCURRENCY)
+RAG_CLASSROOM_MAX_CONCURRENCY = int(os.getenv("RAG_CLASSROOM_MAX_CONCURRENCY", "0"))
+# Questions per second one classroom may start, in bursts of up to RAG_CLASSROOM_BURST (0 = no rate limit)
+RAG_CLASSROOM_RATE_PER_SECOND = float(os.getenv("RAG_CLASSROOM_RATE_PER_SECOND", "0"))
+RAG_CLASSROOM_BURST = int(os.getenv("RAG_CLASSROOM_BURST", "20"))
+# Per-classroom overrides as JSON, e.g.
+# {"math_g10_tamil": {"weight": 2, "max_concurrency": 4, "rate_per_second": 1, "burst": 40}}
+# weight is the classroom's share of the slots when several classrooms are waiting (default 1)
+RAG_CLASSROOM_LIMITS = os.getenv("RAG_CLASSROOM_LIMITS", "")
+# Queue wait objective: once the oldest waiting request has waited this long, new requests
+# from classrooms that already have requests waiting are rejected at once (0 = off)
+RAG_QUEUE_WAIT_SLO_SECONDS = float(os.getenv("RAG_QUEUE_WAIT_SLO_SECONDS", "5"))
+# Idle classrooms forgotten once more than this many are tracked (classroom IDs come from requests)
+MAX_TRACKED_CLASSROOMS = 1000
+
+
+class ServiceOverloadedError(Exception):
+    """Raised when a request cannot be admitted because the server is at capacity."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int = RAG_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(ServiceOverloadedError):
+    """Raised when a classroom is asking faster than its rate limit allows (answered with 429)."""
+
+    status_code = 429
+
+
+def _parse_classroom_limits(text: str) -> dict[str, dict]:
+    if not text.strip():
+        return {}
+    try:
+        limits = json.loads(text)
+        if not isinstance(limits, dict) or not all(isinstance(value, dict) for value in limits.values()):
+            raise ValueError("expected an object of objects")
+        return limits
+    except ValueError as e:
+        logger.error("Ignoring invalid RAG_CLASSROOM_LIMITS: %s", e)
+        return {}
+
+
+class _Waiter:
+    __slots__ = ("future", "classroom_id", "priority", "tag", "enqueued_at", "seq")
+
+    def __init__(self, future, classroom_id, priority, tag, enqueued_at, seq):
+        self.future = future
+        self.classroom_id = classroom_id
+        self.priority = priority
+        self.tag = tag
+        self.enqueued_at = enqueued_at
+        self.seq = seq
+
+
+class _ClassroomQueue:
+    """One classroom's waiting requests (priority ones first) and limits."""
+
+    def __init__(self, limits: dict, now: float):
+        self.weight = max(float(limits.get("weight", 1.0)), 0.01)
+        self.max_concurrency = int(limits.get("max_concurrency", RAG_CLASSROOM_MAX_CONCURRENCY))
+        self.rate = float(limits.get("rate_per_second", RAG_CLASSROOM_RATE_PER_SECOND))
+        self.burst = max(int(limits.get("burst", RAG_CLASSROOM_BURST)), 1)
+        self.tokens = float(self.burst)
+        self.refilled_at = now
+        self.last_tag = 0.0
+        self.running = 0
+        self.waiting = (deque(), deque()) # (priority, normal)
+        self.admitted = 0
+        self.shed = 0
+        self.wait_seconds = 0.0 # Total time admitted requests spent waiting
+
+    def head(self):
+        for lane in self.waiting:
+            if lane:
+                return lane[0]
+        return None
+
+    def waiting_count(self) -> int:
+        return len(self.waiting[0]) + len(self.waiting[1])
+
+    def take_tokens(self, cost: float, now: float) -> float:
+        """Takes cost tokens from the bucket; returns 0, or the seconds until there are enough."""
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def refund_tokens(self, cost: float) -> None:
+        """Gives back tokens taken for a request that never ran (timed out or cancelled in the queue)."""
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + min(cost, self.burst))
+
+    def is_idle(self, now: float) -> bool:
+        """Nothing running or waiting and a full bucket: forgetting it changes nothing (read-only)."""
+        full = not self.rate or self.tokens + (now - self.refilled_at) * self.rate >= self.burst
+        return not self.running and not self.waiting_count() and full
+
+    def has_capacity(self) -> bool:
+        return not self.max_concurrency or self.running < self.max_concurrency
+
+
+class ConcurrencyLimiter:
+    """
+    Limits how many requests run at once and how many may wait in line.
+    Requests beyond (max_concurrency + max_queue_depth) are rejected immediately
+    so the caller can answer with a fast 503 instead of piling up latency.
+
+    Waiting requests are scheduled fairly between classrooms (weighted fair
+    queuing: each classroom gets a share of the freed slots in proportion to its
+    weight, so one classroom's burst cannot starve the others), priority requests
+    (teachers) ahead of the rest. Each classroom can have its own concurrency cap
+    and token-bucket rate limit. While the queue misses its wait objective,
+    classrooms that already have requests waiting are shed on arrival.
+    Runs on the event loop; not thread-safe.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue_depth: int, queue_timeout: float,
+                 wait_slo: float = RAG_QUEUE_WAIT_SLO_SECONDS, classroom_limits: dict | None = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self.wait_slo = wait_slo
+        self.classroom_limits = classroom_limits or {}
+        self._queues: dict[str, _ClassroomQueue] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._running = 0
+        self._waiting = 0
+        self.shed = {"queue_full": 0, "slo": 0, "rate_limited": 0, "timeout": 0}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def is_saturated(self) -> bool:
+        """True if a new request would be rejected right now."""
+        return self._running + self._waiting >= self.max_concurrency + self.max_queue_depth
+
+    def _queue(self, classroom_id: str) -> _ClassroomQueue:
+        queue = self._queues.get(classroom_id)
+        if queue is None:
+            if len(self._queues) >= MAX_TRACKED_CLASSROOMS:
+                self._forget_idle()
+            limits = self.classroom_limits.get(classroom_id) or self.classroom_limits.get("*") or {}
+            queue = self._queues[classroom_id] = _ClassroomQueue(limits, time.monotonic())
+        return queue
+
+    def _forget_idle(self) -> None:
+        now = time.monotonic()
+        for classroom_id, queue in list(self._queues.items()):
+            if queue.is_idle(now):
+                del self._queues[classroom_id]
+
+    def oldest_wait(self) -> float:
+        """Seconds the longest-waiting request has been queued."""
+        now = time.monotonic()
+        oldest = [lane[0].enqueued_at for queue in self._queues.values() for lane in queue.waiting if lane]
+        return now - min(oldest) if oldest else 0.0
+
+    def admission_error(self, classroom_id: str = "", priority: bool = False) -> ServiceOverloadedError | None:
+        """The error a new request would be rejected with right now, or None (tokens are not taken)."""
+        if self.is_saturated():
+            return ServiceOverloadedError("Too many questions are being processed right now. Please retry shortly.")
+        queue = self._queues.get(classroom_id)
+        if (not priority and queue is not None and queue.waiting_count() and self.wait_slo
+                and self.oldest_wait() > self.wait_slo):
+            return ServiceOverloadedError("Too many questions from this classroom are waiting. Please retry shortly.")
+        return None
+
+    def _shed(self, queue: _ClassroomQueue, classroom_id: str, reason: str) -> None:
+        queue.shed += 1
+        self.shed[reason] += 1
+        metrics.SHED.inc(classroom=classroom_id, reason=reason)
+
+    @asynccontextmanager
+    async def slot(self, classroom_id: str = "", priority: bool = False, cost: float = 1.0):
+        """
+        Waits for a free execution slot for a request of the classroom (cost: its share
+        of work, e.g. the number of questions in a batch).
+        Raises ServiceOverloadedError if the queue is full, the classroom is over its
+        rate limit (RateLimitedError), the queue is past its wait objective, or the
+        wait times out.
+        """
+        queue = self._queue(classroom_id)
+        error = self.admission_error(classroom_id, priority)
+        if error is not None:
+            self._shed(queue, classroom_id, "queue_full" if self.is_saturated() else "slo")
+            raise error
+        # Tokens are taken once the request is admitted to the queue (shed requests above took
+        # none) and given back if it leaves the queue without running
+        now = time.monotonic()
+        retry_in = queue.take_tokens(cost, now)
+        if retry_in:
+            self._shed(queue, classroom_id, "rate_limited")
+            raise RateLimitedError("This classroom is asking questions faster than allowed. Please retry shortly.",
+                                   retry_after=max(1, math.ceil(retry_in)))
+
+        # Finish tag of weighted fair queuing: classrooms are served in tag order
+        tag = max(self._virtual_time, queue.last_tag) + cost / queue.weight
+        queue.last_tag = tag
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), classroom_id, priority, tag, now, next(self._seq))
+        queue.waiting[0 if priority else 1].append(waiter)
+        self._waiting += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._withdraw(queue, waiter):
+                self._release(queue) # Granted just as the wait timed out
+            queue.refund_tokens(cost)
+            self._shed(queue, classroom_id, "timeout")
+            raise ServiceOverloadedError("Timed out waiting for a free slot. Please retry shortly.")
+        except BaseException:
+            # Cancelled while waiting (client went away)
+            if not self._withdraw(queue, waiter):
+                self._release(queue)
+            queue.refund_tokens(cost)
+            raise
+        try:
+            yield
+        finally:
+            self._release(queue)
+
+    def _withdraw(self, queue: _ClassroomQueue, waiter: _Waiter) -> bool:
+        """Removes a waiter that gave up; False if it had already been granted a slot."""
+        if waiter.future.done():
+            return False
+        waiter.future.cancel()
+        queue.waiting[0 if waiter.priority else 1].remove(waiter)
+        self._waiting -= 1
+        return True
+
+    def _release(self, queue: _ClassroomQueue) -> None:
+        queue.running -= 1
+        self._running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grants free slots to waiters: priority first, then the smallest finish tag."""
+        while self._running < self.max_concurrency and self._waiting:
+            best = None
+            for queue in self._queues.values():
+                head = queue.head()
+                if head is None or not queue.has_capacity():
+                    continue
+                key = (not head.priority, head.tag, head.seq)
+                if best is None or key < best[0]:
+                    best = (key, queue, head)
+            if best is None:
+                return # Everyone waiting is at their classroom's cap
+            _, queue, waiter = best
+            queue.waiting[0 if waiter.priority else 1].popleft()
+            self._waiting -= 1
+            queue.running += 1
+            self._running += 1
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+            waited = time.monotonic() - waiter.enqueued_at
+            queue.admitted += 1
+            queue.wait_seconds += waited
+            metrics.QUEUE_WAIT_SECONDS.observe(waited, classroom=waiter.classroom_id,
+                                                  priority="teacher" if waiter.priority else "student")
+            waiter.future.set_result(None)
+
+    def classroom_stats(self) -> dict[str, dict]:
+        now = time.monotonic()
+        stats = {}
+        for classroom_id, queue in self._queues.items():
+            head = queue.head()
+            stats[classroom_id] = {
+                "running": queue.running,
+                "waiting": queue.waiting_count(),
+                "oldest_wait_seconds": round(now - head.enqueued_at, 3) if head else 0.0,
+                "admitted": queue.admitted,
+                "mean_wait_seconds": round(queue.wait_seconds / queue.admitted, 4) if queue.admitted else 0.0,
+                "shed": queue.shed,
+                "weight": queue.weight,
+            }
+        return stats
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue_depth": self.max_queue_depth,
+            "running": self.running,
+            "waiting": self.waiting,
+            "oldest_wait_seconds": round(self.oldest_wait(), 3),
+            "wait_slo_seconds": self.wait_slo,
+            "shed": dict(self.shed),
+            "classrooms": self.classroom_stats(),
+        }
+
+
+# --- Process-wide limiter for the RAG pipeline ---
+rag_limiter = ConcurrencyLimiter(
+    max_concurrency=RAG_MAX_CONCURRENCY,
+    max_queue_depth=RAG_MAX_QUEUE_DEPTH,
+    queue_timeout=RAG_QUEUE_TIMEOUT_SECONDS,
+    wait_slo=RAG_QUEUE_WAIT_SLO_SECONDS,
+    classroom_limits=_parse_classroom_limits(RAG_CLASSROOM_LIMITS),
+)
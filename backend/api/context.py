@@ -0,0 +1,167 @@
+# backend/api/context.py
+import math
+import os
+import re
+import threading
+import unicodedata
+
+from .lexical_index import tokenize
+
+# --- Configuration ---
+RAG_CONTEXT_COMPRESSION = os.getenv("RAG_CONTEXT_COMPRESSION", "true").lower() == "true"
+# Most (estimated) tokens of retrieved text sent to the LLM per question (0 = no limit)
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "700"))
+# Sentences whose share of the question's (weighted) terms is below this are dropped,
+# as long as at least one sentence matches the question at all
+RAG_CONTEXT_MIN_RELEVANCE = float(os.getenv("RAG_CONTEXT_MIN_RELEVANCE", "0.1"))
+# Shortest chunk overlap (characters) that is cut when one chunk continues another
+MIN_OVERLAP_CHARS = 30
+# populate_db.py's CHUNK_OVERLAP plus slack for separator placement
+MAX_OVERLAP_CHARS = 400
+
+# Sentence ends (Latin and Devanagari punctuation) and line breaks
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?\u0964\u0965])\s+|\n+")
+# Words too common to say anything about relevance
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in is it its of on or the this that to was "
+    "were what when where which who why will with".split()
+)
+# Query terms match inflected forms sharing this many leading characters (Tamil is agglutinative)
+_STEM_CHARS = 5
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough LLM token count without a tokenizer: about 4 characters per token for
+    ASCII text and 2 for other scripts (Tamil words split into more tokens).
+    """
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
+
+
+def _strip_overlap(previous: str, text: str) -> str:
+    """Removes the start of text that repeats the end of previous (neighbouring chunks overlap)."""
+    limit = min(len(previous), len(text), MAX_OVERLAP_CHARS)
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    return text
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", sentence).casefold().split())
+
+
+def _term_stem(term: str) -> str:
+    return term[:_STEM_CHARS] if len(term) > _STEM_CHARS else term
+
+
+class _Sentence:
+    __slots__ = ("doc_index", "position", "text", "tokens", "score")
+
+    def __init__(self, doc_index: int, position: int, text: str):
+        self.doc_index = doc_index
+        self.position = position
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self.score = 0.0
+
+
+class ContextAssembler:
+    """
+    Turns the retrieved chunks into the context sent to the LLM:
+    overlapping and repeated text is removed, sentences sharing few terms with the
+    question are dropped, and what is left is trimmed to a token budget (the most
+    relevant sentences first, then kept in document order). Counts the tokens it
+    saves; see stats().
+    """
+
+    def __init__(self, enabled: bool, token_budget: int, min_relevance: float):
+        self.enabled = enabled
+        self.token_budget = token_budget
+        self.min_relevance = min_relevance
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retrieved_tokens = 0
+        self.context_tokens = 0
+
+    def assemble(self, docs, question: str) -> tuple[str, int, int]:
+        """Returns (context, retrieved tokens, context tokens) for the documents, best first."""
+        texts = [doc.page_content for doc in docs]
+        retrieved_tokens = sum(estimate_tokens(text) for text in texts)
+        if not self.enabled:
+            context = "\n\n".join(texts)
+        else:
+            context = self._compress(texts, question)
+        context_tokens = estimate_tokens(context)
+        with self._lock:
+            self.requests += 1
+            self.retrieved_tokens += retrieved_tokens
+            self.context_tokens += context_tokens
+        return context, retrieved_tokens, context_tokens
+
+    def _compress(self, texts: list[str], question: str) -> str:
+        # 1. Cut text a chunk shares with an earlier one, then split into unique sentences
+        sentences: list[_Sentence] = []
+        seen = set()
+        for doc_index, text in enumerate(texts):
+            for previous in texts[:doc_index]:
+                text = _strip_overlap(previous, text)
+            for position, sentence in enumerate(_SENTENCE_END_RE.split(text)):
+                key = _sentence_key(sentence)
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                sentences.append(_Sentence(doc_index, position, sentence.strip()))
+        if not sentences:
+            return ""
+
+        # 2. Score each sentence by the question terms it contains, rarer terms weighing more
+        terms = {_term_stem(term) for term in tokenize(question) if term not in _STOPWORDS}
+        sentence_stems = [{_term_stem(token) for token in tokenize(s.text)} for s in sentences]
+        weights = {}
+        for term in terms:
+            df = sum(1 for stems in sentence_stems if term in stems)
+            if df:
+                weights[term] = math.log(1 + len(sentences) / df)
+        total_weight = sum(weights.values())
+        if total_weight:
+            for sentence, stems in zip(sentences, sentence_stems):
+                sentence.score = sum(weight for term, weight in weights.items() if term in stems) / total_weight
+            candidates = [s for s in sentences if s.score >= self.min_relevance]
+        else:
+            candidates = sentences # Nothing matches lexically; trust the retriever's order
+
+        # 3. Fill the budget with the best sentences, then restore document order
+        candidates.sort(key=lambda s: (-s.score, s.doc_index, s.position))
+        chosen, used = [], 0
+        for sentence in candidates:
+            if self.token_budget and chosen and used + sentence.tokens > self.token_budget:
+                continue
+            chosen.append(sentence)
+            used += sentence.tokens
+        chosen.sort(key=lambda s: (s.doc_index, s.position))
+
+        parts, current_doc = [], None
+        for sentence in chosen:
+            if sentence.doc_index != current_doc:
+                parts.append([])
+                current_doc = sentence.doc_index
+            parts[-1].append(sentence.text)
+        return "\n\n".join(" ".join(part) for part in parts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            saved = self.retrieved_tokens - self.context_tokens
+            return {
+                "enabled": self.enabled,
+                "token_budget": self.token_budget,
+                "requests": self.requests,
+                "retrieved_tokens": self.retrieved_tokens,
+                "context_tokens": self.context_tokens,
+                "saved_tokens": saved,
+                "avg_saved_tokens": round(saved / self.requests, 1) if self.requests else 0.0,
+            }
+
+
+context_assembler = ContextAssembler(RAG_CONTEXT_COMPRESSION, RAG_CONTEXT_TOKEN_BUDGET, RAG_CONTEXT_MIN_RELEVANCE)
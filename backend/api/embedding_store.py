@@ -0,0 +1,143 @@
+# backend/api/embedding_store.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# --- Configuration ---
+# SQLite file holding document embeddings by content, shared by populate_db.py runs,
+# every classroom and the backend's note indexing
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "embedding_store.db")
+EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE_ENABLED", "true").lower() == "true"
+# Texts looked up per SQL query (stays below SQLite's bound-parameter limit)
+LOOKUP_BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key BLOB PRIMARY KEY, -- sha256 of model name and text
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL, -- float32, little endian
+    created_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def content_key(model_name: str, text: str) -> bytes:
+    """Store key of a text's embedding: the same text embedded by the same model is stored once."""
+    return hashlib.sha256(f"{model_name}\n{text}".encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    Content-addressed cache of document embeddings in SQLite (WAL mode): vectors are
+    stored once per (model, text) as raw float32 BLOBs, whichever classroom or run
+    embedded them first. Each thread gets its own connection. Entries no index uses
+    any more are removed by collect_garbage().
+    """
+
+    def __init__(self, db_path: str, enabled: bool = True):
+        self.db_path = db_path
+        self.enabled = enabled
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(_SCHEMA)
+                    self._schema_ready = True
+        return conn
+
+    def get_many(self, model_name: str, texts: list[str]) -> list[list[float] | None]:
+        """Stored embeddings for the texts, None where a text has none."""
+        keys = [content_key(model_name, text) for text in texts]
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[start:start + LOOKUP_BATCH_SIZE]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update(rows)
+        return [
+            np.frombuffer(found[key], dtype="<f4").tolist() if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, model_name: str, texts: list[str], vectors) -> None:
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            array = np.asarray(vector, dtype="<f4")
+            rows.append((content_key(model_name, text), len(array), array.tobytes(), now))
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO embeddings (key, dim, vector, created_at) VALUES (?, ?, ?, ?)", rows)
+
+    def get_or_embed(self, model_name: str, texts: list[str], embed_fn) -> tuple[list[list[float]], int]:
+        """
+        Embeddings for the texts: stored ones are reused, the rest come from one
+        embed_fn(missing texts) call and are stored. Returns (vectors, store hits).
+        """
+        if not self.enabled or not texts:
+            return (embed_fn(texts) if texts else []), 0
+        vectors = self.get_many(model_name, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            fresh = dict(zip(missing, embed_fn(missing)))
+            self.put_many(model_name, missing, [fresh[text] for text in missing])
+            vectors = [vector if vector is not None else fresh[text] for text, vector in zip(texts, vectors)]
+        hits = len(texts) - len(missing)
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += len(missing)
+        return vectors, hits
+
+    def collect_garbage(self, live_keys: set[bytes], created_before: float) -> int:
+        """
+        Deletes entries whose key is not in live_keys. Entries created at or after
+        created_before are kept: they may belong to an index being built right now.
+        Returns the number of entries removed.
+        """
+        conn = self._connection()
+        dead = [
+            (key,) for key, created_at in conn.execute("SELECT key, created_at FROM embeddings")
+            if key not in live_keys and created_at < created_before
+        ]
+        if dead:
+            with conn:
+                conn.executemany("DELETE FROM embeddings WHERE key = ?", dead)
+            conn.execute("VACUUM") # Give the space back to the file system
+        return len(dead)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+        if self.enabled and os.path.exists(self.db_path):
+            entries, vector_bytes = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+            stats.update(entries=entries, vector_bytes=vector_bytes)
+        return stats
+
+
+# --- Process-wide embedding store ---
+embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH, enabled=EMBEDDING_STORE_ENABLED)
@@ -0,0 +1,97 @@
+# backend/api/index_lock.py
+import ctypes
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl # POSIX only; without it writes are only serialized within a process
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Lock file inside the index directory it protects
+WRITE_LOCK_FILENAME = ".write.lock"
+# Index directories are symlinks to versioned siblings named <path><VERSION_SEPARATOR><ns>;
+# a new version is swapped in by replacing the symlink (see swap_directory)
+VERSION_SEPARATOR = ".v-"
+# Names next to index directories that are not indexes themselves
+SWAP_ARTIFACT_MARKERS = (".staging", ".old-", VERSION_SEPARATOR, ".link-tmp")
+
+_RENAME_EXCHANGE = 2 # Linux renameat2() flag
+_AT_FDCWD = -100
+
+
+@contextmanager
+def write_lock(directory: str):
+    """
+    Serializes writes into an index directory across processes (backend workers adding
+    notes, populate_db.py copying or rebuilding it). Held with an exclusive flock.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, WRITE_LOCK_FILENAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def is_swap_artifact(name: str) -> bool:
+    """Whether a directory entry is a staging copy, old version or swap link rather than an index."""
+    return any(marker in name for marker in SWAP_ARTIFACT_MARKERS)
+
+
+def _exchange(path_a: str, path_b: str) -> bool:
+    """Atomically swaps two paths with renameat2(RENAME_EXCHANGE); False where that is unavailable."""
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (AttributeError, OSError):
+        return False
+    if renameat2(_AT_FDCWD, os.fsencode(path_a), _AT_FDCWD, os.fsencode(path_b), _RENAME_EXCHANGE) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path_b)
+    return True
+
+
+def swap_directory(new_path: str, live_path: str) -> None:
+    """
+    Makes live_path serve the directory at new_path in one atomic step. new_path is
+    renamed to a versioned sibling and live_path becomes (or stays) a symlink to it,
+    replaced with os.replace(), so a reader resolving live_path finds the old version
+    or the new one, never neither. Versions no longer linked are removed; processes
+    that still have files of one open keep reading them.
+    """
+    parent, name = os.path.split(live_path)
+    target = f"{live_path}{VERSION_SEPARATOR}{time.time_ns()}"
+    os.rename(new_path, target)
+    link_tmp = f"{live_path}.link-tmp"
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+    os.symlink(os.path.basename(target), link_tmp) # Relative, so the tree can be moved
+
+    if os.path.isdir(live_path) and not os.path.islink(live_path):
+        # A directory from before versioned swaps: exchange it with the link in one step
+        # where the kernel can, then it is an old version like any other
+        if _exchange(link_tmp, live_path):
+            shutil.rmtree(link_tmp, ignore_errors=True)
+        else:
+            logger.warning("Cannot swap %s atomically; converting it to a versioned directory", live_path)
+            legacy_path = f"{live_path}.old-{time.time_ns()}"
+            os.rename(live_path, legacy_path)
+            os.replace(link_tmp, live_path)
+            shutil.rmtree(legacy_path, ignore_errors=True)
+    else:
+        os.replace(link_tmp, live_path)
+
+    prefix = f"{name}{VERSION_SEPARATOR}"
+    current = os.path.basename(target)
+    for entry in os.listdir(parent or "."):
+        if entry.startswith(prefix) and entry != current:
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
@@ -0,0 +1,459 @@
+# backend/api/ingestion_jobs.py
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# SQLite file holding ingestion jobs; shared by all uvicorn workers on this machine, so any
+# worker can queue a job or report on it
+INGESTION_JOBS_DB_PATH = os.getenv("INGESTION_JOBS_DB_PATH", "ingestion_jobs.db")
+# Jobs each worker process runs at once (0 = this process only queues and reports jobs).
+# Every job uses populate_db.py's parse process pool and embedding rate limit, which are
+# per process: run_production.py sets 0 for its web workers and runs every job in one
+# run_ingestion_worker.py process instead, so they share a single limit.
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+# How often idle runners look for queued jobs and for jobs other workers finished
+INGESTION_POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", "2"))
+# Progress is written to the job table at most this often (stage changes right away)
+INGESTION_PROGRESS_INTERVAL_SECONDS = float(os.getenv("INGESTION_PROGRESS_INTERVAL_SECONDS", "1"))
+# How often a worker marks the jobs it is running as alive, whatever stage they are in
+INGESTION_HEARTBEAT_SECONDS = float(os.getenv("INGESTION_HEARTBEAT_SECONDS", "10"))
+# Running jobs without a heartbeat for this long are marked failed (their worker died)
+INGESTION_STALE_JOB_SECONDS = float(os.getenv("INGESTION_STALE_JOB_SECONDS", "120"))
+# How long IDs of jobs already swapped in are remembered, past the watcher's lookback
+SWAPPED_JOB_RETENTION_SECONDS = 60
+
+ACTIVE_STATES = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    classroom_id TEXT NOT NULL,
+    config TEXT NOT NULL, -- JSON: populate_db.py classroom config (name, curriculum_path, glob_pattern)
+    state TEXT NOT NULL, -- queued, running, succeeded, failed
+    progress TEXT NOT NULL DEFAULT '{}', -- JSON, see JobProgress
+    error TEXT,
+    worker TEXT, -- host:pid of the process running it
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL,
+    heartbeat_at REAL, -- last sign of life from the worker running it
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_state ON ingestion_jobs (state, classroom_id);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_classroom ON ingestion_jobs (classroom_id, id);
+"""
+
+
+class JobStore:
+    """
+    Ingestion jobs in SQLite (WAL mode). State changes run in IMMEDIATE transactions,
+    so two workers can never claim the same job or queue two jobs for a classroom.
+    Each thread gets its own connection.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(_SCHEMA)
+                    columns = {row["name"] for row in conn.execute("PRAGMA table_info(ingestion_jobs)")}
+                    if "heartbeat_at" not in columns: # Job table created before heartbeats
+                        conn.execute("ALTER TABLE ingestion_jobs ADD COLUMN heartbeat_at REAL")
+                    self._schema_ready = True
+        return conn
+
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    @staticmethod
+    def _to_dict(row) -> dict | None:
+        if row is None:
+            return None
+        job = dict(row)
+        job["config"] = json.loads(job["config"])
+        job["progress"] = json.loads(job["progress"])
+        return job
+
+    def enqueue(self, classroom_id: str, config: dict) -> tuple[dict, bool]:
+        """
+        Queues a job for the classroom, unless one is already queued or running.
+        Returns (job, created).
+        """
+        conn = self._transaction()
+        try:
+            existing = conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE classroom_id = ? AND state IN (?, ?) ORDER BY id LIMIT 1",
+                (classroom_id, *ACTIVE_STATES),
+            ).fetchone()
+            if existing is not None:
+                conn.execute("COMMIT")
+                return self._to_dict(existing), False
+            cursor = conn.execute(
+                "INSERT INTO ingestion_jobs (classroom_id, config, state, created_at) VALUES (?, ?, 'queued', ?)",
+                (classroom_id, json.dumps(config), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(cursor.lastrowid), True
+
+    def claim_next(self, worker: str) -> dict | None:
+        """
+        Marks the oldest queued job as running in this worker and returns it (None if there
+        is none). Jobs of a classroom another job is still running for wait their turn.
+        """
+        now = time.time()
+        conn = self._transaction()
+        try:
+            # Jobs whose worker stopped sending heartbeats are not coming back
+            conn.execute(
+                "UPDATE ingestion_jobs SET state = 'failed', error = 'Worker stopped responding', finished_at = ? "
+                "WHERE state = 'running' AND COALESCE(heartbeat_at, updated_at) < ?",
+                (now, now - INGESTION_STALE_JOB_SECONDS),
+            )
+            row = conn.execute(
+                "SELECT id FROM ingestion_jobs WHERE state = 'queued' AND classroom_id NOT IN "
+                "(SELECT classroom_id FROM ingestion_jobs WHERE state = 'running') ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE ingestion_jobs SET state = 'running', worker = ?, started_at = ?, updated_at = ?, "
+                    "heartbeat_at = ? WHERE id = ?",
+                    (worker, now, now, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row["id"]) if row is not None else None
+
+    # Progress, heartbeats and the final state are only written while the job is still
+    # running in this worker: once it was reaped as stale, its row belongs to nobody.
+    # Each returns whether the job was still this worker's.
+    def update_progress(self, job_id: int, worker: str, progress: dict) -> bool:
+        cursor = self._connection().execute(
+            "UPDATE ingestion_jobs SET progress = ?, updated_at = ? WHERE id = ? AND state = 'running' AND worker = ?",
+            (json.dumps(progress), time.time(), job_id, worker),
+        )
+        return cursor.rowcount > 0
+
+    def heartbeat(self, worker: str) -> int:
+        """Marks every job running in this worker as alive. Returns how many there are."""
+        cursor = self._connection().execute(
+            "UPDATE ingestion_jobs SET heartbeat_at = ? WHERE state = 'running' AND worker = ?",
+            (time.time(), worker),
+        )
+        return cursor.rowcount
+
+    def finish(self, job_id: int, worker: str, succeeded: bool, progress: dict, error: str | None = None) -> bool:
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE ingestion_jobs SET state = ?, progress = ?, error = ?, updated_at = ?, finished_at = ? "
+            "WHERE id = ? AND state = 'running' AND worker = ?",
+            ("succeeded" if succeeded else "failed", json.dumps(progress), error, now, now, job_id, worker),
+        )
+        return cursor.rowcount > 0
+
+    def get(self, job_id: int) -> dict | None:
+        row = self._connection().execute("SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def list_jobs(self, classroom_id: str | None = None, limit: int = 50) -> list[dict]:
+        """Most recent jobs first, optionally for one classroom."""
+        if classroom_id is None:
+            rows = self._connection().execute(
+                "SELECT * FROM ingestion_jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT * FROM ingestion_jobs WHERE classroom_id = ? ORDER BY id DESC LIMIT ?",
+                (classroom_id, limit)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def running_classrooms(self) -> set[str]:
+        rows = self._connection().execute(
+            "SELECT DISTINCT classroom_id FROM ingestion_jobs WHERE state = 'running'").fetchall()
+        return {row["classroom_id"] for row in rows}
+
+    def succeeded_since(self, since: float) -> list[dict]:
+        """(id, classroom_id) of jobs that succeeded at or after since."""
+        rows = self._connection().execute(
+            "SELECT id, classroom_id FROM ingestion_jobs WHERE state = 'succeeded' AND finished_at >= ?", (since,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class JobProgress:
+    """
+    Collects process_classroom's progress callbacks for one job and writes them to
+    the job store (throttled), adding elapsed time, embedding rate and an ETA. The
+    ETA extrapolates from the share of parse jobs done, since parsing and embedding
+    run as one pipeline.
+    """
+
+    def __init__(self, store: JobStore, job_id: int, worker: str):
+        self.store = store
+        self.job_id = job_id
+        self.worker = worker
+        self.started = time.monotonic()
+        self.fields = {}
+        self._embedding_started = None
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, **fields) -> None:
+        with self._lock:
+            stage_changed = "stage" in fields and fields["stage"] != self.fields.get("stage")
+            self.fields.update(fields)
+            if self._embedding_started is None and fields.get("chunks_embedded"):
+                self._embedding_started = time.monotonic()
+            now = time.monotonic()
+            if not stage_changed and now - self._last_write < INGESTION_PROGRESS_INTERVAL_SECONDS:
+                return
+            self._last_write = now
+            snapshot = self.snapshot_locked()
+        try:
+            self.store.update_progress(self.job_id, self.worker, snapshot)
+        except sqlite3.Error as e:
+            # Progress is informational; never fail the job over it
+            logger.warning("Could not record ingestion progress: %s", e)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return self.snapshot_locked()
+
+    def snapshot_locked(self) -> dict:
+        now = time.monotonic()
+        elapsed = now - self.started
+        progress = dict(self.fields, elapsed_seconds=round(elapsed, 1))
+        embedded = self.fields.get("chunks_embedded", 0)
+        if self._embedding_started is not None and embedded:
+            progress["embeddings_per_second"] = round(embedded / max(now - self._embedding_started, 1e-6), 1)
+        total, done = self.fields.get("parse_jobs_total"), self.fields.get("parse_jobs_done")
+        if total and done:
+            fraction = min(done / total, 1.0)
+            progress["fraction_done"] = round(fraction, 3)
+            progress["eta_seconds"] = round(elapsed * (1 - fraction) / fraction, 1)
+        return progress
+
+
+class JobRunner:
+    """
+    Runs queued ingestion jobs on INGESTION_WORKERS background threads of this
+    process (never on the request path), then swaps the rebuilt classroom into the
+    component cache. The same threads watch for jobs other workers are running or
+    have finished, so every process keeps serving a classroom's loaded components
+    while it is re-indexed and swaps in the new index once it is done.
+
+    With serving=False (run_ingestion_worker.py) the runner only runs jobs: the
+    process serves no classrooms, so there is nothing to hold or swap in.
+    """
+
+    def __init__(self, store: JobStore, workers: int, serving: bool = True):
+        self.store = store
+        self.workers = workers
+        self.serving = serving
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._own_classrooms = set()
+        self._other_classrooms = set()
+        self._swapped_job_ids = {} # job id -> when it was swapped in here (pruned by _watch_other_workers)
+        self._last_watch = time.time()
+        self.jobs_run = 0
+        self.jobs_failed = 0
+        self.swaps = 0
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        # One watcher even when this process runs no jobs itself
+        for index in range(max(self.workers, int(self.serving))):
+            thread = threading.Thread(target=self._loop, args=(index < self.workers,),
+                                      name=f"ingestion-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.workers:
+            thread = threading.Thread(target=self._heartbeat_loop, name="ingestion-heartbeat", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stops taking jobs; a job still running is abandoned (marked failed once it goes stale)."""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self) -> None:
+        """Hint that a job was queued in this process (runners otherwise poll)."""
+        self._wake.set()
+
+    def _wait(self) -> None:
+        self._wake.wait(INGESTION_POLL_SECONDS)
+        self._wake.clear()
+
+    def _loop(self, runs_jobs: bool) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.serving:
+                    self._watch_other_workers()
+                job = self.store.claim_next(self.worker_id) if runs_jobs else None
+            except sqlite3.Error as e:
+                logger.warning("Ingestion job store unavailable: %s", e)
+                job = None
+            if job is None:
+                self._wait()
+                continue
+            self._run(job)
+
+    def _heartbeat_loop(self) -> None:
+        """Keeps this worker's running jobs from being reaped, however long a stage takes."""
+        while not self._stop.wait(INGESTION_HEARTBEAT_SECONDS):
+            with self._lock:
+                running = self._running
+            if not running:
+                continue
+            try:
+                self.store.heartbeat(self.worker_id)
+            except sqlite3.Error as e:
+                logger.warning("Could not record ingestion heartbeat: %s", e)
+
+    def _run(self, job: dict) -> None:
+        from . import clients
+
+        classroom_id = job["classroom_id"]
+        progress = JobProgress(self.store, job["id"], self.worker_id)
+        with self._lock:
+            self._running += 1
+            self._own_classrooms.add(classroom_id)
+        self._publish_reindexing()
+        logger.info("Ingestion job %d started", job["id"], extra={"classroom_id": classroom_id})
+        succeeded, error = False, None
+        try:
+            import populate_db # Deferred: only processes that run a job need the ingestion pipeline
+
+            succeeded = populate_db.process_classroom(classroom_id, job["config"], clients.get_embeddings(),
+                                                      progress=progress.update)
+            if not succeeded:
+                error = "Indexing failed; the previous index is still in use. See the server log for details."
+            elif self.serving:
+                from . import services
+
+                progress.update(stage="reloading")
+                if services.swap_in_classroom(classroom_id):
+                    self.swaps += 1
+                with self._lock:
+                    self._swapped_job_ids[job["id"]] = time.time()
+        except Exception as e:
+            logger.exception("Ingestion job %d failed", job["id"], extra={"classroom_id": classroom_id})
+            succeeded, error = False, str(e) or type(e).__name__
+        finally:
+            self._release(classroom_id)
+        progress.update(stage="done" if succeeded else "failed")
+        if not self.store.finish(job["id"], self.worker_id, succeeded, progress.snapshot(), error):
+            logger.warning("Ingestion job %d was marked failed as stale while it ran; its result was not recorded",
+                           job["id"], extra={"classroom_id": classroom_id})
+        self.jobs_run += 1
+        self.jobs_failed += not succeeded
+        logger.info("Ingestion job %d %s", job["id"], "succeeded" if succeeded else "failed",
+                    extra={"classroom_id": classroom_id})
+
+    def _release(self, classroom_id: str) -> None:
+        """After a job: drops its classroom from the re-indexing set and, when idle, frees the pipeline's resources."""
+        with self._lock:
+            self._running -= 1
+            self._own_classrooms.discard(classroom_id)
+            idle = self._running == 0
+        self._publish_reindexing()
+        if idle:
+            import populate_db
+
+            # The parse processes and the shared index's write lock are not held between jobs
+            populate_db.shutdown_parse_pool()
+            populate_db.close_shared_vectorstore()
+
+    def _publish_reindexing(self, others: set[str] | None = None) -> None:
+        if not self.serving:
+            return
+        from . import services
+
+        with self._lock:
+            if others is not None:
+                self._other_classrooms = others
+            classrooms = self._own_classrooms | self._other_classrooms
+        services.set_reindexing_classrooms(classrooms)
+
+    def _watch_other_workers(self) -> None:
+        """Holds classrooms other workers are re-indexing, and swaps in the ones they finished."""
+        from . import services
+
+        since, self._last_watch = self._last_watch - INGESTION_POLL_SECONDS, time.time()
+        running = self.store.running_classrooms()
+        with self._lock:
+            # Jobs that finished before the lookback no longer come back from succeeded_since
+            cutoff = since - SWAPPED_JOB_RETENTION_SECONDS
+            self._swapped_job_ids = {job_id: at for job_id, at in self._swapped_job_ids.items() if at >= cutoff}
+        finished = [job for job in self.store.succeeded_since(since) if job["id"] not in self._swapped_job_ids]
+        # Keep holding the finished ones until they are swapped in here
+        self._publish_reindexing(running | {job["classroom_id"] for job in finished})
+        for job in finished:
+            with self._lock:
+                if job["id"] in self._swapped_job_ids:
+                    continue # Another watcher thread got here first
+                self._swapped_job_ids[job["id"]] = time.time()
+            try:
+                if services.swap_in_classroom(job["classroom_id"]):
+                    self.swaps += 1
+            except Exception as e:
+                logger.warning("Could not swap in re-indexed classroom: %s", e, extra={"classroom_id": job["classroom_id"]})
+        if finished:
+            self._publish_reindexing(running)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "jobs_run": self.jobs_run,
+                "jobs_failed": self.jobs_failed,
+                "swaps": self.swaps,
+            }
+
+
+def default_classroom_config(classroom_id: str) -> dict | None:
+    """The classroom's entry in populate_db.py's CLASSROOMS, if it has one."""
+    import populate_db # Light to import; the ingestion pipeline's own imports are deferred
+
+    return populate_db.CLASSROOMS.get(classroom_id)
+
+
+# --- Process-wide job store and runner ---
+job_store = JobStore(INGESTION_JOBS_DB_PATH)
+job_runner = JobRunner(job_store, INGESTION_WORKERS)
@@ -0,0 +1,141 @@
+# backend/api/lexical_index.py
+import os
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+# --- Configuration ---
+# Written by populate_db.py next to each classroom's Chroma files
+LEXICAL_INDEX_FILENAME = "lexical_index.npz"
+LEXICAL_INDEX_VERSION = 1
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Section numbers ("3.2.1") stay one token; otherwise runs of letters, digits and the
+# combining marks Indic scripts (Tamil, Devanagari, ...) use inside words
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)+|[\w\u0300-\u036f\u0900-\u0dff]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Case-folded word tokens; works for Tamil as well as English text."""
+    return _TOKEN_RE.findall(unicodedata.normalize("NFC", text).casefold())
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over a classroom's chunks, stored as flat numpy arrays:
+    sorted terms, offsets into one postings list of (document, term frequency).
+    Documents are identified by their Chroma chunk IDs.
+    """
+
+    def __init__(self, doc_ids, doc_lengths, terms, term_offsets, postings_docs, postings_tf):
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths.astype(np.float32)
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf.astype(np.float32)
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+        self._length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(self.avg_doc_length, 1e-9))
+
+    @property
+    def size(self) -> int:
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, documents) -> "LexicalIndex":
+        """Builds the index from an iterable of (chunk_id, text) pairs."""
+        doc_ids, doc_lengths = [], []
+        postings: dict[str, list[tuple[int, int]]] = {}
+        for doc_index, (doc_id, text) in enumerate(documents):
+            counts = Counter(tokenize(text or ""))
+            doc_ids.append(doc_id)
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_index, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+        docs = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.int32)
+        for i, term in enumerate(terms):
+            entries = postings[term]
+            docs[offsets[i]:offsets[i + 1]] = [doc for doc, _ in entries]
+            tfs[offsets[i]:offsets[i + 1]] = [tf for _, tf in entries]
+        return cls(np.array(doc_ids, dtype=str), np.array(doc_lengths, dtype=np.int32),
+                   np.array(terms, dtype=str), offsets, docs, tfs)
+
+    def save(self, directory: str) -> None:
+        """Writes the index atomically into a classroom DB directory."""
+        path = os.path.join(directory, LEXICAL_INDEX_FILENAME)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            version=np.array(LEXICAL_INDEX_VERSION),
+            doc_ids=self.doc_ids,
+            doc_lengths=self.doc_lengths.astype(np.int32),
+            terms=self.terms,
+            term_offsets=self.term_offsets,
+            postings_docs=self.postings_docs,
+            postings_tf=self.postings_tf.astype(np.int32),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, directory: str) -> "LexicalIndex | None":
+        """Loads a classroom's index, or returns None if it has none (or an outdated one)."""
+        path = os.path.join(directory, LEXICAL_INDEX_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != LEXICAL_INDEX_VERSION:
+                return None
+            return cls(data["doc_ids"], data["doc_lengths"], data["terms"], data["term_offsets"],
+                       data["postings_docs"], data["postings_tf"])
+
+    def search(self, query: str, top_n: int) -> list[tuple[str, float]]:
+        """Returns up to top_n (chunk_id, BM25 score) pairs, best first."""
+        if not self.size:
+            return []
+        scores = np.zeros(self.size, dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            position = int(np.searchsorted(self.terms, term))
+            if position >= len(self.terms) or self.terms[position] != term:
+                continue
+            start, end = self.term_offsets[position], self.term_offsets[position + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            df = end - start
+            idf = np.log(1.0 + (self.size - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + self._length_norm[docs])
+            matched = True
+        if not matched:
+            return []
+        top_n = min(top_n, int(np.count_nonzero(scores)))
+        best = np.argpartition(-scores, top_n - 1)[:top_n]
+        best = best[np.argsort(-scores[best])]
+        return [(str(self.doc_ids[i]), float(scores[i])) for i in best]
+
+
+def build_from_collection(collection, page_size: int = 1000, where: dict | None = None) -> LexicalIndex:
+    """
+    Builds the lexical index from every chunk stored in a Chroma collection, page by page
+    (only the chunks matching where, e.g. one classroom of the shared index, if given).
+    """
+
+    def documents():
+        offset = 0
+        while True:
+            page = collection.get(where=where, include=["documents"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                return
+            yield from zip(page["ids"], page["documents"])
+            offset += len(page["ids"])
+
+    return LexicalIndex.build(documents())
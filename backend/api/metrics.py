@@ -0,0 +1,296 @@
+# backend/api/metrics.py
+import bisect
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Share of RAG requests profiled stage by stage (0 disables, 1 profiles every request)
+RAG_PROFILE_SAMPLE_RATE = float(os.getenv("RAG_PROFILE_SAMPLE_RATE", "0.1"))
+
+# Distinct classroom label values kept; later ones are reported as "other".
+# Classroom IDs come from requests, so this bounds the series an attacker can create.
+RAG_METRICS_MAX_CLASSROOMS = int(os.getenv("RAG_METRICS_MAX_CLASSROOMS", "200"))
+
+# Latency buckets in seconds, from cache hits (~1 ms) to slow LLM answers
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+_seen_classrooms: set = set()
+_seen_classrooms_lock = threading.Lock()
+
+
+def _classroom_label(classroom_id: str) -> str:
+    if classroom_id in _seen_classrooms:
+        return classroom_id
+    with _seen_classrooms_lock:
+        if len(_seen_classrooms) < RAG_METRICS_MAX_CLASSROOMS:
+            _seen_classrooms.add(classroom_id)
+            return classroom_id
+    return "other"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(
+            _classroom_label(str(labels.get(name, ""))) if name == "classroom" else str(labels.get(name, ""))
+            for name in self.labelnames
+        )
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {} # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {state[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors = [] # Callables refreshing gauges right before a scrape
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                logger.exception("Metrics collector failed")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- RAG pipeline metrics ---
+REQUESTS = registry.register(Counter(
+    "rag_requests_total", "RAG requests by classroom, endpoint and outcome.", ("classroom", "endpoint", "outcome")))
+ERRORS = registry.register(Counter(
+    "rag_errors_total", "RAG failures by classroom and stage.", ("classroom", "stage")))
+REQUEST_SECONDS = registry.register(Histogram(
+    "rag_request_seconds", "End-to-end RAG request latency.", ("classroom", "endpoint")))
+STAGE_SECONDS = registry.register(Histogram(
+    "rag_stage_seconds", "Time spent per pipeline stage (per-request stages only on profiled requests).", ("classroom", "stage")))
+ANSWER_CACHE = registry.register(Counter(
+    "rag_answer_cache_total", "Answer cache lookups by result (exact, similar, miss).", ("classroom", "result")))
+IN_FLIGHT = registry.register(Gauge(
+    "rag_in_flight_requests", "RAG requests currently being processed.", ("classroom",)))
+COALESCED = registry.register(Counter(
+    "rag_coalesced_requests_total", "Requests answered by waiting on an identical in-flight question.", ("classroom",)))
+CONTEXT_TOKENS = registry.register(Counter(
+    "rag_context_tokens_total", "Estimated tokens of retrieved text (retrieved) and of the context sent to the LLM (sent).", ("classroom", "kind")))
+DEPENDENCY_CALLS = registry.register(Counter(
+    "rag_dependency_calls_total", "Embedding and LLM call attempts by result (ok, error, timeout, rejected, hedged, circuit_open).", ("dependency", "result")))
+DEGRADED = registry.register(Counter(
+    "rag_degraded_total", "Questions answered in degraded mode because a backend failed, by fallback used.", ("classroom", "fallback")))
+PROFILED = registry.register(Counter(
+    "rag_profiled_requests_total", "Requests profiled stage by stage.", ("classroom",)))
+QUEUE_WAIT_SECONDS = registry.register(Histogram(
+    "rag_queue_wait_seconds", "Time admitted requests waited for an execution slot.", ("classroom", "priority")))
+SHED = registry.register(Counter(
+    "rag_shed_requests_total", "Requests rejected by admission control, by reason (queue_full, slo, rate_limited, timeout).", ("classroom", "reason")))
+CLASSROOM_QUEUE = registry.register(Gauge(
+    "rag_classroom_queue", "Per-classroom requests running and waiting for a slot, and the oldest wait in seconds.", ("classroom", "field")))
+
+
+# --- Sampled per-stage profiling ---
+# The active request's profile; retrieval code running in worker threads sees it
+# because LangChain copies the context into its executor threads.
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("rag_profile", default=None)
+
+
+class RequestProfile:
+    """Stage timings of one sampled request."""
+
+    def __init__(self, classroom_id: str):
+        self.classroom_id = classroom_id
+        self.stages: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self) -> None:
+        """Publishes the stage timings to the stage histogram."""
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, classroom=self.classroom_id, stage=stage)
+        PROFILED.inc(classroom=self.classroom_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("RAG request profile", extra={"classroom_id": self.classroom_id,
+                                                       "stages_ms": {k: round(v * 1000, 2) for k, v in self.stages.items()}})
+
+
+@contextmanager
+def profiled_request(classroom_id: str):
+    """
+    Profiles the enclosed request if it is sampled (see RAG_PROFILE_SAMPLE_RATE).
+    Yields the callbacks to pass in the chain's RunnableConfig (empty when not sampled).
+    """
+    if RAG_PROFILE_SAMPLE_RATE <= 0 or random.random() >= RAG_PROFILE_SAMPLE_RATE:
+        yield []
+        return
+    from .profiling import StageTimingCallback # Imports LangChain; only needed once a request is sampled
+
+    profile = RequestProfile(classroom_id)
+    token = _current_profile.set(profile)
+    try:
+        yield [StageTimingCallback(profile)]
+        profile.finish()
+    finally:
+        try:
+            _current_profile.reset(token)
+        except ValueError:
+            pass # Generator finished in another context; nothing to restore there
+
+
+@contextmanager
+def stage(name: str):
+    """Times a stage of the current request if it is being profiled; a no-op otherwise."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+@contextmanager
+def timed_stage(classroom_id: str, name: str):
+    """Always-on timing for coarse, per-request stages (cache lookups, component initialization)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, classroom=classroom_id, stage=name)
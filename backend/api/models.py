@@ -1,4 +1,6 @@
 # backend/api/models.py
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
 # Defines the expected structure for requests to the /api/ask endpoint
@@ -6,6 +8,7 @@ class QueryRequest(BaseModel):
     query: str = Field(..., description="The question asked by the user.")
     # Add classroom_id for MVP2
     classroom_id: str = Field(..., description="The unique identifier for the classroom context.")
+    role: Literal["student", "teacher"] = Field("student", description="Who is asking; teachers' questions are scheduled ahead of students'.")
 
 # Defines the structure for responses from the /api/ask endpoint
 class AnswerResponse(BaseModel):
@@ -13,6 +16,25 @@ class AnswerResponse(BaseModel):
     # Future enhancement: Add sources used for the answer
     # sources: list[dict] = Field([], description="List of source document snippets used for the answer.")
 
+# --- Batch questions (worksheets, quizzes) for the /api/ask/batch endpoint ---
+MAX_BATCH_QUESTIONS = 100
+
+class BatchQueryRequest(BaseModel):
+    classroom_id: str = Field(..., description="The unique identifier for the classroom context.")
+    queries: list[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUESTIONS, description="The questions, answered in this order.")
+    role: Literal["student", "teacher"] = Field("student", description="Who is asking; teachers' questions are scheduled ahead of students'.")
+
+class BatchAnswerItem(BaseModel):
+    index: int = Field(..., description="Position of the question in the request.")
+    query: str = Field(..., description="The question as it was asked.")
+    answer: str = Field(..., description="The answer generated by the RAG pipeline.")
+    cached: bool = Field(False, description="True if the answer came from the answer cache.")
+    degraded: bool = Field(False, description="True if the LLM was unavailable and an older cached answer or the source passages were sent instead.")
+    error: bool = Field(False, description="True if this question could not be answered.")
+
+class BatchAnswerResponse(BaseModel):
+    answers: list[BatchAnswerItem] = Field(..., description="One answer per question, in request order.")
+
 # --- MVP2: Add models for the new Notes endpoint ---
 
 # Defines the structure for requests to add a note
@@ -24,5 +46,35 @@ class AddNoteRequest(BaseModel):
 class AddNoteResponse(BaseModel):
     message: str = Field(..., description="Confirmation message.")
     classroom_id: str = Field(..., description="The ID of the classroom the note was added to.")
-    note_id: int | str = Field(..., description="A unique identifier for the newly added note (e.g., timestamp or index).") # Example ID
+    note_id: int = Field(..., description="A unique, monotonically increasing identifier for the newly added note.")
 
+# --- Classroom catalog for the /api/classrooms endpoint ---
+class ClassroomInfo(BaseModel):
+    classroom_id: str = Field(..., description="The unique identifier for the classroom context.")
+    name: str = Field(..., description="Display name of the classroom.")
+    updated_at: float | None = Field(None, description="When the classroom's index was last updated (Unix time).")
+    files: int = Field(0, description="Number of curriculum files indexed.")
+
+
+# --- Ingestion jobs (re-indexing a classroom from the API) ---
+
+class IngestRequest(BaseModel):
+    # All optional: classrooms defined in populate_db.py's CLASSROOMS use that entry
+    name: str | None = Field(None, description="Display name of the classroom.")
+    curriculum_path: str | None = Field(None, description="Folder of the classroom's documents, relative to the documents root.")
+    glob_pattern: str | None = Field(None, description="Files to index within curriculum_path, e.g. \"**/*.pdf\".")
+
+class IngestionJob(BaseModel):
+    id: int = Field(..., description="Job ID.")
+    classroom_id: str = Field(..., description="The classroom being indexed.")
+    state: str = Field(..., description="queued, running, succeeded or failed.")
+    progress: dict = Field({}, description="Stage, file and chunk counts, embeddings per second and ETA in seconds.")
+    error: str | None = Field(None, description="Why the job failed.")
+    created_at: float = Field(..., description="When the job was queued (Unix time).")
+    started_at: float | None = Field(None, description="When a worker started it.")
+    finished_at: float | None = Field(None, description="When it succeeded or failed.")
+
+class IngestResponse(BaseModel):
+    message: str = Field(..., description="Confirmation message.")
+    created: bool = Field(..., description="False if a job for this classroom was already queued or running (that job is returned).")
+    job: IngestionJob = Field(..., description="The classroom's ingestion job.")
@@ -0,0 +1,98 @@
+# backend/api/notes_store.py
+import os
+import sqlite3
+import threading
+import time
+
+# --- Configuration ---
+# SQLite file holding teacher notes; shared by all uvicorn workers on this machine
+NOTES_DB_PATH = os.getenv("NOTES_DB_PATH", "notes.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, -- AUTOINCREMENT: IDs only ever grow, never reused
+    classroom_id TEXT NOT NULL,
+    note_text TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    indexed_at REAL -- Set once the note is embedded into the classroom's vector store
+);
+CREATE INDEX IF NOT EXISTS idx_notes_classroom ON notes (classroom_id, id);
+"""
+
+
+class NotesStore:
+    """
+    Durable notes storage in SQLite (WAL mode, so readers never block the writer).
+    Each thread gets its own connection.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(_SCHEMA)
+                    self._schema_ready = True
+        return conn
+
+    def add_note(self, classroom_id: str, note_text: str) -> int:
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO notes (classroom_id, note_text, created_at) VALUES (?, ?, ?)",
+                (classroom_id, note_text, time.time()),
+            )
+        return cursor.lastrowid
+
+    def list_notes(self, classroom_id: str, limit: int = 50, after_id: int | None = None) -> list[dict]:
+        """Returns up to `limit` notes in ID order, starting after `after_id` (keyset pagination)."""
+        rows = self._connection().execute(
+            "SELECT id, note_text, created_at FROM notes WHERE classroom_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (classroom_id, after_id or 0, limit),
+        ).fetchall()
+        return [{"id": row["id"], "text": row["note_text"], "created_at": row["created_at"]} for row in rows]
+
+    def all_notes(self, classroom_id: str) -> list[dict]:
+        """Every note of a classroom (used to sync them into the vector store)."""
+        rows = self._connection().execute(
+            "SELECT id, note_text FROM notes WHERE classroom_id = ? ORDER BY id",
+            (classroom_id,),
+        ).fetchall()
+        return [{"id": row["id"], "text": row["note_text"]} for row in rows]
+
+    def count_notes(self, classroom_id: str) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM notes WHERE classroom_id = ?", (classroom_id,)
+        ).fetchone()[0]
+
+    def mark_indexed(self, note_ids: list[int]) -> None:
+        if not note_ids:
+            return
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "UPDATE notes SET indexed_at = ? WHERE id = ? AND indexed_at IS NULL",
+                [(time.time(), note_id) for note_id in note_ids],
+            )
+
+    def indexed_version(self, classroom_id: str) -> int:
+        """Highest note ID already embedded for a classroom; changes whenever new notes get indexed."""
+        row = self._connection().execute(
+            "SELECT MAX(id) FROM notes WHERE classroom_id = ? AND indexed_at IS NOT NULL", (classroom_id,)
+        ).fetchone()
+        return row[0] or 0
+
+
+# --- Process-wide notes store ---
+notes_store = NotesStore(NOTES_DB_PATH)
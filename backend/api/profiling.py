@@ -0,0 +1,63 @@
+# backend/api/profiling.py
+# LangChain callback used by metrics.profiled_request(); kept apart from metrics.py so
+# importing the metrics doesn't import LangChain.
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .metrics import RequestProfile
+
+
+class StageTimingCallback(BaseCallbackHandler):
+    """Times the LCEL stages of a profiled request (retriever, context formatting, prompt, LLM)."""
+
+    _CHAIN_STAGES = {"PromptTemplate": "prompt", "StrOutputParser": "output_parser"}
+    run_inline = True # Called on the request's own thread/loop, so timings stay accurate
+
+    def __init__(self, profile: RequestProfile):
+        self.profile = profile
+        self._starts: dict = {}
+
+    def _start(self, run_id, stage):
+        if stage:
+            self._starts[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id):
+        started = self._starts.pop(run_id, None)
+        if started:
+            stage, start = started
+            self.profile.add(stage, time.perf_counter() - start)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, name=None, **kwargs):
+        stage_name = name or (serialized or {}).get("name")
+        self._start(run_id, self._CHAIN_STAGES.get(stage_name))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+        self._starts[("first_token", run_id)] = ("llm_first_token", time.perf_counter())
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        self._end(("first_token", run_id))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._starts.pop(("first_token", run_id), None)
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(("first_token", run_id), None)
+        self._end(run_id)
@@ -0,0 +1,486 @@
+# backend/api/resilience.py
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from . import metrics
+from .concurrency import ServiceOverloadedError
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Deadlines per attempt (0 disables): one embedding request, one LLM answer, and the
+# first streamed token. Retrieval as a whole (embedding + search) has its own deadline.
+RAG_EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("RAG_EMBEDDING_TIMEOUT_SECONDS", "5"))
+RAG_RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RAG_RETRIEVAL_TIMEOUT_SECONDS", "10"))
+RAG_LLM_TIMEOUT_SECONDS = float(os.getenv("RAG_LLM_TIMEOUT_SECONDS", "20"))
+RAG_LLM_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv("RAG_LLM_FIRST_TOKEN_TIMEOUT_SECONDS", "10"))
+# Total time a question may spend on LLM attempts, retries included (0 = attempts * timeout)
+RAG_LLM_DEADLINE_SECONDS = float(os.getenv("RAG_LLM_DEADLINE_SECONDS", "30"))
+# Retries after a failed or timed-out attempt; backoff is exponential with full jitter
+RAG_RETRY_ATTEMPTS = int(os.getenv("RAG_RETRY_ATTEMPTS", "2"))
+RAG_RETRY_BASE_DELAY_SECONDS = float(os.getenv("RAG_RETRY_BASE_DELAY_SECONDS", "0.2"))
+RAG_RETRY_MAX_DELAY_SECONDS = float(os.getenv("RAG_RETRY_MAX_DELAY_SECONDS", "2"))
+# Hedged LLM requests: when an answer takes longer than this percentile of recent
+# answers, a second identical request is sent and whichever finishes first is used
+RAG_HEDGE_ENABLED = os.getenv("RAG_HEDGE_ENABLED", "false").lower() == "true"
+RAG_HEDGE_PERCENTILE = float(os.getenv("RAG_HEDGE_PERCENTILE", "95"))
+# Answers observed before hedging starts (the percentile is meaningless before that)
+RAG_HEDGE_MIN_SAMPLES = int(os.getenv("RAG_HEDGE_MIN_SAMPLES", "20"))
+# Circuit breaker: it opens when at least RAG_BREAKER_MIN_FAILURES of the last
+# RAG_BREAKER_WINDOW attempts failed and they make up RAG_BREAKER_FAILURE_RATIO of
+# them (0 failures disables it), and stays open this long before one trial request
+RAG_BREAKER_MIN_FAILURES = int(os.getenv("RAG_BREAKER_MIN_FAILURES", "5"))
+RAG_BREAKER_FAILURE_RATIO = float(os.getenv("RAG_BREAKER_FAILURE_RATIO", "0.5"))
+RAG_BREAKER_WINDOW = int(os.getenv("RAG_BREAKER_WINDOW", "20"))
+RAG_BREAKER_RESET_SECONDS = float(os.getenv("RAG_BREAKER_RESET_SECONDS", "30"))
+# Recent successful call latencies kept per dependency (for the hedging percentile)
+LATENCY_WINDOW = 200
+
+# HTTP-style status codes (google.api_core exceptions carry one as .code) worth retrying
+_RETRYABLE_CODES = frozenset({408, 429, 500, 502, 503, 504})
+# Backend errors worth retrying, matched by class name (anywhere in the class hierarchy) so
+# google.api_core, grpc and HTTP client exceptions are recognized without importing them
+_RETRYABLE_ERROR_NAMES = frozenset({
+    "ServiceUnavailable", "DeadlineExceeded", "ResourceExhausted", "InternalServerError",
+    "TooManyRequests", "GatewayTimeout", "BadGateway", "RetryError", "TransportError",
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "ReadError", "RemoteProtocolError", "gaierror",
+})
+
+# Sync calls with a deadline run here, so the caller can give up on a hung request;
+# the abandoned call finishes (or fails) in the background
+_deadline_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="rag-deadline")
+
+
+class CircuitOpenError(ServiceOverloadedError):
+    """
+    Raised instead of calling a backend whose circuit breaker is open. Routes that
+    don't degrade answer it like any overload: 503 with Retry-After.
+    """
+
+    def __init__(self, dependency: str, retry_after: float):
+        retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"The {dependency} backend is unavailable. Please retry in {retry_after}s.", retry_after)
+        self.dependency = dependency
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    True if a failed call may succeed when retried: timeouts, network errors and the
+    backend's overload and server errors. Anything else (bugs, bad requests, local
+    storage errors) is permanent, so it surfaces as an error instead of a degraded answer.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    # asyncio and concurrent.futures timeouts are TimeoutError too (Python 3.11+)
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, FutureTimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in _RETRYABLE_CODES:
+        return True
+    return any(cls.__name__ in _RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def is_dependency_failure(error: BaseException) -> bool:
+    """True if a backend (not the request) failed: the service should degrade rather than error."""
+    return isinstance(error, CircuitOpenError) or is_transient(error)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a backend once most recent attempts failed (min_failures of the
+    last window attempts, at least failure_ratio of them), so requests fail fast
+    instead of each waiting out a timeout. After reset_seconds one trial call is let
+    through (half open): success closes the breaker, failure opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, name: str, min_failures: int = RAG_BREAKER_MIN_FAILURES,
+                 failure_ratio: float = RAG_BREAKER_FAILURE_RATIO, window: int = RAG_BREAKER_WINDOW,
+                 reset_seconds: float = RAG_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.min_failures = min_failures
+        self.failure_ratio = failure_ratio
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._outcomes = deque(maxlen=max(window, min_failures, 1)) # True = failed
+        self._opened_at = 0.0
+        self._trial_started_at = None
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError if the call must not be made right now."""
+        if self.min_failures <= 0:
+            return
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            now = time.monotonic()
+            waited = now - self._opened_at
+            if self._state == self.OPEN and waited >= self.reset_seconds:
+                self._state = self.HALF_OPEN
+                self._trial_started_at = None
+            if self._state == self.HALF_OPEN:
+                # One trial at a time; a trial whose caller vanished doesn't block forever
+                if self._trial_started_at is None or now - self._trial_started_at >= self.reset_seconds:
+                    self._trial_started_at = now
+                    return
+            self.rejected += 1
+            retry_after = self.reset_seconds - waited
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit breaker closed for %s", self.name)
+                self._outcomes.clear()
+            self._state = self.CLOSED
+            self._outcomes.append(False)
+            self._trial_started_at = None
+
+    def record_failure(self) -> None:
+        if self.min_failures <= 0:
+            return
+        with self._lock:
+            self._outcomes.append(True)
+            failures = sum(self._outcomes)
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and failures >= self.min_failures
+                    and failures >= self.failure_ratio * len(self._outcomes)):
+                logger.warning("Circuit breaker opened for %s (%d of the last %d attempts failed)",
+                               self.name, failures, len(self._outcomes))
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_started_at = None
+                self.opened += 1
+
+    def stats(self) -> dict:
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "recent_failures": sum(self._outcomes),
+                "recent_attempts": len(self._outcomes),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class CallPolicy:
+    """
+    Deadline, retries with jittered exponential backoff, optional hedging, and a
+    circuit breaker around the calls to one backend (the LLM or the embedding model).
+    acall() and astream() are for async callers, call() for blocking ones (no hedging).
+    """
+
+    def __init__(self, name: str, timeout: float, retries: int, breaker: CircuitBreaker,
+                 base_delay: float = RAG_RETRY_BASE_DELAY_SECONDS, max_delay: float = RAG_RETRY_MAX_DELAY_SECONDS,
+                 deadline: float = 0.0, hedge: bool = False, hedge_percentile: float = RAG_HEDGE_PERCENTILE,
+                 hedge_min_samples: int = RAG_HEDGE_MIN_SAMPLES):
+        self.name = name
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.breaker = breaker
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # --- Bookkeeping ---
+    def _record(self, result: str) -> None:
+        metrics.DEPENDENCY_CALLS.inc(dependency=self.name, result=result)
+
+    def _admit(self) -> None:
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self._record("circuit_open")
+            raise
+
+    def _succeeded(self, seconds: float) -> None:
+        self.breaker.record_success()
+        with self._lock:
+            self._latencies.append(seconds)
+        self._record("ok")
+
+    def _failed(self, error: BaseException) -> bool:
+        """Counts a failed attempt; returns True if it may be retried."""
+        if not is_transient(error):
+            # The backend answered (e.g. rejected the request), so it is not unhealthy
+            self.breaker.record_success()
+            self._record("rejected")
+            return False
+        self.breaker.record_failure()
+        timed_out = isinstance(error, TimeoutError)
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.failures += 1
+        self._record("timeout" if timed_out else "error")
+        return True
+
+    def _backoff(self, attempt: int) -> float:
+        with self._lock:
+            return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _attempt_timeout(self, give_up_at: float | None) -> float | None:
+        """This attempt's timeout, cut short by the overall deadline; None means no limit."""
+        timeout = self.timeout or None
+        if give_up_at is not None:
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{self.name} deadline of {self.deadline}s exceeded")
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    def _may_retry(self, attempt: int, give_up_at: float | None, delay: float) -> bool:
+        if attempt >= self.retries:
+            return False
+        return give_up_at is None or time.monotonic() + delay < give_up_at
+
+    def hedge_delay(self) -> float | None:
+        """Seconds after which a hedged request is sent, or None while hedging is off."""
+        if not self.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    # --- Async calls ---
+    async def acall(self, fn):
+        """Awaits fn() (a coroutine factory) with the policy applied; returns its result or raises."""
+        give_up_at = time.monotonic() + self.deadline if self.deadline else None
+        with self._lock:
+            self.calls += 1
+        attempt = 0
+        while True:
+            self._admit()
+            timeout = self._attempt_timeout(give_up_at)
+            started = time.monotonic()
+            try:
+                result = await self._ahedged(fn, timeout)
+            except Exception as e:
+                delay = self._backoff(attempt)
+                if not self._failed(e) or not self._may_retry(attempt, give_up_at, delay):
+                    raise
+                logger.info("%s call failed (%s), retrying in %.2fs", self.name, str(e) or type(e).__name__, delay)
+                with self._lock:
+                    self.retried += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded(time.monotonic() - started)
+            return result
+
+    async def _ahedged(self, fn, timeout: float | None):
+        """One attempt: fn() under the timeout, plus a second fn() if it runs past the hedge delay."""
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is None:
+            try:
+                return await asyncio.wait_for(fn(), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"{self.name} call timed out after {timeout:.1f}s")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        hedge_at = loop.time() + hedge_delay
+        pending = {asyncio.ensure_future(fn())}
+        backup = None
+        error = None
+        try:
+            while pending:
+                wake_at = hedge_at if deadline is None else deadline if hedge_at is None else min(hedge_at, deadline)
+                wait = None if wake_at is None else max(0.0, wake_at - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                now = loop.time()
+                if deadline is not None and now >= deadline:
+                    raise TimeoutError(f"{self.name} call timed out after {timeout:.1f}s")
+                if hedge_at is not None and now >= hedge_at and pending:
+                    hedge_at = None
+                    backup = asyncio.ensure_future(fn())
+                    pending.add(backup)
+                    with self._lock:
+                        self.hedges += 1
+                    self._record("hedged")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def astream(self, fn, first_item_timeout: float | None = None):
+        """
+        Iterates fn() (an async iterator factory) with the policy applied. Attempts are
+        retried until the first item arrives (within first_item_timeout); after that a
+        failure is raised to the caller, who has already received part of the stream.
+        """
+        give_up_at = time.monotonic() + self.deadline if self.deadline else None
+        with self._lock:
+            self.calls += 1
+        attempt = 0
+        while True:
+            self._admit()
+            timeout = self._attempt_timeout(give_up_at)
+            if first_item_timeout:
+                timeout = first_item_timeout if timeout is None else min(timeout, first_item_timeout)
+            started = time.monotonic()
+            iterator = fn().__aiter__()
+            try:
+                try:
+                    first = await asyncio.wait_for(iterator.__anext__(), timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"{self.name} sent nothing within {timeout:.1f}s")
+            except StopAsyncIteration:
+                self._succeeded(time.monotonic() - started)
+                return
+            except Exception as e:
+                await _aclose(iterator)
+                delay = self._backoff(attempt)
+                if not self._failed(e) or not self._may_retry(attempt, give_up_at, delay):
+                    raise
+                logger.info("%s stream failed (%s), retrying in %.2fs", self.name, str(e) or type(e).__name__, delay)
+                with self._lock:
+                    self.retried += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            break
+
+        try:
+            yield first
+            # The rest of the stream shares the attempt's timeout
+            finish_by = started + self.timeout if self.timeout else None
+            while True:
+                wait = None if finish_by is None else max(0.0, finish_by - time.monotonic())
+                try:
+                    item = await asyncio.wait_for(iterator.__anext__(), wait)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"{self.name} stream timed out after {self.timeout:.1f}s")
+                yield item
+        except Exception as e:
+            self._failed(e)
+            raise
+        finally:
+            await _aclose(iterator)
+        self._succeeded(time.monotonic() - started)
+
+    # --- Blocking calls ---
+    def call(self, fn):
+        """Calls fn() with the policy applied (deadlines via a helper thread); returns its result or raises."""
+        give_up_at = time.monotonic() + self.deadline if self.deadline else None
+        with self._lock:
+            self.calls += 1
+        attempt = 0
+        while True:
+            self._admit()
+            timeout = self._attempt_timeout(give_up_at)
+            started = time.monotonic()
+            try:
+                result = self._call_with_timeout(fn, timeout)
+            except Exception as e:
+                delay = self._backoff(attempt)
+                if not self._failed(e) or not self._may_retry(attempt, give_up_at, delay):
+                    raise
+                logger.info("%s call failed (%s), retrying in %.2fs", self.name, str(e) or type(e).__name__, delay)
+                with self._lock:
+                    self.retried += 1
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._succeeded(time.monotonic() - started)
+            return result
+
+    def _call_with_timeout(self, fn, timeout: float | None):
+        if timeout is None:
+            return fn()
+        # Copy the context so profiling (metrics.stage) still sees the request
+        future = _deadline_executor.submit(contextvars.copy_context().run, fn)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"{self.name} call timed out after {timeout:.1f}s")
+
+    def stats(self) -> dict:
+        hedge_delay = self.hedge_delay()
+        with self._lock:
+            stats = {
+                "calls": self.calls,
+                "retried": self.retried,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_delay_ms": round(hedge_delay * 1000, 1) if hedge_delay is not None else None,
+            }
+        stats["breaker"] = self.breaker.stats()
+        return stats
+
+
+async def _aclose(iterator) -> None:
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception:
+            pass
+
+
+# --- Process-wide policies for the Vertex AI backends ---
+llm_policy = CallPolicy(
+    "llm",
+    timeout=RAG_LLM_TIMEOUT_SECONDS,
+    retries=RAG_RETRY_ATTEMPTS,
+    breaker=CircuitBreaker("llm"),
+    deadline=RAG_LLM_DEADLINE_SECONDS,
+    hedge=RAG_HEDGE_ENABLED,
+)
+embedding_policy = CallPolicy(
+    "embeddings",
+    timeout=RAG_EMBEDDING_TIMEOUT_SECONDS,
+    retries=RAG_RETRY_ATTEMPTS,
+    breaker=CircuitBreaker("embeddings"),
+)
+
+
+def stats() -> dict:
+    return {"llm": llm_policy.stats(), "embeddings": embedding_policy.stats()}
@@ -0,0 +1,280 @@
+# backend/api/retrieval.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from . import metrics
+from .batching import MicroBatcher
+from .embedding_store import embedding_store
+from .resilience import embedding_policy
+from .vector_index import MmapVectorStore
+
+# --- Configuration ---
+# Query embeddings kept in memory (shared by all classrooms, same model everywhere)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+# How long to wait for other queries to join a batch (0 disables micro-batching)
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+# Most queries sent in one embedding call / one Chroma search
+QUERY_MAX_BATCH_SIZE = int(os.getenv("QUERY_MAX_BATCH_SIZE", "32"))
+# Hybrid retrieval (classrooms with a lexical index): candidates taken from each ranking
+# before fusion, and the weight of the BM25 ranking relative to the vector ranking
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+RAG_HYBRID_LEXICAL_WEIGHT = float(os.getenv("RAG_HYBRID_LEXICAL_WEIGHT", "1.0"))
+# Reciprocal rank fusion constant; damps the difference between the top few ranks
+RRF_K = 60
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embeddings client with an LRU cache of query embeddings.
+    Cache misses arriving within QUERY_BATCH_WINDOW_MS of each other are embedded
+    together in one call. Document embeddings (notes) go through the shared
+    content-addressed embedding store, so text already embedded is not sent again.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, cache_size: int = QUERY_EMBEDDING_CACHE_SIZE,
+                 batch_window_ms: float = QUERY_BATCH_WINDOW_MS, max_batch_size: int = QUERY_MAX_BATCH_SIZE):
+        self.base = base
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, list[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._batcher = MicroBatcher(self._embed_query_batch, batch_window_ms, max_batch_size, name="query-embeddings")
+        self.hits = 0
+        self.misses = 0
+
+    def _embed_query_batch(self, texts: list[str]) -> list[list[float]]:
+        """Embeds several queries in one request when the client supports it."""
+        embed = getattr(self.base, "embed", None)
+        if embed is not None:
+            # VertexAIEmbeddings: embed_query uses the RETRIEVAL_QUERY task type, keep it for batches
+            request = lambda: embed(texts, embeddings_task_type="RETRIEVAL_QUERY")
+        else:
+            request = lambda: [self.base.embed_query(text) for text in texts]
+        # Timeout, retries and circuit breaking for the embedding backend (see resilience.py)
+        return embedding_policy.call(request)
+
+    def _cache_get(self, text: str):
+        with self._lock:
+            embedding = self._cache.get(text)
+            if embedding is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+            return embedding
+
+    def _cache_put(self, text: str, embedding: list[float]) -> None:
+        with self._lock:
+            self._cache[text] = embedding
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def embed_query(self, text: str) -> list[float]:
+        embedding = self._cache_get(text)
+        if embedding is not None:
+            return embedding
+        with self._lock:
+            self.misses += 1
+        embedding = self._batcher.submit(text)
+        self._cache_put(text, embedding)
+        return embedding
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Embeds many queries at once: cached ones are reused, the rest go out in one batch call."""
+        results = [self._cache_get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, emb in zip(texts, results) if emb is None))
+        if missing:
+            with self._lock:
+                self.misses += len(missing)
+            fresh = dict(zip(missing, self._embed_query_batch(missing)))
+            for text, embedding in fresh.items():
+                self._cache_put(text, embedding)
+            results = [emb if emb is not None else fresh[text] for text, emb in zip(texts, results)]
+        return results
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, _ = embedding_store.get_or_embed(self.model_name, texts, self.base.embed_documents)
+        return vectors
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "model": self.model_name,
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+        stats["batching"] = self._batcher.stats()
+        return stats
+
+
+def _chroma_system_registry() -> dict:
+    """Chroma's process-wide {persist_directory: System} registry."""
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+    except ImportError: # chromadb < 0.5
+        from chromadb.api.client import SharedSystemClient
+    return SharedSystemClient._identifier_to_system
+
+
+def detach_chroma_path(persist_directory: str) -> None:
+    """
+    Makes the next Chroma store opened on this path start its own System.
+    Chroma otherwise reuses the System already open for the path, which would keep
+    serving the old index after populate_db.py swapped a new one in. Stores already
+    open on the old System keep working until they are closed.
+    """
+    _chroma_system_registry().pop(persist_directory, None)
+
+
+def close_vectorstore(vectorstore) -> None:
+    """Stops the Chroma System this vector store was opened with."""
+    if isinstance(vectorstore, MmapVectorStore):
+        vectorstore.close()
+        return
+    collection = getattr(vectorstore, "_collection", None)
+    system = getattr(getattr(collection, "_client", None), "_system", None)
+    if system is None:
+        return
+    # Only unregister it if a newer store hasn't already replaced it for this path
+    registry = _chroma_system_registry()
+    for identifier, registered in list(registry.items()):
+        if registered is system:
+            registry.pop(identifier, None)
+    system.stop()
+
+
+def search_by_vectors(vectorstore, query_embeddings: list[list[float]], k: int, where: dict | None = None) -> list[list[Document]]:
+    """
+    Runs one multi-query Chroma search and returns the top-k documents for each query.
+    where restricts the search to matching chunks (one classroom of the shared index).
+    """
+    if isinstance(vectorstore, MmapVectorStore):
+        # A memory-mapped index holds one classroom; it cannot apply a filter, so refuse one
+        # rather than return chunks the filter was meant to exclude
+        if where:
+            raise ValueError("Memory-mapped indexes do not support metadata filters (where); search Chroma instead.")
+        return vectorstore.search(query_embeddings, k)
+    result = vectorstore._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=k,
+        where=where,
+        include=["documents", "metadatas", "distances"],
+    )
+    all_docs = []
+    for ids, texts, metadatas in zip(result["ids"], result["documents"], result["metadatas"]):
+        all_docs.append([
+            Document(id=chunk_id, page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        ])
+    return all_docs
+
+
+def _get_by_ids(vectorstore, ids: list[str]) -> dict[str, Document]:
+    if isinstance(vectorstore, MmapVectorStore):
+        return vectorstore.get_by_ids(ids)
+    result = vectorstore._collection.get(ids=ids, include=["documents", "metadatas"])
+    return {
+        chunk_id: Document(id=chunk_id, page_content=text, metadata=metadata or {})
+        for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+
+
+def existing_ids(vectorstore, ids: list[str]) -> set[str]:
+    """Returns which of the given chunk IDs the vector store already holds."""
+    if isinstance(vectorstore, MmapVectorStore):
+        return vectorstore.existing_ids(ids)
+    return set(vectorstore._collection.get(ids=ids, include=[])["ids"])
+
+
+class ClassroomRetriever(BaseRetriever):
+    """
+    Top-k retriever over a classroom's vector store (Chroma or memory-mapped).
+    Uses the shared cached query embeddings, and searches that arrive close
+    together are sent to Chroma as one multi-query search.
+
+    When the classroom has a lexical index (built by populate_db.py), the vector
+    and BM25 rankings are merged with reciprocal rank fusion, so exact terms such as
+    section numbers and names are found even when the embedding misses them.
+
+    With the shared index (RAG_INDEX_LAYOUT=shared), vectorstore is the collection
+    of all classrooms and where limits every search to this classroom's chunks.
+    """
+
+    vectorstore: Any
+    embeddings: Any
+    k: int = 4
+    search_batcher: Any = None
+    lexical_index: Any = None
+    candidates: int = 4
+    where: Any = None
+
+    @classmethod
+    def create(cls, vectorstore, embeddings, k: int = 4, lexical_index=None, where: dict | None = None) -> "ClassroomRetriever":
+        candidates = max(k, RAG_HYBRID_CANDIDATES) if lexical_index is not None else k
+        search_batcher = MicroBatcher(
+            lambda vectors: search_by_vectors(vectorstore, vectors, candidates, where=where),
+            QUERY_BATCH_WINDOW_MS,
+            QUERY_MAX_BATCH_SIZE,
+            name="chroma-search",
+        )
+        return cls(vectorstore=vectorstore, embeddings=embeddings, k=k, search_batcher=search_batcher,
+                   lexical_index=lexical_index, candidates=candidates, where=where)
+
+    def _fuse(self, query: str, vector_docs: list[Document]) -> list[Document]:
+        """Merges the vector results with the BM25 results for the query (reciprocal rank fusion)."""
+        if self.lexical_index is None:
+            return vector_docs[:self.k]
+        with metrics.stage("lexical_search"):
+            lexical_hits = self.lexical_index.search(query, self.candidates)
+        if not lexical_hits:
+            return vector_docs[:self.k]
+
+        docs = {doc.id: doc for doc in vector_docs}
+        scores: dict[str, float] = {}
+        for rank, doc in enumerate(vector_docs):
+            scores[doc.id] = 1.0 / (RRF_K + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical_hits):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + RAG_HYBRID_LEXICAL_WEIGHT / (RRF_K + rank + 1)
+        best = sorted(scores, key=scores.get, reverse=True)
+
+        # Lexical-only hits that made the cut still need their text from Chroma
+        missing = [chunk_id for chunk_id in best[:self.k] if chunk_id not in docs]
+        if missing:
+            docs.update(_get_by_ids(self.vectorstore, missing))
+        # Chunks deleted since the lexical index was built are skipped
+        return [docs[chunk_id] for chunk_id in best if chunk_id in docs][:self.k]
+
+    def search_many(self, queries: list[str], query_embeddings: list[list[float]]) -> list[list[Document]]:
+        """Retrieves documents for several queries with one Chroma search."""
+        results = search_by_vectors(self.vectorstore, query_embeddings, self.candidates, where=self.where)
+        return [self._fuse(query, docs) for query, docs in zip(queries, results)]
+
+    def lexical_search(self, query: str) -> list[Document]:
+        """
+        Top-k chunks by BM25 alone, for when query embeddings are unavailable.
+        Returns an empty list for classrooms without a lexical index.
+        """
+        if self.lexical_index is None:
+            return []
+        with metrics.stage("lexical_search"):
+            hits = self.lexical_index.search(query, self.k)
+        if not hits:
+            return []
+        docs = _get_by_ids(self.vectorstore, [chunk_id for chunk_id, _ in hits])
+        return [docs[chunk_id] for chunk_id, _ in hits if chunk_id in docs]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        with metrics.stage("query_embedding"):
+            query_embedding = self.embeddings.embed_query(query)
+        with metrics.stage("vector_search"):
+            vector_docs = self.search_batcher.submit(query_embedding)
+        return self._fuse(query, vector_docs)
@@ -1,9 +1,22 @@
 # backend/api/routes.py
-from fastapi import APIRouter, HTTPException, status
+import os
+import re
+import json
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
 # --- Update Model Imports ---
-from .models import QueryRequest, AnswerResponse, AddNoteRequest, AddNoteResponse
+from .models import QueryRequest, AnswerResponse, AddNoteRequest, AddNoteResponse, BatchQueryRequest, BatchAnswerResponse
+from .models import IngestRequest, IngestResponse, IngestionJob, ClassroomInfo
 # --- Update Service Imports ---
-from .services import get_rag_answer, add_note_to_classroom # Removed mock, added note service
+from .services import aget_rag_answer, astream_rag_answer, abatch_rag_answers, astream_batch_answers, add_note_to_classroom, get_service_stats # Removed mock, added note service
+from .services import classroom_catalog
+from .concurrency import rag_limiter, ServiceOverloadedError
+from .ingestion_jobs import job_store, job_runner, default_classroom_config
+from .static_assets import etag_matches, not_modified
+
+logger = logging.getLogger(__name__)
 
 # Create an API router. All routes defined here will be prefixed with /api
 router = APIRouter(prefix="/api")
@@ -21,18 +34,136 @@ async def ask_question(request: QueryRequest):
          raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Classroom ID cannot be empty")
 
     try:
-        # Call the RAG service function, passing both query and classroom_id
-        answer_text = get_rag_answer(query=request.query, classroom_id=request.classroom_id)
+        # Call the async RAG service function, passing both query and classroom_id
+        answer_text = await aget_rag_answer(query=request.query, classroom_id=request.classroom_id,
+                                            priority=request.role == "teacher")
         return AnswerResponse(answer=answer_text)
+    except ServiceOverloadedError as e:
+        # Fail fast when at capacity so clients can back off and retry
+        raise _overloaded(e)
     except FileNotFoundError as e:
          # Handle case where the classroom DB doesn't exist
          raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except Exception as e:
         # Catch other potential errors from the service layer
-        print(f"Error processing /api/ask route: {e}")
+        logger.exception("Error processing /api/ask route")
         # Avoid leaking internal error details to the client in production
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An internal error occurred while processing the question.")
 
+def _overloaded(error: ServiceOverloadedError) -> HTTPException:
+    """503 when the server is at capacity, 429 when the classroom is over its rate limit."""
+    return HTTPException(
+        status_code=error.status_code,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+def _check_admission(classroom_id: str, priority: bool) -> None:
+    """Rejects a streaming request up front, while a proper status code can still be sent."""
+    error = rag_limiter.admission_error(classroom_id, priority)
+    if error is not None:
+        raise _overloaded(error)
+
+def _sse_event(event: str, data: dict) -> str:
+    """Formats one Server-Sent Events message. Data is JSON so newlines in tokens survive."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# --- Streaming variant of /ask using Server-Sent Events ---
+@router.post("/ask/stream")
+async def ask_question_stream(request: QueryRequest):
+    """
+    Same as /ask, but streams the answer as Server-Sent Events while the LLM generates it.
+    Events: 'token' ({"token": "..."}), then 'done' ({}), or 'error' ({"detail": "..."}).
+    """
+    if not request.query:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Query cannot be empty")
+    if not request.classroom_id:
+         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Classroom ID cannot be empty")
+
+    # Reject up front while we can still send a proper status code
+    priority = request.role == "teacher"
+    _check_admission(request.classroom_id, priority)
+
+    async def event_stream():
+        try:
+            async for token in astream_rag_answer(query=request.query, classroom_id=request.classroom_id, priority=priority):
+                yield _sse_event("token", {"token": token})
+            yield _sse_event("done", {})
+        except ServiceOverloadedError as e:
+            yield _sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            logger.exception("Error processing /api/ask/stream route")
+            yield _sse_event("error", {"detail": "An internal error occurred while processing the question."})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _validate_batch(request: BatchQueryRequest) -> None:
+    if not request.classroom_id:
+         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Classroom ID cannot be empty")
+    if any(not query.strip() for query in request.queries):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Queries cannot be empty")
+
+# --- Batch of questions (worksheets): one retrieval pass, parallel generation ---
+@router.post("/ask/batch", response_model=BatchAnswerResponse)
+async def ask_batch(request: BatchQueryRequest):
+    """
+    Answers a list of questions for one classroom. Answers are returned in the
+    order of the questions; the whole batch takes about as long as its slowest question.
+    """
+    _validate_batch(request)
+    try:
+        answers = await abatch_rag_answers(request.queries, classroom_id=request.classroom_id,
+                                           priority=request.role == "teacher")
+        return BatchAnswerResponse(answers=answers)
+    except ServiceOverloadedError as e:
+        raise _overloaded(e)
+    except Exception:
+        logger.exception("Error processing /api/ask/batch route")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An internal error occurred while processing the questions.")
+
+@router.post("/ask/batch/stream")
+async def ask_batch_stream(request: BatchQueryRequest):
+    """
+    Same as /ask/batch, but sends each answer as a Server-Sent Event as soon as it is ready.
+    Events: 'answer' (a BatchAnswerItem, with its index), then 'done' ({}), or 'error' ({"detail": "..."}).
+    """
+    _validate_batch(request)
+    priority = request.role == "teacher"
+    _check_admission(request.classroom_id, priority)
+
+    async def event_stream():
+        try:
+            async for item in astream_batch_answers(request.queries, classroom_id=request.classroom_id, priority=priority):
+                yield _sse_event("answer", item)
+            yield _sse_event("done", {})
+        except ServiceOverloadedError as e:
+            yield _sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+        except Exception:
+            logger.exception("Error processing /api/ask/batch/stream route")
+            yield _sse_event("error", {"detail": "An internal error occurred while processing the questions."})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- Classroom catalog (replaces the list hard-coded in the frontend) ---
+CATALOG_CACHE_CONTROL = "no-cache" # Revalidated on every page load: a 304 while nothing was re-indexed
+
+@router.get("/classrooms", response_model=list[ClassroomInfo])
+async def list_classrooms(request: Request):
+    """Lists the classrooms that have been indexed, with their display names."""
+    classrooms, etag = await asyncio.to_thread(classroom_catalog)
+    if etag_matches(request.headers.get("if-none-match"), [etag]):
+        return not_modified(etag, CATALOG_CACHE_CONTROL)
+    return JSONResponse(classrooms, headers={"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL})
+
 # --- MVP2: New endpoint for adding notes ---
 @router.post("/classrooms/{classroom_id}/notes", response_model=AddNoteResponse, status_code=status.HTTP_201_CREATED)
 async def add_note(classroom_id: str, request: AddNoteRequest):
@@ -44,22 +175,88 @@ async def add_note(classroom_id: str, request: AddNoteRequest):
 
     try:
         # Here you might add checks: Does classroom_id exist? User permissions? (Deferred for now)
-        print(f"Received request to add note to classroom: {classroom_id}")
-        note_id = add_note_to_classroom(classroom_id=classroom_id, note_text=request.note_text)
+        logger.debug("Received request to add note", extra={"classroom_id": classroom_id})
+        # SQLite write; keep it off the event loop
+        note_id = await asyncio.to_thread(add_note_to_classroom, classroom_id=classroom_id, note_text=request.note_text)
         return AddNoteResponse(
             message="Note added successfully.",
             classroom_id=classroom_id,
             note_id=note_id
         )
     except Exception as e:
-        print(f"Error processing add_note route for classroom {classroom_id}: {e}")
+        logger.exception("Error processing add_note route", extra={"classroom_id": classroom_id})
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to add note.")
 
-# --- Optional: Endpoint to retrieve notes (for testing/debugging) ---
+# --- Endpoint to retrieve notes, paginated (pass the last ID you saw as after_id) ---
 @router.get("/classrooms/{classroom_id}/notes", response_model=list[dict])
-async def get_notes(classroom_id: str):
-     """Retrieves all notes for a given classroom (from in-memory store)."""
+async def get_notes(
+    classroom_id: str,
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of notes to return."),
+    after_id: int | None = Query(None, description="Return notes with IDs greater than this."),
+):
+     """Retrieves a page of notes for a given classroom, oldest first."""
      from .services import get_classroom_notes # Import here or globally
-     notes = get_classroom_notes(classroom_id)
+     notes = await asyncio.to_thread(get_classroom_notes, classroom_id, limit, after_id)
      return notes
 
+
+# --- Ingestion jobs: re-index a classroom in the background, then hot-swap it in ---
+# Classroom IDs become directory names under chroma_dbs/
+_CLASSROOM_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+def _job_config(classroom_id: str, request: IngestRequest) -> dict:
+    """The populate_db.py classroom config for a job: CLASSROOMS entry overridden by the request."""
+    if not _CLASSROOM_ID_PATTERN.match(classroom_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Classroom ID may only contain letters, digits, '-' and '_'")
+    config = dict(default_classroom_config(classroom_id) or {})
+    config.update(request.model_dump(exclude_none=True))
+    curriculum_path = config.get("curriculum_path")
+    if not curriculum_path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Unknown classroom '{classroom_id}'; pass its curriculum_path to index it")
+    # Documents must stay inside the documents root
+    for field in ("curriculum_path", "glob_pattern"):
+        value = config.get(field) or ""
+        if os.path.isabs(value) or ".." in value.replace("\\", "/").split("/"):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{field} must stay within the documents root")
+    return config
+
+@router.post("/classrooms/{classroom_id}/ingest", response_model=IngestResponse, status_code=status.HTTP_202_ACCEPTED)
+async def ingest_classroom(classroom_id: str, request: IngestRequest | None = None):
+    """
+    Queues a job that re-indexes the classroom's documents (only new or changed files are
+    embedded). Questions keep being answered from the current index until the job swaps
+    the new one in. Poll GET /api/ingestion/jobs/{job_id} for progress.
+    """
+    config = await asyncio.to_thread(_job_config, classroom_id, request or IngestRequest())
+    job, created = await asyncio.to_thread(job_store.enqueue, classroom_id, config)
+    if created:
+        job_runner.wake()
+        logger.info("Ingestion job %d queued", job["id"], extra={"classroom_id": classroom_id})
+    message = "Ingestion job queued." if created else "An ingestion job for this classroom is already queued or running."
+    return IngestResponse(message=message, created=created, job=IngestionJob(**job))
+
+@router.get("/ingestion/jobs/{job_id}", response_model=IngestionJob)
+async def get_ingestion_job(job_id: int):
+    """Returns an ingestion job with its progress (files, chunks, embeddings per second, ETA)."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Ingestion job {job_id} not found")
+    return IngestionJob(**job)
+
+@router.get("/ingestion/jobs", response_model=list[IngestionJob])
+async def list_ingestion_jobs(
+    classroom_id: str | None = Query(None, description="Only jobs for this classroom."),
+    limit: int = Query(20, ge=1, le=200, description="Maximum number of jobs to return."),
+):
+    """Lists recent ingestion jobs, newest first."""
+    jobs = await asyncio.to_thread(job_store.list_jobs, classroom_id, limit)
+    return [IngestionJob(**job) for job in jobs]
+
+
+# --- Runtime stats (cache sizes, limiter state) for operators ---
+@router.get("/stats")
+async def get_stats():
+     """Returns runtime counters for the RAG service."""
+     return get_service_stats()
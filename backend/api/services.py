@@ -1,82 +1,239 @@
 # backend/api/services.py
 import os
-from dotenv import load_dotenv
-import time # For simple note ID generation
-
-# LangChain components
-from langchain_google_vertexai import VertexAIEmbeddings, VertexAI # LLM
-from langchain_community.vectorstores import Chroma
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableConfig
+import json
+import time
+import hashlib
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+
+# LangChain, Chroma and the Vertex AI SDK are imported when the first classroom is
+# built (see _build_classroom_components), not at import time: worker restarts,
+# health checks and the notes routes don't wait for seconds of imports.
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+
+from . import clients
+from . import metrics
+from .concurrency import rag_limiter, ServiceOverloadedError
+from .resilience import llm_policy, is_dependency_failure, RAG_RETRIEVAL_TIMEOUT_SECONDS, RAG_LLM_FIRST_TOKEN_TIMEOUT_SECONDS
+from . import resilience
+from .component_cache import ComponentCache
+from .answer_cache import answer_cache, normalize_query, ANSWER_CACHE_ENABLED
+from .coalescing import RequestCoalescer, RAG_COALESCE_ENABLED
+from .context import context_assembler
+from .notes_store import notes_store
+from .embedding_store import embedding_store
+from .lexical_index import LexicalIndex
+from .ingestion_jobs import job_runner
+from .index_lock import is_swap_artifact, write_lock as index_write_lock
+from .shared_index import shared_index, SHARED_INDEX_ENABLED, classroom_filter, write_lock as shared_write_lock
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 # Base directory where individual classroom DBs are stored
 # Assumes this script is run from the project root (e.g., via run_backend.py)
 CHROMA_DBS_ROOT = "chroma_dbs"
 LLM_MODEL_NAME = "gemini-1.0-pro" # Or choose another appropriate Gemini model
-
-# --- Simple In-Memory Storage for Notes (Replace with DB later) ---
-# Dictionary to store notes per classroom { classroom_id: [list of notes] }
-classroom_notes_store = {}
+# Written by populate_db.py into each classroom DB directory
+INDEX_MANIFEST_FILENAME = "index_manifest.json"
+
+# Limits for the classroom component cache (0 disables a limit)
+RAG_CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "32"))
+RAG_CACHE_TTL_SECONDS = float(os.getenv("RAG_CACHE_TTL_SECONDS", "3600"))
+RAG_CACHE_MAX_MEMORY_MB = int(os.getenv("RAG_CACHE_MAX_MEMORY_MB", "0"))
+# Classrooms to load at startup, comma separated (e.g. "math_g10_tamil,ai_intro_eng"), or "*" for every built index
+RAG_WARM_CLASSROOMS = [c.strip() for c in os.getenv("RAG_WARM_CLASSROOMS", "").split(",") if c.strip()]
+# Evicted vector stores are closed after this delay so in-flight requests can finish with them
+RAG_EVICTION_CLOSE_DELAY_SECONDS = float(os.getenv("RAG_EVICTION_CLOSE_DELAY_SECONDS", "30"))
+# LLM calls a single batch request (/api/ask/batch) may have running at once
+RAG_BATCH_MAX_CONCURRENCY = int(os.getenv("RAG_BATCH_MAX_CONCURRENCY", "8"))
+# Passages sent instead of an answer while the LLM is unavailable, and their length limit
+RAG_DEGRADED_PASSAGES = int(os.getenv("RAG_DEGRADED_PASSAGES", "3"))
+DEGRADED_PASSAGE_CHARS = 600
+
+# Rough per-chunk memory cost used for cache accounting:
+# 768-dim float32 embedding + HNSW links + chunk text and metadata
+ESTIMATED_BYTES_PER_CHUNK = 768 * 4 + 512 + 1500
+# Fixed overhead per open classroom (Chroma client, chain objects)
+ESTIMATED_BYTES_PER_CLASSROOM = 2 * 1024 * 1024
+# Memory-mapped classrooms: an int8 row plus its scale and offsets; chunk text stays
+# on disk and all pages are shared page cache, so this is an upper bound
+ESTIMATED_BYTES_PER_MMAP_CHUNK = 768 + 32
+ESTIMATED_BYTES_PER_MMAP_CLASSROOM = 256 * 1024
+# Shared index: the vectors are accounted once for all classrooms (they are not evicted
+# with a classroom), each classroom only adds its retriever and lexical index
+ESTIMATED_BYTES_PER_SHARED_CLASSROOM = 256 * 1024
+
+# --- Notes ---
+# Notes live in the SQLite notes store (see notes_store.py) and are embedded into the
+# classroom's vector store in the background by this single-threaded executor.
+_notes_indexer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notes-indexer")
+NOTE_ID_PREFIX = "note-" # Chroma IDs of indexed notes, e.g. "note-42"
+
+# --- In-flight deduplication of identical questions (per worker process) ---
+rag_coalescer = RequestCoalescer(enabled=RAG_COALESCE_ENABLED)
 
 # --- Global Cache for Initialized Components (per classroom) ---
-# { classroom_id: {"vectorstore": Chroma, "llm": VertexAI, "rag_chain": Runnable} }
-initialized_components_cache = {}
+# { classroom_id: {"vectorstore": Chroma, "llm": VertexAI, "retriever": ..., "generation_chain": Runnable} }
+# Bounded by entry count, idle TTL and an estimated memory budget (see ComponentCache)
+
+def _estimate_components_size(components: dict) -> int:
+    """Estimates the resident size of a classroom's components from its chunk count."""
+    from .vector_index import MmapVectorStore
+
+    vectorstore = components["vectorstore"]
+    if components.get("shared_index"):
+        return ESTIMATED_BYTES_PER_SHARED_CLASSROOM
+    if isinstance(vectorstore, MmapVectorStore):
+        return ESTIMATED_BYTES_PER_MMAP_CLASSROOM + vectorstore.count() * ESTIMATED_BYTES_PER_MMAP_CHUNK
+    chunk_count = 0
+    try:
+        chunk_count = vectorstore._collection.count()
+    except Exception:
+        pass
+    return ESTIMATED_BYTES_PER_CLASSROOM + chunk_count * ESTIMATED_BYTES_PER_CHUNK
+
+def _on_components_evicted(classroom_id: str, components: dict) -> None:
+    """Schedules the evicted classroom's vector store to be closed once in-flight requests are done."""
+    logger.info("Evicting cached components", extra={"classroom_id": classroom_id})
+    vectorstore = components.get("vectorstore")
+    if vectorstore is None or components.get("shared_index"):
+        return # The shared collection stays open for the other classrooms
+
+    def close():
+        from .retrieval import close_vectorstore
+
+        try:
+            close_vectorstore(vectorstore)
+            logger.info("Closed vector store of evicted classroom", extra={"classroom_id": classroom_id})
+        except Exception as e:
+            logger.warning("Could not close vector store: %s", e, extra={"classroom_id": classroom_id})
+
+    timer = threading.Timer(RAG_EVICTION_CLOSE_DELAY_SECONDS, close)
+    timer.daemon = True
+    timer.start()
+
+initialized_components_cache = ComponentCache(
+    max_entries=RAG_CACHE_MAX_ENTRIES,
+    ttl_seconds=RAG_CACHE_TTL_SECONDS,
+    max_memory_bytes=RAG_CACHE_MAX_MEMORY_MB * 1024 * 1024,
+    size_fn=_estimate_components_size,
+    on_evict=_on_components_evicted,
+)
 
 def _initialize_classroom_components(classroom_id: str):
     """
-    Initializes LangChain components for a specific classroom if not already cached.
+    Returns the LangChain components for a classroom, building them on first use.
+    Concurrent first requests for the same classroom share a single build.
+    """
+    return initialized_components_cache.get_or_create(
+        classroom_id,
+        _build_and_sync_notes,
+        # populate_db.py swapped in a new index: reload it (the old one keeps serving until then)
+        is_stale=lambda components: _components_are_stale(classroom_id, components),
+    )
+
+def _components_are_stale(classroom_id: str, components: dict) -> bool:
+    # While an ingestion job re-indexes the classroom, the loaded components keep serving
+    # until the job swaps rebuilt ones in (see swap_in_classroom), off the request path
+    if classroom_id not in _reindexing_classrooms and components.get("index_version") != _index_version(classroom_id):
+        return True
+    # Another process wrote to the shared collection: rebuild on the reopened one
+    return bool(components.get("shared_index")) and not shared_index.is_current(components["vectorstore"])
+
+def _build_and_sync_notes(classroom_id: str):
+    """Builds a classroom's components, then makes sure its notes are in the loaded index."""
+    try:
+        with metrics.timed_stage(classroom_id, "component_init"):
+            components = _build_classroom_components(classroom_id)
+    except Exception:
+        metrics.ERRORS.inc(classroom=classroom_id, stage="component_init")
+        raise
+    _notes_indexer.submit(_sync_notes_index, classroom_id)
+    return components
+
+def _run_config(**config) -> "RunnableConfig":
+    """A LangChain run config; RunnableConfig is a TypedDict, so a plain dict is one."""
+    return config
+
+def assemble_context(docs, question: str, classroom_id: str) -> str:
+    """Builds the LLM context from the retrieved chunks (deduplicated, filtered, within the token budget)."""
+    with metrics.stage("format_context"):
+        context, retrieved_tokens, context_tokens = context_assembler.assemble(docs, question)
+    metrics.CONTEXT_TOKENS.inc(retrieved_tokens, classroom=classroom_id, kind="retrieved")
+    metrics.CONTEXT_TOKENS.inc(context_tokens, classroom=classroom_id, kind="sent")
+    return context
+
+def _build_classroom_components(classroom_id: str):
+    """
+    Initializes LangChain components for a specific classroom.
     Loads vector store, LLM, and creates the RAG chain.
     """
-    global initialized_components_cache
-
-    # Check cache first
-    if classroom_id in initialized_components_cache:
-        # print(f"Using cached components for classroom: {classroom_id}") # Optional: for debugging cache hits
-        return initialized_components_cache[classroom_id]
-
-    print(f"Initializing RAG components for classroom: {classroom_id}...")
-    load_dotenv()
-    google_project_id = os.getenv("GOOGLE_PROJECT_ID")
-
-    if not google_project_id:
-        raise ValueError("GOOGLE_PROJECT_ID not found in environment variables.")
+    logger.info("Initializing RAG components", extra={"classroom_id": classroom_id})
+    # Heavy imports, deferred to the first classroom build (see the note at the top)
+    from langchain_community.vectorstores import Chroma
+    from langchain.prompts import PromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+    from .retrieval import ClassroomRetriever, detach_chroma_path
+    from .vector_index import MmapVectorStore, RAG_VECTOR_BACKEND, has_mmap_index
 
     # Define paths specific to this classroom
     vectorstore_path = os.path.join(CHROMA_DBS_ROOT, classroom_id)
 
     try:
-        # 1. Embeddings (reuse the same model used for populating)
-        # This could potentially be initialized once globally if desired
-        embeddings = VertexAIEmbeddings(
-            model_name="text-embedding-004",
-            project=google_project_id
-        )
+        # 1. Embeddings (shared process-wide; same model used for populating)
+        # Query embeddings are cached and micro-batched across all classrooms
+        embeddings = clients.get_query_embeddings()
 
         # 2. Load Classroom-Specific Vector Store
         if not os.path.isdir(vectorstore_path):
              raise FileNotFoundError(f"ChromaDB directory not found for classroom '{classroom_id}' at {vectorstore_path}. Did populate_db.py run successfully for this classroom?")
 
-        vectorstore = Chroma(
-            persist_directory=vectorstore_path,
-            embedding_function=embeddings
-        )
-        print(f"Vector store loaded from {vectorstore_path}")
-
-        # 3. Initialize LLM (Could also be global if same settings for all classrooms)
-        llm = VertexAI(
+        index_version = _index_version(classroom_id)
+        where = None
+        if SHARED_INDEX_ENABLED:
+            # One collection for every classroom, opened once per process; searches are filtered
+            if RAG_VECTOR_BACKEND == "mmap":
+                logger.warning("RAG_VECTOR_BACKEND=mmap is not used with the shared index, searching Chroma",
+                               extra={"classroom_id": classroom_id})
+            vectorstore = shared_index.get(embeddings)
+            where = classroom_filter(classroom_id)
+        elif RAG_VECTOR_BACKEND == "mmap" and has_mmap_index(vectorstore_path):
+            vectorstore = MmapVectorStore(vectorstore_path, embedding_function=embeddings)
+        else:
+            if RAG_VECTOR_BACKEND == "mmap":
+                logger.warning("No memory-mapped index, falling back to Chroma (run migrate_vector_index.py)",
+                               extra={"classroom_id": classroom_id})
+            # Open the version the classroom path links to now (populate_db.py swaps the link),
+            # on a fresh Chroma System so a re-indexed directory is actually re-read
+            index_directory = os.path.realpath(vectorstore_path)
+            detach_chroma_path(index_directory)
+            vectorstore = Chroma(
+                persist_directory=index_directory,
+                embedding_function=embeddings
+            )
+        logger.debug("Vector store loaded from %s", vectorstore_path)
+
+        # 3. LLM (shared process-wide, same settings for all classrooms)
+        llm = clients.get_llm(
             model_name=LLM_MODEL_NAME,
-            project=google_project_id,
             temperature=0.1, # Lower temperature for more factual answers
             max_output_tokens=1024 # Adjust as needed
         )
-        print(f"LLM initialized ({LLM_MODEL_NAME})")
+        logger.debug("LLM ready (%s)", LLM_MODEL_NAME)
 
         # 4. Create Retriever for this classroom's vector store
-        # Retrieve top 4 most relevant chunks
-        retriever = vectorstore.as_retriever(search_kwargs={'k': 4})
-        print("Retriever created.")
+        # Retrieve top 4 most relevant chunks; concurrent searches are batched into one Chroma query.
+        # With a lexical index from populate_db.py, BM25 and vector rankings are fused.
+        lexical_index = LexicalIndex.load(vectorstore_path)
+        if lexical_index is None:
+            logger.info("No lexical index, using vector search only", extra={"classroom_id": classroom_id})
+        retriever = ClassroomRetriever.create(vectorstore, embeddings, k=4, lexical_index=lexical_index, where=where)
+        logger.debug("Retriever created.")
 
         # 5. Define Prompt Template (Could also be global)
         template = """
@@ -92,84 +249,691 @@ Question:
 
 Answer:"""
         prompt = PromptTemplate.from_template(template)
-        print("Prompt template created.")
-
-        # 6. Define RAG Chain using LangChain Expression Language (LCEL)
-        def format_docs(docs):
-            # Helper function to join document contents
-            return "\n\n".join(doc.page_content for doc in docs)
-
-        rag_chain = (
-            # RunnableParallel allows passing question through and retrieving context
-            {"context": retriever | format_docs, "question": RunnablePassthrough()}
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
-        print("RAG chain created successfully.")
-
-        # Store initialized components in cache
-        initialized_components_cache[classroom_id] = {
+        logger.debug("Prompt template created.")
+
+        # 6. Define the generation chain using LangChain Expression Language (LCEL)
+        # ({"context", "question"} -> answer). Retrieval runs as its own step before it
+        # (see _arun_pipeline), so each stage gets its own deadline and fallback.
+        generation_chain = prompt | llm | StrOutputParser()
+        logger.debug("Generation chain created.")
+
+        # Returned to the cache, which stores it under classroom_id
+        logger.info("Components ready", extra={"classroom_id": classroom_id})
+        return {
+            "index_version": index_version,
             "vectorstore": vectorstore,
+            "shared_index": SHARED_INDEX_ENABLED,
             "llm": llm,
-            "rag_chain": rag_chain
+            "retriever": retriever,
+            "generation_chain": generation_chain,
         }
-        print(f"Components cached for classroom: {classroom_id}")
-        return initialized_components_cache[classroom_id]
 
     except Exception as e:
-        print(f"ERROR initializing RAG components for classroom {classroom_id}: {e}")
+        logger.error("Failed to initialize RAG components: %s", e, extra={"classroom_id": classroom_id})
         # Raise the error to prevent the API from running with faulty components
         raise RuntimeError(f"Failed to initialize RAG components for classroom {classroom_id}: {e}")
 
 
-def get_rag_answer(query: str, classroom_id: str) -> str:
+# --- Answer cache helpers ---
+def _index_version(classroom_id: str):
     """
-    Processes a query using the RAG pipeline for a specific classroom.
+    Identifies the current contents of a classroom's vector store.
+    populate_db.py rewrites the index manifest on every update, so its mtime changes
+    (older builds without a manifest fall back to the directory mtime). Notes indexed
+    by any worker bump the notes part, so other workers reload and see them too.
     """
+    vectorstore_path = os.path.join(CHROMA_DBS_ROOT, classroom_id)
+    index_part = None
+    for path in (os.path.join(vectorstore_path, INDEX_MANIFEST_FILENAME), vectorstore_path):
+        try:
+            index_part = os.stat(path).st_mtime_ns
+            break
+        except OSError:
+            continue
+    return (index_part, notes_store.indexed_version(classroom_id))
+
+def _lookup_cached_answer(query: str, classroom_id: str):
+    """
+    Checks the answer cache: exact normalized question first, then near-duplicates
+    by query embedding. Returns (answer or None, query_embedding or None, index_version).
+    """
+    with metrics.timed_stage(classroom_id, "answer_cache_lookup"):
+        return _lookup_cached_answer_untimed(query, classroom_id)
+
+def _lookup_cached_answer_untimed(query: str, classroom_id: str):
+    version = _index_version(classroom_id)
+    if not ANSWER_CACHE_ENABLED:
+        return None, None, version
+
+    answer = answer_cache.lookup_exact(classroom_id, query, version)
+    if answer is not None:
+        logger.debug("Answer cache hit (exact)", extra={"classroom_id": classroom_id})
+        metrics.ANSWER_CACHE.inc(classroom=classroom_id, result="exact")
+        return answer, None, version
+
+    query_embedding = None
+    if answer_cache.semantic_enabled:
+        try:
+            query_embedding = clients.get_query_embeddings().embed_query(query)
+            answer = answer_cache.lookup_similar(classroom_id, query_embedding, version)
+            if answer is not None:
+                logger.debug("Answer cache hit (similar question)", extra={"classroom_id": classroom_id})
+                metrics.ANSWER_CACHE.inc(classroom=classroom_id, result="similar")
+                return answer, query_embedding, version
+        except Exception as e:
+            # A failed cache lookup should never fail the request
+            logger.warning("Semantic answer cache lookup failed: %s", e, extra={"classroom_id": classroom_id})
+            metrics.ERRORS.inc(classroom=classroom_id, stage="answer_cache_lookup")
+
+    answer_cache.record_miss()
+    metrics.ANSWER_CACHE.inc(classroom=classroom_id, result="miss")
+    return None, query_embedding, version
+
+def _store_cached_answer(query: str, classroom_id: str, answer: str, query_embedding, version) -> None:
+    if ANSWER_CACHE_ENABLED and answer:
+        answer_cache.store(classroom_id, query, answer, version, query_embedding)
+
+
+# --- Degraded mode (a backend failed or its circuit breaker is open, see resilience.py) ---
+UNAVAILABLE_MESSAGE = "Sorry, the assistant is temporarily unavailable. Please try again in a few minutes."
+
+def _lexical_fallback(retriever, query: str, classroom_id: str, error: Exception):
+    """Retrieves with BM25 alone when vector retrieval failed; re-raises error without a lexical index."""
+    if retriever.lexical_index is None:
+        raise error
+    logger.warning("Vector retrieval failed (%s), using lexical search only", str(error) or type(error).__name__,
+                   extra={"classroom_id": classroom_id})
+    metrics.DEGRADED.inc(classroom=classroom_id, fallback="lexical_retrieval")
+    return retriever.lexical_search(query)
+
+def format_passages(docs) -> str:
+    """The top retrieved passages with their sources, sent instead of a generated answer."""
+    parts = ["The assistant can't write an answer right now. These passages from the classroom material match your question:"]
+    for number, doc in enumerate(docs[:RAG_DEGRADED_PASSAGES], 1):
+        text = " ".join(doc.page_content.split())
+        if len(text) > DEGRADED_PASSAGE_CHARS:
+            text = text[:DEGRADED_PASSAGE_CHARS].rsplit(" ", 1)[0] + " ..."
+        source, page = doc.metadata.get("source"), doc.metadata.get("page")
+        if source and isinstance(page, int):
+            text += f" ({source}, page {page + 1})"
+        elif source:
+            text += f" ({source})"
+        parts.append(f"{number}. {text}")
+    return "\n\n".join(parts)
+
+def _degraded_answer(query: str, classroom_id: str, docs, query_embedding, version, error: Exception) -> tuple[str, str]:
+    """
+    Answer for a question whose generation failed: an expired cached answer if there
+    is one, else the retrieved passages. Returns (answer, outcome).
+    """
+    logger.warning("Answering in degraded mode: %s", str(error) or type(error).__name__, extra={"classroom_id": classroom_id})
+    if ANSWER_CACHE_ENABLED:
+        answer = answer_cache.lookup_stale(classroom_id, query, query_embedding, version)
+        if answer is not None:
+            metrics.DEGRADED.inc(classroom=classroom_id, fallback="stale_cache")
+            return answer, "degraded"
+    if docs:
+        metrics.DEGRADED.inc(classroom=classroom_id, fallback="passages")
+        return format_passages(docs), "degraded"
+    metrics.DEGRADED.inc(classroom=classroom_id, fallback="unavailable")
+    return UNAVAILABLE_MESSAGE, "unavailable"
+
+async def _aretrieve(retriever, query: str, classroom_id: str, config) -> list:
+    """Retrieval under RAG_RETRIEVAL_TIMEOUT_SECONDS, falling back to lexical search if the embeddings fail."""
     try:
-        # Get or initialize components for the specified classroom
-        components = _initialize_classroom_components(classroom_id)
-        rag_chain = components.get("rag_chain")
+        return await asyncio.wait_for(retriever.ainvoke(query, config=config), RAG_RETRIEVAL_TIMEOUT_SECONDS or None)
+    except Exception as e:
+        if not is_dependency_failure(e):
+            raise
+        return await asyncio.to_thread(_lexical_fallback, retriever, query, classroom_id, e)
 
-        if not rag_chain:
-             raise RuntimeError(f"RAG chain is not initialized for classroom {classroom_id}.")
+async def _arun_pipeline(components: dict, query: str, classroom_id: str, query_embedding, version, callbacks) -> tuple[str, str]:
+    """
+    Retrieval, context assembly and generation for one question, each backend call
+    under its deadline, retries and circuit breaker. Returns (answer, outcome); the
+    outcome is "degraded" (or "unavailable") when a backend failure was answered around.
+    """
+    config = _run_config(run_name="Classroom RAG Query", callbacks=callbacks)
+    docs = None
+    try:
+        docs = await _aretrieve(components["retriever"], query, classroom_id, config)
+        context = assemble_context(docs, query, classroom_id)
+        generation_chain = components["generation_chain"]
+        answer = await llm_policy.acall(
+            lambda: generation_chain.ainvoke({"context": context, "question": query}, config=config))
+    except Exception as e:
+        if not is_dependency_failure(e):
+            raise
+        return await asyncio.to_thread(_degraded_answer, query, classroom_id, docs, query_embedding, version, e)
+    return answer, "ok"
+
+def _run_pipeline(components: dict, query: str, classroom_id: str, query_embedding, version, callbacks) -> tuple[str, str]:
+    """Blocking version of _arun_pipeline (no retrieval deadline or hedging)."""
+    config = _run_config(run_name="Classroom RAG Query", callbacks=callbacks)
+    retriever = components["retriever"]
+    docs = None
+    try:
+        try:
+            docs = retriever.invoke(query, config=config)
+        except Exception as e:
+            if not is_dependency_failure(e):
+                raise
+            docs = _lexical_fallback(retriever, query, classroom_id, e)
+        context = assemble_context(docs, query, classroom_id)
+        generation_chain = components["generation_chain"]
+        answer = llm_policy.call(lambda: generation_chain.invoke({"context": context, "question": query}, config=config))
+    except Exception as e:
+        if not is_dependency_failure(e):
+            raise
+        return _degraded_answer(query, classroom_id, docs, query_embedding, version, e)
+    return answer, "ok"
 
-        print(f"Invoking RAG chain for classroom '{classroom_id}' with query: {query}")
-        # Invoke the chain with the user's query
-        # Pass config if needed, e.g., for tracing or specific run settings
-        answer = rag_chain.invoke(query, config=RunnableConfig(run_name="Classroom RAG Query"))
-        print(f"RAG chain returned answer for classroom '{classroom_id}'.")
-        return answer
 
-    except FileNotFoundError as e:
-         print(f"Error getting RAG answer: {e}")
-         return f"Sorry, the data for classroom '{classroom_id}' could not be found. Please ensure it has been processed."
-    except Exception as e:
-        print(f"Error during RAG chain invocation for classroom {classroom_id}: {e}")
-        # Return a generic error message to the user
-        return "Sorry, an error occurred while processing your question in this classroom."
+def _record_request(classroom_id: str, endpoint: str, outcome: str, started: float) -> None:
+    metrics.REQUESTS.inc(classroom=classroom_id, endpoint=endpoint, outcome=outcome)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, classroom=classroom_id, endpoint=endpoint)
+    if outcome in ("error", "not_found", "unavailable"):
+        metrics.ERRORS.inc(classroom=classroom_id, stage="chain")
 
-# --- MVP2: Service function for adding notes ---
-def add_note_to_classroom(classroom_id: str, note_text: str) -> str:
+def get_rag_answer(query: str, classroom_id: str) -> str:
     """
-    Adds a text note to the simple in-memory store for a classroom.
-    Returns a unique ID for the note (using timestamp for simplicity).
+    Processes a query using the RAG pipeline for a specific classroom.
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    with metrics.IN_FLIGHT.track_in_progress(classroom=classroom_id):
+        try:
+            cached_answer, query_embedding, version = _lookup_cached_answer(query, classroom_id)
+            if cached_answer is not None:
+                outcome = "cached"
+                return cached_answer
+
+            # Get or initialize components for the specified classroom
+            components = _initialize_classroom_components(classroom_id)
+
+            logger.debug("Invoking RAG chain", extra={"classroom_id": classroom_id, "query": query})
+            with metrics.profiled_request(classroom_id) as callbacks:
+                # Sampled requests get stage timing callbacks
+                answer, outcome = _run_pipeline(components, query, classroom_id, query_embedding, version, callbacks)
+            logger.debug("RAG chain returned answer", extra={"classroom_id": classroom_id})
+            if outcome == "ok":
+                _store_cached_answer(query, classroom_id, answer, query_embedding, version)
+            return answer
+
+        except FileNotFoundError as e:
+             outcome = "not_found"
+             logger.warning("Classroom data not found: %s", e, extra={"classroom_id": classroom_id})
+             return f"Sorry, the data for classroom '{classroom_id}' could not be found. Please ensure it has been processed."
+        except Exception:
+            logger.exception("RAG chain invocation failed", extra={"classroom_id": classroom_id})
+            # Return a generic error message to the user
+            return "Sorry, an error occurred while processing your question in this classroom."
+        finally:
+            _record_request(classroom_id, "ask_sync", outcome, started)
+
+async def aget_rag_answer(query: str, classroom_id: str, priority: bool = False) -> str:
+    """
+    Async version of get_rag_answer for use from the API routes.
+    Runs the chain with ainvoke so the event loop stays free while waiting on
+    retrieval and the LLM; when they fail or time out, the answer degrades (see
+    _arun_pipeline) instead of the request hanging. Admission is bounded by rag_limiter, which shares
+    slots fairly between classrooms (priority requests, i.e. teachers, go first); when the server or the
+    classroom is at capacity this raises ServiceOverloadedError instead of queueing forever.
+    Identical questions already being answered in the classroom are not asked
+    again: they wait for the in-flight answer (see rag_coalescer).
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    with metrics.IN_FLIGHT.track_in_progress(classroom=classroom_id):
+        try:
+            # Cached answers skip the limiter and the LLM entirely
+            cached_answer, query_embedding, version = await asyncio.to_thread(_lookup_cached_answer, query, classroom_id)
+            if cached_answer is not None:
+                outcome = "cached"
+                return cached_answer
+
+            (answer, outcome), coalesced = await rag_coalescer.run(
+                (classroom_id, normalize_query(query), version),
+                lambda: _agenerate_answer(query, classroom_id, query_embedding, version, priority),
+            )
+            if coalesced:
+                metrics.COALESCED.inc(classroom=classroom_id)
+            return answer
+        except ServiceOverloadedError:
+            outcome = "overloaded"
+            raise
+        finally:
+            _record_request(classroom_id, "ask", outcome, started)
+
+async def _agenerate_answer(query: str, classroom_id: str, query_embedding, version, priority: bool = False) -> tuple[str, str]:
+    """Runs the RAG chain for a question under the limiter. Returns (answer, outcome)."""
+    async with rag_limiter.slot(classroom_id, priority=priority):
+        try:
+            # Loading a classroom's vector store is blocking disk work, keep it off the event loop
+            components = await asyncio.to_thread(_initialize_classroom_components, classroom_id)
+
+            logger.debug("Invoking RAG chain (async)", extra={"classroom_id": classroom_id, "query": query})
+            with metrics.profiled_request(classroom_id) as callbacks:
+                answer, outcome = await _arun_pipeline(components, query, classroom_id, query_embedding, version, callbacks)
+            logger.debug("RAG chain returned answer", extra={"classroom_id": classroom_id})
+            if outcome == "ok":
+                _store_cached_answer(query, classroom_id, answer, query_embedding, version)
+            return answer, outcome
+
+        except FileNotFoundError as e:
+             logger.warning("Classroom data not found: %s", e, extra={"classroom_id": classroom_id})
+             return f"Sorry, the data for classroom '{classroom_id}' could not be found. Please ensure it has been processed.", "not_found"
+        except Exception:
+            logger.exception("RAG chain invocation failed", extra={"classroom_id": classroom_id})
+            return "Sorry, an error occurred while processing your question in this classroom.", "error"
+
+async def astream_rag_answer(query: str, classroom_id: str, priority: bool = False):
+    """
+    Streams the answer for a query token by token using the chain's astream.
+    Yields text chunks as the LLM produces them. If a backend fails before the first
+    token, the degraded answer is sent as a single chunk; later errors are raised to
+    the caller (the streaming route turns them into an SSE error event).
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    with metrics.IN_FLIGHT.track_in_progress(classroom=classroom_id):
+        try:
+            cached_answer, query_embedding, version = await asyncio.to_thread(_lookup_cached_answer, query, classroom_id)
+            if cached_answer is not None:
+                # Send the whole cached answer as a single chunk
+                outcome = "cached"
+                yield cached_answer
+                return
+
+            async with rag_limiter.slot(classroom_id, priority=priority):
+                components = await asyncio.to_thread(_initialize_classroom_components, classroom_id)
+
+                logger.debug("Streaming RAG chain", extra={"classroom_id": classroom_id, "query": query})
+                chunks = []
+                docs = None
+                with metrics.profiled_request(classroom_id) as callbacks:
+                    config = _run_config(run_name="Classroom RAG Query (stream)", callbacks=callbacks)
+                    try:
+                        docs = await _aretrieve(components["retriever"], query, classroom_id, config)
+                        context = assemble_context(docs, query, classroom_id)
+                        generation_chain = components["generation_chain"]
+                        tokens = llm_policy.astream(
+                            lambda: generation_chain.astream({"context": context, "question": query}, config=config),
+                            first_item_timeout=RAG_LLM_FIRST_TOKEN_TIMEOUT_SECONDS,
+                        )
+                        async for chunk in tokens:
+                            if chunk:
+                                chunks.append(chunk)
+                                yield chunk
+                    except Exception as e:
+                        # Part of the answer was already sent: nothing to fall back to
+                        if chunks or not is_dependency_failure(e):
+                            raise
+                        answer, outcome = await asyncio.to_thread(
+                            _degraded_answer, query, classroom_id, docs, query_embedding, version, e)
+                        yield answer
+                        return
+                logger.debug("RAG chain finished streaming", extra={"classroom_id": classroom_id})
+                _store_cached_answer(query, classroom_id, "".join(chunks), query_embedding, version)
+                outcome = "ok"
+        except ServiceOverloadedError:
+            outcome = "overloaded"
+            raise
+        finally:
+            _record_request(classroom_id, "ask_stream", outcome, started)
+
+# --- Batches of questions (worksheets, quizzes) ---
+def _prepare_batch(queries: list[str], classroom_id: str):
+    """
+    Blocking part of a batch: answer cache lookups, one embedding call for all
+    uncached questions, then one multi-query Chroma search for them (lexical search
+    if the embeddings are unavailable).
+    Returns (components or None, cached {index: answer}, pending [(indexes, query, docs, context, embedding)], version).
+    Questions that normalize to the same text are answered once.
+    """
+    version = _index_version(classroom_id)
+    cached = {}
+    unique = {} # normalized query -> (indexes, query)
+    for index, query in enumerate(queries):
+        answer = answer_cache.lookup_exact(classroom_id, query, version) if ANSWER_CACHE_ENABLED else None
+        if answer is not None:
+            cached[index] = answer
+            metrics.ANSWER_CACHE.inc(classroom=classroom_id, result="exact")
+            continue
+        unique.setdefault(normalize_query(query), ([], query))[0].append(index)
+    if not unique:
+        return None, cached, [], version
+
+    components = _initialize_classroom_components(classroom_id)
+    retriever = components["retriever"]
+    groups = list(unique.values())
+    embedding_error = None
+    with metrics.timed_stage(classroom_id, "batch_query_embedding"):
+        try:
+            embeddings = retriever.embeddings.embed_queries([query for _, query in groups])
+        except Exception as e:
+            if not is_dependency_failure(e) or retriever.lexical_index is None:
+                raise
+            embedding_error = e
+            embeddings = [None] * len(groups)
+
+    misses = []
+    for (indexes, query), embedding in zip(groups, embeddings):
+        answer = None
+        if ANSWER_CACHE_ENABLED and answer_cache.semantic_enabled:
+            answer = answer_cache.lookup_similar(classroom_id, embedding, version)
+        if answer is not None:
+            metrics.ANSWER_CACHE.inc(classroom=classroom_id, result="similar")
+            for index in indexes:
+                cached[index] = answer
+        else:
+            if ANSWER_CACHE_ENABLED:
+                answer_cache.record_miss()
+                metrics.ANSWER_CACHE.inc(classroom=classroom_id, result="miss")
+            misses.append((indexes, query, embedding))
+    if not misses:
+        return components, cached, [], version
+
+    if embedding_error is not None:
+        results = [_lexical_fallback(retriever, query, classroom_id, embedding_error) for _, query, _ in misses]
+    else:
+        with metrics.timed_stage(classroom_id, "batch_vector_search"):
+            results = retriever.search_many([query for _, query, _ in misses], [embedding for _, _, embedding in misses])
+    pending = [
+        (indexes, query, docs, assemble_context(docs, query, classroom_id), embedding)
+        for (indexes, query, embedding), docs in zip(misses, results)
+    ]
+    return components, cached, pending, version
+
+async def astream_batch_answers(queries: list[str], classroom_id: str, priority: bool = False):
+    """
+    Answers a list of questions for one classroom, yielding
+    {"index", "query", "answer", "cached", "degraded", "error"} as each answer finishes.
+    Retrieval is done for the whole batch up front; generation runs with up to
+    RAG_BATCH_MAX_CONCURRENCY LLM calls at once (each under llm_policy), so a
+    worksheet takes about as long as its slowest question. The batch is admitted
+    through rag_limiter as one request weighing as much as its questions.
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    with metrics.IN_FLIGHT.track_in_progress(classroom=classroom_id):
+        try:
+            async with rag_limiter.slot(classroom_id, priority=priority, cost=len(queries)):
+                components, cached, pending, version = await asyncio.to_thread(_prepare_batch, queries, classroom_id)
+                for index, answer in cached.items():
+                    yield {"index": index, "query": queries[index], "answer": answer, "cached": True,
+                           "degraded": False, "error": False}
+
+                if pending:
+                    async for position, answer, error in _agenerate_batch(components["generation_chain"], pending):
+                        indexes, query, docs, _, embedding = pending[position]
+                        degraded = failed = False
+                        if error is None:
+                            _store_cached_answer(query, classroom_id, answer, embedding, version)
+                        elif is_dependency_failure(error):
+                            answer, item_outcome = _degraded_answer(query, classroom_id, docs, embedding, version, error)
+                            degraded, failed = True, item_outcome == "unavailable"
+                        else:
+                            logger.error("Batch question failed: %s", error, extra={"classroom_id": classroom_id})
+                            metrics.ERRORS.inc(classroom=classroom_id, stage="batch_item")
+                            answer, failed = "Sorry, an error occurred while processing this question.", True
+                        for index in indexes:
+                            yield {"index": index, "query": queries[index], "answer": answer, "cached": False,
+                                   "degraded": degraded, "error": failed}
+            outcome = "ok"
+        except ServiceOverloadedError:
+            outcome = "overloaded"
+            raise
+        finally:
+            _record_request(classroom_id, "ask_batch", outcome, started)
+
+async def _agenerate_batch(generation_chain, pending: list):
+    """Generates the pending batch answers, RAG_BATCH_MAX_CONCURRENCY at a time; yields (position, answer, error) as they finish."""
+    semaphore = asyncio.Semaphore(max(1, RAG_BATCH_MAX_CONCURRENCY))
+    config = _run_config(run_name="Classroom RAG Batch")
+
+    async def generate(position: int):
+        _, query, _, context, _ = pending[position]
+        async with semaphore:
+            try:
+                answer = await llm_policy.acall(
+                    lambda: generation_chain.ainvoke({"context": context, "question": query}, config=config))
+                return position, answer, None
+            except Exception as e:
+                return position, None, e
+
+    tasks = [asyncio.ensure_future(generate(position)) for position in range(len(pending))]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def abatch_rag_answers(queries: list[str], classroom_id: str, priority: bool = False) -> list[dict]:
+    """Answers a list of questions for one classroom; results are in the order of the questions."""
+    results = [item async for item in astream_batch_answers(queries, classroom_id, priority)]
+    return sorted(results, key=lambda item: item["index"])
+
+# --- Startup / shutdown helpers ---
+def built_classroom_ids() -> list[str]:
+    """Classrooms with an index in CHROMA_DBS_ROOT (skipping populate_db.py's staging copies and versions)."""
+    try:
+        names = os.listdir(CHROMA_DBS_ROOT)
+    except OSError:
+        return []
+    return sorted(
+        name for name in names
+        if os.path.isdir(os.path.join(CHROMA_DBS_ROOT, name)) and not is_swap_artifact(name)
+    )
+
+# --- Classroom catalog for the frontend (/api/classrooms) ---
+_catalog_lock = threading.Lock()
+_catalog = {"stamp": None, "classrooms": [], "etag": '""'}
+
+def _read_catalog_entry(classroom_id: str) -> dict:
+    entry = {"classroom_id": classroom_id, "name": classroom_id, "updated_at": None, "files": 0}
+    try:
+        with open(os.path.join(CHROMA_DBS_ROOT, classroom_id, INDEX_MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return entry # Built before manifests existed
+    entry.update(name=manifest.get("name") or classroom_id, updated_at=manifest.get("updated_at"),
+                 files=len(manifest.get("files", {})))
+    return entry
+
+def classroom_catalog() -> tuple[list[dict], str]:
+    """
+    The classrooms with a built index ({classroom_id, name, updated_at, files}) and an ETag
+    for the list. Kept in memory until CHROMA_DBS_ROOT changes (populate_db.py swaps
+    classroom directories in by renaming, which touches it) or a job swaps a classroom in.
+    """
+    try:
+        stamp = os.stat(CHROMA_DBS_ROOT).st_mtime_ns
+    except OSError:
+        stamp = 0
+    with _catalog_lock:
+        if _catalog["stamp"] == stamp:
+            return _catalog["classrooms"], _catalog["etag"]
+        classrooms = [_read_catalog_entry(classroom_id) for classroom_id in built_classroom_ids()]
+        body = json.dumps(classrooms, sort_keys=True).encode("utf-8")
+        _catalog.update(stamp=stamp, classrooms=classrooms, etag=f'"{hashlib.sha256(body).hexdigest()[:20]}"')
+        return classrooms, _catalog["etag"]
+
+def invalidate_classroom_catalog() -> None:
+    with _catalog_lock:
+        _catalog["stamp"] = None
+
+def warm_classroom_ids() -> list[str]:
     """
-    global classroom_notes_store
-    if classroom_id not in classroom_notes_store:
-        classroom_notes_store[classroom_id] = []
+    The classrooms RAG_WARM_CLASSROOMS asks to preload. "*" expands to the most recently
+    indexed built classrooms, as many as the component cache holds (RAG_CACHE_MAX_ENTRIES):
+    preloading more would only evict them again.
+    """
+    if "*" not in RAG_WARM_CLASSROOMS:
+        return list(RAG_WARM_CLASSROOMS)
+    classroom_ids = sorted(built_classroom_ids(), key=lambda cid: _index_version(cid)[0] or 0, reverse=True)
+    max_entries = initialized_components_cache.max_entries
+    return classroom_ids[:max_entries] if max_entries else classroom_ids
 
-    # Simple ID generation using timestamp
-    note_id = str(time.time())
-    classroom_notes_store[classroom_id].append({"id": note_id, "text": note_text})
+def warm_up_classrooms(classroom_ids: list[str] | None = None) -> dict:
+    """
+    Loads components for the given (or configured RAG_WARM_CLASSROOMS) classrooms ahead of time.
+    Returns {classroom_id: True/False} so callers can report which ones failed.
+    """
+    results = {}
+    for classroom_id in (warm_classroom_ids() if classroom_ids is None else classroom_ids):
+        try:
+            _initialize_classroom_components(classroom_id)
+            results[classroom_id] = True
+        except Exception as e:
+            logger.warning("Warm-up failed: %s", e, extra={"classroom_id": classroom_id})
+            results[classroom_id] = False
+    return results
+
+# --- Hot swap after re-indexing (ingestion jobs, see ingestion_jobs.py) ---
+# Classrooms an ingestion job is re-indexing in some worker process; set by the job runner
+_reindexing_classrooms: frozenset[str] = frozenset()
+
+def set_reindexing_classrooms(classroom_ids) -> None:
+    global _reindexing_classrooms
+    _reindexing_classrooms = frozenset(classroom_ids)
+
+def swap_in_classroom(classroom_id: str) -> bool:
+    """
+    Rebuilds a loaded classroom's components from its current index and replaces the
+    cached entry in one step; requests use the old components until then, and the old
+    vector store is closed after the eviction delay. Classrooms that are not loaded are
+    left alone (their next request loads the new index). Returns True if swapped.
+    """
+    # The manifest (name, update time) changed even if nobody has loaded the classroom
+    invalidate_classroom_catalog()
+    if classroom_id not in initialized_components_cache:
+        return False
+    components = _build_and_sync_notes(classroom_id)
+    initialized_components_cache.put(classroom_id, components)
+    # Answers stored while the old components were still serving the new index version
+    answer_cache.invalidate(classroom_id)
+    logger.info("Swapped in re-indexed components", extra={"classroom_id": classroom_id})
+    return True
+
+def close_all_classrooms(notes_timeout: float = 30.0) -> None:
+    """Drops every cached classroom (used at shutdown), after queued note indexing has finished."""
+    # The indexer runs one task at a time, so this completes once everything queued before it has
+    try:
+        _notes_indexer.submit(lambda: None).result(timeout=notes_timeout)
+    except Exception as e:
+        logger.warning("Note indexing still running at shutdown: %s", e)
+    initialized_components_cache.clear()
+    shared_index.close()
+
+def get_service_stats() -> dict:
+    """Returns runtime counters for the RAG service."""
+    return {
+        "rag_limiter": rag_limiter.stats(),
+        "component_cache": initialized_components_cache.stats(),
+        "clients": clients.registry_stats(),
+        "answer_cache": answer_cache.stats(),
+        "coalescing": rag_coalescer.stats(),
+        "context": context_assembler.stats(),
+        "resilience": resilience.stats(),
+        "embedding_store": embedding_store.stats(),
+        "shared_index": shared_index.stats(),
+        "ingestion_jobs": job_runner.stats(),
+    }
+
+# --- Scrape-time gauges for /metrics (values read from the components' own stats) ---
+_SERVICE_GAUGES = metrics.registry.register(metrics.Gauge(
+    "rag_service_state", "Current state of the limiter, caches and backend circuit breakers.", ("component", "field")))
+
+def _collect_service_gauges() -> None:
+    limiter = rag_limiter.stats()
+    components = initialized_components_cache.stats()
+    answers = answer_cache.stats()
+    for component, stats, fields in (
+        ("rag_limiter", limiter, ("running", "waiting", "max_concurrency", "max_queue_depth")),
+        ("component_cache", components, ("entries", "estimated_bytes", "hits", "misses", "evictions")),
+        ("answer_cache", answers, ("entries", "exact_hits", "semantic_hits", "misses", "invalidations")),
+        ("coalescing", rag_coalescer.stats(), ("in_flight", "leaders", "coalesced")),
+        ("context", context_assembler.stats(), ("requests", "retrieved_tokens", "context_tokens", "saved_tokens")),
+    ):
+        for field in fields:
+            _SERVICE_GAUGES.set(stats[field], component=component, field=field)
+    for dependency, stats in resilience.stats().items():
+        breaker = stats["breaker"]
+        _SERVICE_GAUGES.set(0 if breaker["state"] == "closed" else 1, component=f"{dependency}_breaker", field="open")
+        _SERVICE_GAUGES.set(breaker["opened"], component=f"{dependency}_breaker", field="opened")
+        for field in ("retried", "timeouts", "failures", "hedges", "hedge_wins"):
+            _SERVICE_GAUGES.set(stats[field], component=dependency, field=field)
+    _SERVICE_GAUGES.set(limiter["oldest_wait_seconds"], component="rag_limiter", field="oldest_wait_seconds")
+    for classroom_id, stats in limiter["classrooms"].items():
+        for field in ("running", "waiting", "oldest_wait_seconds"):
+            metrics.CLASSROOM_QUEUE.set(stats[field], classroom=classroom_id, field=field)
+
+metrics.registry.add_collector(_collect_service_gauges)
 
-    print(f"Note added to classroom '{classroom_id}'. Total notes: {len(classroom_notes_store[classroom_id])}")
-    # In a real app, save this to a persistent database
+# --- MVP2: Service function for adding notes ---
+def add_note_to_classroom(classroom_id: str, note_text: str) -> int:
+    """
+    Saves a note for a classroom in the persistent notes store and schedules it
+    to be embedded into the classroom's vector index in the background.
+    Returns the note's ID (monotonically increasing).
+    """
+    note_id = notes_store.add_note(classroom_id, note_text)
+    # Cached answers are dropped once the note is indexed: that changes the index version they are stored under
+    _notes_indexer.submit(_sync_notes_index, classroom_id)
+    logger.info("Note added", extra={"classroom_id": classroom_id, "note_id": note_id})
     return note_id
 
-def get_classroom_notes(classroom_id: str) -> list[dict]:
-     """Retrieves all notes for a given classroom."""
-     global classroom_notes_store
-     return classroom_notes_store.get(classroom_id, [])
+def get_classroom_notes(classroom_id: str, limit: int = 50, after_id: int | None = None) -> list[dict]:
+     """Retrieves a page of notes for a classroom, oldest first, starting after after_id."""
+     return notes_store.list_notes(classroom_id, limit=limit, after_id=after_id)
+
+def _sync_notes_index(classroom_id: str) -> int:
+    """
+    Embeds any of the classroom's notes that are missing from its vector store.
+    Runs on the notes indexer thread after a note is added and after a classroom is
+    loaded (a full populate_db.py rebuild starts without notes). Returns notes added.
+    """
+    try:
+        vectorstore_path = os.path.join(CHROMA_DBS_ROOT, classroom_id)
+        if not os.path.isdir(vectorstore_path):
+            # No index yet; notes get indexed once populate_db.py has built one
+            return 0
+        notes = notes_store.all_notes(classroom_id)
+        if not notes:
+            return 0
 
+        components = _initialize_classroom_components(classroom_id)
+        from .retrieval import existing_ids # Loaded by the build above
+
+        vectorstore = components["vectorstore"]
+        note_ids = [f"{NOTE_ID_PREFIX}{note['id']}" for note in notes]
+        # Another worker may be syncing the same notes: check and add under the lock
+        # (note IDs are unique across classrooms, so they need no prefix in the shared index)
+        with (shared_write_lock() if SHARED_INDEX_ENABLED else index_write_lock(vectorstore_path)):
+            if SHARED_INDEX_ENABLED:
+                # Write through the latest collection, not one another process has written to since
+                vectorstore = shared_index.get(clients.get_query_embeddings())
+            present = existing_ids(vectorstore, note_ids)
+            missing = [note for note, chroma_id in zip(notes, note_ids) if chroma_id not in present]
+            if missing:
+                vectorstore.add_texts(
+                    texts=[note["text"] for note in missing],
+                    metadatas=[{"source": "teacher_note", "note_id": note["id"], "classroom_id": classroom_id}
+                               for note in missing],
+                    ids=[f"{NOTE_ID_PREFIX}{note['id']}" for note in missing],
+                )
+                if SHARED_INDEX_ENABLED:
+                    shared_index.mark_written(vectorstore)
+        if missing:
+            logger.info("Indexed %d note(s)", len(missing), extra={"classroom_id": classroom_id})
+        notes_store.mark_indexed([note["id"] for note in notes])
+        # This worker's store already holds the notes, no reload needed here: swap in a copy
+        # carrying the new version (cached answers under the old one are no longer served)
+        initialized_components_cache.replace(
+            classroom_id, components, dict(components, index_version=_index_version(classroom_id)))
+        return len(missing)
+    except Exception:
+        logger.exception("Failed to index notes", extra={"classroom_id": classroom_id})
+        return 0
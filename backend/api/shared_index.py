@@ -0,0 +1,145 @@
+# backend/api/shared_index.py
+import logging
+import os
+import threading
+
+from . import index_lock
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Index layout: "per_classroom" (one Chroma directory per classroom under chroma_dbs/) or
+# "shared" (every classroom's chunks in one Chroma collection, tagged with classroom_id
+# metadata; chroma_dbs/<classroom_id> then only holds the manifest and lexical index)
+RAG_INDEX_LAYOUT = os.getenv("RAG_INDEX_LAYOUT", "per_classroom").lower()
+SHARED_INDEX_ENABLED = RAG_INDEX_LAYOUT == "shared"
+SHARED_INDEX_PATH = os.getenv("RAG_SHARED_INDEX_PATH", "chroma_shared")
+# Replaced collections are closed after this delay so in-flight searches can finish with them
+SHARED_INDEX_CLOSE_DELAY_SECONDS = float(os.getenv("RAG_EVICTION_CLOSE_DELAY_SECONDS", "30"))
+
+# Touched after every write; processes holding the collection open reopen it when it changes
+# (Chroma does not see another process's writes in a collection it already has open)
+STAMP_FILENAME = "index_stamp"
+PAGE_SIZE = 1000
+
+
+def shared_chunk_id(classroom_id: str, chunk_id: str) -> str:
+    """ID of a classroom's chunk in the shared collection (chunk IDs are only unique per classroom)."""
+    return f"{classroom_id}/{chunk_id}"
+
+
+def classroom_filter(classroom_id: str) -> dict:
+    """Chroma metadata filter selecting one classroom's chunks."""
+    return {"classroom_id": classroom_id}
+
+
+def iter_classroom_pages(collection, classroom_id: str, include: list[str], page_size: int = PAGE_SIZE):
+    """Yields one classroom's chunks from the shared collection, a Chroma get() page at a time."""
+    offset = 0
+    while True:
+        page = collection.get(where=classroom_filter(classroom_id), include=include, limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+
+def write_lock():
+    """Serializes writes into the shared collection across processes (populate_db.py and backend workers)."""
+    return index_lock.write_lock(SHARED_INDEX_PATH)
+
+
+def read_stamp():
+    try:
+        return os.stat(os.path.join(SHARED_INDEX_PATH, STAMP_FILENAME)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def touch_stamp():
+    """Records that the shared collection changed on disk. Returns the new stamp."""
+    os.makedirs(SHARED_INDEX_PATH, exist_ok=True)
+    path = os.path.join(SHARED_INDEX_PATH, STAMP_FILENAME)
+    with open(path, "a"):
+        pass
+    os.utime(path)
+    return read_stamp()
+
+
+class SharedIndex:
+    """
+    The shared Chroma collection, opened once per process and used by every
+    classroom's retriever (with a classroom_id filter). When another process has
+    written to it (the stamp changed), the next get() opens it afresh; the replaced
+    store is closed after SHARED_INDEX_CLOSE_DELAY_SECONDS.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._store = None
+        self._stamp = None
+        self.reopens = 0
+
+    def get(self, embeddings):
+        stamp = read_stamp()
+        with self._lock:
+            if self._store is not None and stamp == self._stamp:
+                return self._store
+            # Heavy imports, only needed once a classroom is loaded
+            from langchain_community.vectorstores import Chroma
+            from .retrieval import detach_chroma_path
+
+            if not os.path.isdir(self.path):
+                raise FileNotFoundError(f"Shared index not found at {self.path}. Did populate_db.py run with RAG_INDEX_LAYOUT=shared?")
+            replaced = self._store
+            # Open on a fresh Chroma System so the other process's writes are actually read
+            detach_chroma_path(self.path)
+            self._store = Chroma(persist_directory=self.path, embedding_function=embeddings)
+            self._stamp = stamp
+            if replaced is not None:
+                self.reopens += 1
+                logger.info("Shared index changed on disk, reopened it")
+                self._close_later(replaced)
+            return self._store
+
+    def is_current(self, store) -> bool:
+        """Whether store is still the collection to search (not replaced by a newer one on disk)."""
+        return store is self._store and read_stamp() == self._stamp
+
+    def mark_written(self, store) -> None:
+        """Publishes a write made through store, without making this process reopen it."""
+        stamp = touch_stamp()
+        with self._lock:
+            if store is self._store:
+                self._stamp = stamp
+
+    def _close_later(self, store) -> None:
+        from .retrieval import close_vectorstore
+
+        timer = threading.Timer(SHARED_INDEX_CLOSE_DELAY_SECONDS, close_vectorstore, args=(store,))
+        timer.daemon = True
+        timer.start()
+
+    def close(self) -> None:
+        with self._lock:
+            store, self._store, self._stamp = self._store, None, None
+        if store is not None:
+            from .retrieval import close_vectorstore
+
+            close_vectorstore(store)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"enabled": SHARED_INDEX_ENABLED, "open": self._store is not None, "reopens": self.reopens}
+            store = self._store
+        if store is not None:
+            try:
+                stats["chunks"] = store._collection.count()
+            except Exception:
+                pass
+        return stats
+
+
+# --- Process-wide shared collection ---
+shared_index = SharedIndex(SHARED_INDEX_PATH)
@@ -0,0 +1,155 @@
+# backend/api/static_assets.py
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+
+from fastapi import Request, Response
+
+try:
+    import brotli # Optional: without it only gzip copies are prepared
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Re-read a frontend file when it changes on disk (for development; run_backend.py turns it on)
+FRONTEND_RELOAD = os.getenv("FRONTEND_RELOAD", "false").lower() == "true"
+# Browser cache lifetime of frontend files other than HTML. HTML is always revalidated
+# (Cache-Control: no-cache), which costs one small 304 response while it is unchanged.
+FRONTEND_ASSET_MAX_AGE_SECONDS = int(os.getenv("FRONTEND_ASSET_MAX_AGE_SECONDS", "604800"))
+# Files smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 256
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+def parse_accept_encoding(header: str) -> set[str]:
+    """Content codings the client accepts (q=0 excluded)."""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def etag_matches(if_none_match: str | None, etags) -> bool:
+    """Whether an If-None-Match header names one of etags (weak comparison, as RFC 9110 asks for)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(etag in candidates for etag in etags)
+
+
+def not_modified(etag: str, cache_control: str, vary: str | None = None) -> Response:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if vary:
+        headers["Vary"] = vary
+    return Response(status_code=304, headers=headers)
+
+
+class _Asset:
+    """One file's bytes, its precompressed copies and their (strong) ETags."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        with open(path, "rb") as f:
+            body = f.read()
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        self.media_type = media_type
+        self.cache_control = "no-cache" if media_type.startswith("text/html") else f"public, max-age={FRONTEND_ASSET_MAX_AGE_SECONDS}"
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.bodies = {"identity": (body, f'"{digest}"')} # coding -> (bytes, etag)
+        if len(body) >= MIN_COMPRESS_BYTES and media_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=11)
+            for coding, data in compressed.items():
+                if len(data) < len(body):
+                    self.bodies[coding] = (data, f'"{digest}-{coding}"')
+
+    def response(self, request: Request) -> Response:
+        accepted = parse_accept_encoding(request.headers.get("accept-encoding", ""))
+        coding = next((c for c in ("br", "gzip") if c in self.bodies and c in accepted), "identity")
+        body, etag = self.bodies[coding]
+        vary = "Accept-Encoding" if len(self.bodies) > 1 else None
+        # Any coding of the same content is still valid for the client
+        if etag_matches(request.headers.get("if-none-match"), [tag for _, tag in self.bodies.values()]):
+            return not_modified(etag, self.cache_control, vary)
+        headers = {"ETag": etag, "Cache-Control": self.cache_control}
+        if vary:
+            headers["Vary"] = vary
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(content=body, media_type=self.media_type, headers=headers)
+
+
+class StaticAssets:
+    """
+    The frontend files, read and precompressed (gzip, and brotli when installed) once
+    at startup and then served from memory with ETags and 304 handling. Only files
+    present at load time are served, so request paths never reach the file system.
+    """
+
+    def __init__(self, directory: str, reload: bool = FRONTEND_RELOAD):
+        self.directory = directory
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._assets: dict[str, _Asset] | None = None
+
+    def load(self) -> None:
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                try:
+                    assets[relative] = _Asset(path)
+                except OSError as e:
+                    logger.error("Could not load frontend file %s: %s", path, e)
+        with self._lock:
+            self._assets = assets
+        logger.info("Loaded %d frontend file(s) from %s (brotli %s)",
+                    len(assets), self.directory, "on" if brotli is not None else "not installed")
+
+    def get(self, name: str) -> _Asset | None:
+        if self._assets is None:
+            self.load()
+        asset = self._assets.get(name)
+        if self.reload:
+            path = asset.path if asset else os.path.join(self.directory, name)
+            try:
+                if asset is None or os.stat(path).st_mtime_ns != asset.mtime_ns:
+                    if os.path.realpath(path).startswith(os.path.realpath(self.directory) + os.sep):
+                        asset = _Asset(path)
+                        with self._lock:
+                            self._assets[name] = asset
+            except OSError:
+                return asset
+        return asset
+
+    def stats(self) -> dict:
+        assets = self._assets or {}
+        return {
+            "files": len(assets),
+            "bytes": sum(len(asset.bodies["identity"][0]) for asset in assets.values()),
+            "compressed_bytes": {
+                name: {coding: len(body) for coding, (body, _) in asset.bodies.items()} for name, asset in assets.items()
+            },
+            "brotli": brotli is not None,
+        }
@@ -0,0 +1,337 @@
+# backend/api/vector_index.py
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from .index_lock import swap_directory
+
+# --- Configuration ---
+# Vector store the backend searches: "chroma", or "mmap" for the quantized, memory-mapped
+# index that populate_db.py / migrate_vector_index.py write next to the Chroma files
+RAG_VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma").lower()
+# Storage type of memory-mapped vectors: "int8" (1 byte per dimension) or "float16" (2 bytes)
+MMAP_INDEX_DTYPE = os.getenv("MMAP_INDEX_DTYPE", "int8").lower()
+# Indexes with at least this many chunks are split into ~sqrt(n) IVF partitions (0 = never)
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "50000"))
+# Partitions scanned per query; higher is slower but closer to an exact search
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+
+MMAP_INDEX_DIRNAME = "mmap_index"
+MMAP_INDEX_VERSION = 1
+# Rows dequantized and scored at a time, bounding the temporary float32 memory
+_SEARCH_BLOCK_ROWS = 16384
+# Notes added at runtime (small, float32, rewritten on every add)
+_OVERLAY_FILENAME = "notes_overlay.npz"
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _quantize(matrix: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray]:
+    """Returns (stored rows, per-row scales); row ~= stored row * scale."""
+    if dtype == "float16":
+        return matrix.astype(np.float16), np.ones(len(matrix), dtype=np.float32)
+    if dtype != "int8":
+        raise ValueError(f"Unsupported vector dtype '{dtype}' (use 'int8' or 'float16')")
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def _kmeans(matrix: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the rows; returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    sample = matrix[rng.choice(len(matrix), min(len(matrix), nlist * 256), replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(nlist):
+            members = sample[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids.astype(np.float32)
+
+
+def write_mmap_index(directory: str, ids: list[str], texts: list[str], metadatas: list[dict],
+                     embeddings, dtype: str = MMAP_INDEX_DTYPE, nlist: int | None = None) -> dict:
+    """
+    Writes a memory-mappable index into <directory>/mmap_index, replacing any existing one.
+    Embeddings are normalized and stored quantized; with nlist partitions the rows are
+    stored grouped by partition so each one is a contiguous slice. Returns the index metadata.
+    """
+    if not ids:
+        raise ValueError("Cannot build a vector index without any chunks.")
+    vectors, scales = _quantize(_normalize(np.asarray(embeddings, dtype=np.float32)), dtype)
+    if nlist is None:
+        nlist = int(np.sqrt(len(ids))) if IVF_MIN_ROWS and len(ids) >= IVF_MIN_ROWS else 0
+
+    order = np.arange(len(ids))
+    centroids = list_offsets = None
+    if nlist:
+        dequantized = vectors.astype(np.float32) * scales[:, None]
+        centroids = _kmeans(dequantized, nlist)
+        assignment = np.concatenate([
+            np.argmax(dequantized[start:start + _SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+            for start in range(0, len(ids), _SEARCH_BLOCK_ROWS)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        list_offsets = np.searchsorted(assignment[order], np.arange(nlist + 1)).astype(np.int64)
+
+    index_path = os.path.join(directory, MMAP_INDEX_DIRNAME)
+    tmp_path = index_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, "vectors.npy"), vectors[order])
+    np.save(os.path.join(tmp_path, "scales.npy"), scales[order])
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    with open(os.path.join(tmp_path, "records.bin"), "wb") as f:
+        for row, source_row in enumerate(order):
+            record = json.dumps({"id": ids[source_row], "text": texts[source_row], "metadata": metadatas[source_row] or {}},
+                                ensure_ascii=False).encode("utf-8")
+            f.write(record)
+            offsets[row + 1] = offsets[row] + len(record)
+    np.save(os.path.join(tmp_path, "record_offsets.npy"), offsets)
+    stored_ids = np.array([ids[i] for i in order], dtype=str)
+    id_order = np.argsort(stored_ids)
+    np.save(os.path.join(tmp_path, "sorted_ids.npy"), stored_ids[id_order])
+    np.save(os.path.join(tmp_path, "sorted_rows.npy"), id_order.astype(np.int64))
+    if nlist:
+        np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+        np.save(os.path.join(tmp_path, "list_offsets.npy"), list_offsets)
+
+    meta = {
+        "version": MMAP_INDEX_VERSION,
+        "count": len(ids),
+        "dim": int(vectors.shape[1]),
+        "dtype": dtype,
+        "nlist": nlist,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    # Notes added at runtime are not in the collection the index was built from: keep them
+    copy_overlay(index_path, tmp_path)
+
+    # Swap in atomically: processes with the old files mapped keep reading them until they reopen
+    swap_directory(tmp_path, index_path)
+    return meta
+
+
+def build_from_collection(collection, directory: str, dtype: str = MMAP_INDEX_DTYPE,
+                          nlist: int | None = None, page_size: int = 1000) -> dict:
+    """Exports every chunk of a Chroma collection (stored embeddings included) as a memory-mapped index."""
+    ids, texts, metadatas, embeddings = [], [], [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+        if not len(page["ids"]):
+            break
+        ids.extend(page["ids"])
+        texts.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        embeddings.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    return write_mmap_index(directory, ids, texts, metadatas,
+                            np.concatenate(embeddings) if embeddings else [], dtype=dtype, nlist=nlist)
+
+
+def copy_overlay(source_index_path: str, target_index_path: str) -> bool:
+    """Copies the notes overlay of one mmap_index directory into another. Returns False if there is none."""
+    source = os.path.join(source_index_path, _OVERLAY_FILENAME)
+    if not os.path.exists(source):
+        return False
+    target = os.path.join(target_index_path, _OVERLAY_FILENAME)
+    shutil.copyfile(source, target + ".tmp.npz")
+    os.replace(target + ".tmp.npz", target)
+    return True
+
+
+def has_mmap_index(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, MMAP_INDEX_DIRNAME, "meta.json"))
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        return scores[best], rows[best]
+    return scores, rows
+
+
+class MmapVectorStore:
+    """
+    Read-optimized classroom vector store over the files written by write_mmap_index().
+    The quantized vectors, chunk records and ID lookup table are memory-mapped, so
+    opening a classroom is near-instant, pages are only read when searched, and
+    worker processes share them through the OS page cache.
+
+    Search is an exact dot-product scan (cosine similarity, vectors are normalized),
+    or a scan of the IVF_NPROBE closest partitions when the index is partitioned.
+    Notes added at runtime are kept in a small float32 overlay file next to the index.
+    """
+
+    def __init__(self, directory: str, embedding_function=None, nprobe: int = IVF_NPROBE):
+        self.directory = directory
+        self.embedding_function = embedding_function
+        self.nprobe = nprobe
+        # Resolved once, so every file comes from the same version even if a new one is swapped in
+        index_path = os.path.realpath(os.path.join(directory, MMAP_INDEX_DIRNAME))
+        with open(os.path.join(index_path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != MMAP_INDEX_VERSION:
+            raise ValueError(f"Unsupported memory-mapped index version at {index_path}; rebuild it.")
+        self.dim = self.meta["dim"]
+
+        def load(name):
+            return np.load(os.path.join(index_path, name), mmap_mode="r", allow_pickle=False)
+
+        self.vectors = load("vectors.npy")
+        self.scales = load("scales.npy")
+        self.record_offsets = load("record_offsets.npy")
+        self.sorted_ids = load("sorted_ids.npy")
+        self.sorted_rows = load("sorted_rows.npy")
+        self._records = np.memmap(os.path.join(index_path, "records.bin"), dtype=np.uint8, mode="r")
+        self.centroids = self.list_offsets = None
+        if self.meta.get("nlist"):
+            self.centroids = np.load(os.path.join(index_path, "centroids.npy"), allow_pickle=False)
+            self.list_offsets = np.load(os.path.join(index_path, "list_offsets.npy"), allow_pickle=False)
+
+        self._overlay_path = os.path.join(index_path, _OVERLAY_FILENAME)
+        self._lock = threading.Lock()
+        self._load_overlay()
+
+    # --- Runtime additions (notes) ---
+    def _load_overlay(self) -> None:
+        ids, texts, metadatas, vectors = [], [], [], np.zeros((0, self.dim), dtype=np.float32)
+        if os.path.exists(self._overlay_path):
+            with np.load(self._overlay_path, allow_pickle=False) as data:
+                ids, texts = data["ids"].tolist(), data["texts"].tolist()
+                metadatas = [json.loads(m) for m in data["metadatas"].tolist()]
+                vectors = data["vectors"]
+        with self._lock:
+            self._overlay_ids, self._overlay_texts, self._overlay_metadatas = ids, texts, metadatas
+            self._overlay_vectors = vectors
+            self._overlay_index = {chunk_id: i for i, chunk_id in enumerate(ids)}
+
+    def add_texts(self, texts: list[str], metadatas: list[dict] | None = None, ids: list[str] | None = None) -> list[str]:
+        """Embeds and adds texts to the overlay (callers serialize writers across processes)."""
+        if self.embedding_function is None:
+            raise RuntimeError("MmapVectorStore was opened without an embedding function.")
+        ids = ids or [f"overlay-{time.time_ns()}-{i}" for i in range(len(texts))]
+        metadatas = metadatas or [{} for _ in texts]
+        new_vectors = _normalize(np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32))
+        self._load_overlay() # Another process may have added rows since we loaded
+        replaced = set(ids)
+        with self._lock:
+            keep = [i for i, chunk_id in enumerate(self._overlay_ids) if chunk_id not in replaced]
+            all_ids = [self._overlay_ids[i] for i in keep] + list(ids)
+            all_texts = [self._overlay_texts[i] for i in keep] + list(texts)
+            all_metadatas = [self._overlay_metadatas[i] for i in keep] + list(metadatas)
+            all_vectors = np.concatenate([self._overlay_vectors[keep], new_vectors])
+        tmp_path = self._overlay_path + ".tmp.npz"
+        np.savez(tmp_path, ids=np.array(all_ids, dtype=str), texts=np.array(all_texts, dtype=str),
+                 metadatas=np.array([json.dumps(m, ensure_ascii=False) for m in all_metadatas], dtype=str),
+                 vectors=all_vectors.astype(np.float32))
+        os.replace(tmp_path, self._overlay_path)
+        self._load_overlay()
+        return list(ids)
+
+    # --- Lookups ---
+    def count(self) -> int:
+        return len(self.vectors) + len(self._overlay_ids)
+
+    def _row_for_id(self, chunk_id: str):
+        position = int(np.searchsorted(self.sorted_ids, chunk_id))
+        if position < len(self.sorted_ids) and self.sorted_ids[position] == chunk_id:
+            return int(self.sorted_rows[position])
+        return None
+
+    def existing_ids(self, ids: list[str]) -> set[str]:
+        self._load_overlay()
+        return {chunk_id for chunk_id in ids if chunk_id in self._overlay_index or self._row_for_id(chunk_id) is not None}
+
+    def _document(self, row: int) -> Document:
+        if row >= len(self.vectors):
+            i = row - len(self.vectors)
+            return Document(id=self._overlay_ids[i], page_content=self._overlay_texts[i], metadata=self._overlay_metadatas[i])
+        start, end = int(self.record_offsets[row]), int(self.record_offsets[row + 1])
+        record = json.loads(bytes(self._records[start:end]).decode("utf-8"))
+        return Document(id=record["id"], page_content=record["text"], metadata=record["metadata"])
+
+    def get_by_ids(self, ids: list[str]) -> dict[str, Document]:
+        found = {}
+        for chunk_id in ids:
+            if chunk_id in self._overlay_index:
+                row = len(self.vectors) + self._overlay_index[chunk_id]
+            else:
+                row = self._row_for_id(chunk_id)
+            if row is not None:
+                found[chunk_id] = self._document(row)
+        return found
+
+    # --- Search ---
+    def _score_rows(self, start: int, end: int, queries: np.ndarray) -> np.ndarray:
+        """Similarity of rows [start, end) to each query, shape (rows, queries)."""
+        block = self.vectors[start:end].astype(np.float32)
+        return (block @ queries.T) * self.scales[start:end, None]
+
+    def _ranges(self, query: np.ndarray) -> list[tuple[int, int]]:
+        if self.centroids is None:
+            return [(0, len(self.vectors))]
+        probes = np.argsort(-(self.centroids @ query))[:self.nprobe]
+        return [(int(self.list_offsets[c]), int(self.list_offsets[c + 1])) for c in sorted(probes)]
+
+    def search(self, query_embeddings, k: int) -> list[list[Document]]:
+        """Returns the k most similar chunks for each query embedding, best first."""
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Query embeddings have {queries.shape[1]} dimensions, the index has {self.dim}.")
+        empty = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64))
+        best = [empty] * len(queries)
+
+        def merge(i, scores, rows):
+            best[i] = _top_k(np.concatenate([best[i][0], scores]), np.concatenate([best[i][1], rows]), k)
+
+        if self.centroids is None:
+            # Flat scan: every block is scored against all queries at once
+            for start in range(0, len(self.vectors), _SEARCH_BLOCK_ROWS):
+                end = min(start + _SEARCH_BLOCK_ROWS, len(self.vectors))
+                scores = self._score_rows(start, end, queries)
+                rows = np.arange(start, end)
+                for i in range(len(queries)):
+                    merge(i, scores[:, i], rows)
+        else:
+            for i, query in enumerate(queries):
+                for range_start, range_end in self._ranges(query):
+                    for start in range(range_start, range_end, _SEARCH_BLOCK_ROWS):
+                        end = min(start + _SEARCH_BLOCK_ROWS, range_end)
+                        merge(i, self._score_rows(start, end, query[None, :])[:, 0], np.arange(start, end))
+
+        with self._lock:
+            overlay = self._overlay_vectors
+        if len(overlay):
+            overlay_scores = overlay @ queries.T
+            rows = np.arange(len(self.vectors), len(self.vectors) + len(overlay))
+            for i in range(len(queries)):
+                merge(i, overlay_scores[:, i], rows)
+
+        results = []
+        for scores, rows in best:
+            ranked = rows[np.argsort(-scores, kind="stable")]
+            results.append([self._document(int(row)) for row in ranked])
+        return results
+
+    def close(self) -> None:
+        """Drops the mappings; the OS unmaps the files once no array refers to them."""
+        self.vectors = self.scales = self.record_offsets = self.sorted_ids = self.sorted_rows = None
+        self._records = None
@@ -1,22 +1,50 @@
 # backend/main.py (Updated to serve frontend)
 import os
-from fastapi import FastAPI
+import signal
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+# Load .env before importing the API modules so their configuration constants see it
+load_dotenv()
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 # Import the API router
 from .api import routes
+from .api import services
+from .api import metrics
+from .api.ingestion_jobs import job_runner
+from .api.static_assets import StaticAssets
+from .api.logging_config import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # --- Define Paths ---
 # Get the directory where main.py is located (backend/)
 CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 # Get the project root directory (one level up from backend/)
 PROJECT_ROOT = os.path.dirname(CURRENT_SCRIPT_DIR)
-# Define the path to the index.html file within the frontend directory
-INDEX_HTML_PATH = os.path.join(PROJECT_ROOT, "frontend", "index.html")
+# The frontend files (index.html), served from memory by frontend_assets
+FRONTEND_DIR = os.path.join(PROJECT_ROOT, "frontend")
 # --- END DEFINE PATHS ---
 
+frontend_assets = StaticAssets(FRONTEND_DIR)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Runs the startup hooks (see below) in order, and the shutdown hook once the server stops."""
+    await warm_up_hot_classrooms()
+    await report_draining_on_exit_signal()
+    await load_frontend()
+    await start_ingestion_jobs()
+    yield
+    await close_classrooms()
+
 # Create the FastAPI app instance
-app = FastAPI(title="Localized Learning Companion MVP - Backend")
+app = FastAPI(title="Localized Learning Companion MVP - Backend", lifespan=lifespan)
 
 # --- CORS Middleware ---
 # Allows the frontend served potentially on a different origin (like IDX preview URL)
@@ -35,22 +63,115 @@ app.add_middleware(
 # All routes defined in there will be prefixed with /api
 app.include_router(routes.router)
 
+# Seconds a worker keeps serving after SIGTERM/SIGINT while /readyz reports "draining",
+# so load balancers stop sending it traffic before it stops accepting connections
+READINESS_DRAIN_SECONDS = float(os.getenv("READINESS_DRAIN_SECONDS", "0"))
+
+# --- Startup / shutdown hooks (run by lifespan above) ---
+# Readiness: "starting" until warm-up has finished, "ready", then "draining" during shutdown
+app.state.readiness = "starting"
+app.state.warmup_results = {}
+
+async def warm_up_hot_classrooms():
+    """
+    Pre-loads the classrooms listed in RAG_WARM_CLASSROOMS in the background,
+    so the first lesson of the day doesn't pay the cold-start cost.
+    /readyz reports ready once this has finished.
+    """
+    classroom_ids = services.warm_classroom_ids()
+    if not classroom_ids:
+        app.state.readiness = "ready"
+        return
+
+    async def warm_up():
+        logger.info("Warming up classrooms: %s", ", ".join(classroom_ids))
+        try:
+            app.state.warmup_results = await asyncio.to_thread(services.warm_up_classrooms, classroom_ids)
+        finally:
+            if app.state.readiness == "starting":
+                app.state.readiness = "ready"
+                logger.info("Warm-up finished; ready to serve")
+
+    # Keep a reference so the task isn't garbage collected while running
+    app.state.warmup_task = asyncio.create_task(warm_up())
+
+async def report_draining_on_exit_signal():
+    """
+    Wraps the server's SIGTERM/SIGINT handlers: the first signal switches /readyz to
+    "draining" and hands the signal on after READINESS_DRAIN_SECONDS (the server then
+    stops accepting connections and finishes in-flight requests). A second signal is
+    handed on at once. Shutdown hooks run too late for the probe to see this.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return # Signal handlers can only be installed from the main thread
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        server_handler = signal.getsignal(sig)
+        if not callable(server_handler):
+            continue
+
+        def handle_exit(signum, frame, server_handler=server_handler):
+            if app.state.readiness == "draining" or READINESS_DRAIN_SECONDS <= 0:
+                app.state.readiness = "draining"
+                server_handler(signum, frame)
+                return
+            app.state.readiness = "draining"
+            logger.info("Exit signal received; draining for %.0fs before shutting down", READINESS_DRAIN_SECONDS)
+            loop.call_soon_threadsafe(loop.call_later, READINESS_DRAIN_SECONDS, server_handler, signum, frame)
+
+        signal.signal(sig, handle_exit)
+
+async def load_frontend():
+    """Reads and precompresses the frontend once, so page loads are served from memory."""
+    await asyncio.to_thread(frontend_assets.load)
+
+async def start_ingestion_jobs():
+    """Starts this process's ingestion job runner (background threads, see ingestion_jobs.py)."""
+    job_runner.start()
+
+async def close_classrooms():
+    """Stops the ingestion job runner, then closes all cached classroom vector stores."""
+    app.state.readiness = "draining"
+    # Both wait on background threads (up to seconds); keep the event loop free meanwhile
+    await asyncio.to_thread(job_runner.stop)
+    await asyncio.to_thread(services.close_all_classrooms)
+
+# --- Health probes ---
+@app.get("/healthz", include_in_schema=False)
+async def liveness():
+    """Liveness: the process is up and its event loop is responsive."""
+    return {"status": "ok", "pid": os.getpid()}
+
+@app.get("/readyz", include_in_schema=False)
+async def readiness():
+    """Readiness: 200 once warm-up has finished, 503 while starting or draining."""
+    body = {"status": app.state.readiness, "pid": os.getpid(), "warm_classrooms": app.state.warmup_results}
+    status_code = 200 if app.state.readiness == "ready" else 503
+    return JSONResponse(body, status_code=status_code)
+
+# --- Prometheus metrics ---
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    """Exposes RAG request, stage latency and cache metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 # --- Root route to serve the frontend ---
 @app.get("/")
-async def serve_index():
-    """Serves the index.html file when the root URL is accessed."""
-    # Check if the index.html file exists at the calculated path
-    if not os.path.exists(INDEX_HTML_PATH):
-        print(f"ERROR: index.html not found at expected path: {INDEX_HTML_PATH}")
+async def serve_index(request: Request):
+    """Serves index.html (compressed when the browser accepts it; 304 if the browser's copy is current)."""
+    asset = frontend_assets.get("index.html")
+    if asset is None:
+        logger.error("index.html not found in %s", FRONTEND_DIR)
         # Return a simple error message if the file is missing
         return {"error": "Frontend not found."}
-    # Return the index.html file as a response
-    return FileResponse(INDEX_HTML_PATH)
+    return asset.response(request)
 # --- END NEW ROOT ROUTE ---
 
-# Example of how you might serve other static files (CSS, JS) if needed later:
-# from fastapi.staticfiles import StaticFiles
-# FRONTEND_DIR = os.path.join(PROJECT_ROOT, "frontend")
-# app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
-# Then link to them in index.html like <link rel="stylesheet" href="/static/styles.css">
+# Other frontend files (CSS, JS), linked from index.html like <link rel="stylesheet" href="/static/styles.css">
+@app.get("/static/{path:path}", include_in_schema=False)
+async def serve_static(path: str, request: Request):
+    asset = frontend_assets.get(path)
+    if asset is None:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    return asset.response(request)
 
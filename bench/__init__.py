@@ -0,0 +1,2 @@
+# bench/__init__.py
+# Offline benchmark harness (python -m bench.run). Not imported by the app.
@@ -0,0 +1,68 @@
+# bench/corpus.py
+# Synthetic, reproducible curriculum documents and questions for benchmarks.
+import os
+import random
+
+# Small topic vocabularies so questions actually overlap with some documents
+_TOPICS = {
+    "geometry": "triangle angle hypotenuse pythagoras theorem circle radius area perimeter polygon".split(),
+    "algebra": "equation variable quadratic factor polynomial root coefficient linear slope graph".split(),
+    "statistics": "mean median mode variance probability sample distribution histogram outlier".split(),
+    "ai": "model training data neural network gradient loss classifier feature prediction".split(),
+    "physics": "force mass velocity acceleration energy momentum friction gravity wave".split(),
+}
+_FILLER = "the a of and to in is that for on with as by this are from it at be which".split()
+
+
+def _sentence(rng: random.Random, topic_words: list[str]) -> str:
+    words = [rng.choice(topic_words) if rng.random() < 0.35 else rng.choice(_FILLER) for _ in range(rng.randint(8, 18))]
+    return " ".join(words).capitalize() + "."
+
+
+def generate_corpus(root: str, classrooms: int = 2, files_per_classroom: int = 10, chars_per_file: int = 20_000,
+                    seed: int = 0) -> dict:
+    """
+    Writes plain-text documents under root/<classroom>/ and returns a CLASSROOMS
+    dict in populate_db.py's format (curriculum paths relative to root).
+    """
+    rng = random.Random(seed)
+    topic_names = sorted(_TOPICS)
+    config = {}
+    for c in range(classrooms):
+        classroom_id = f"bench_classroom_{c}"
+        subdir = f"classroom_bench_{c}"
+        os.makedirs(os.path.join(root, subdir), exist_ok=True)
+        for f in range(files_per_classroom):
+            topic = topic_names[(c + f) % len(topic_names)]
+            sentences, size = [], 0
+            while size < chars_per_file:
+                sentence = _sentence(rng, _TOPICS[topic])
+                sentences.append(sentence)
+                size += len(sentence) + 1
+                if rng.random() < 0.1:
+                    sentences.append("\n")
+            with open(os.path.join(root, subdir, f"{topic}_{f:03d}.txt"), "w", encoding="utf-8") as out:
+                out.write(" ".join(sentences))
+        config[classroom_id] = {
+            "name": f"Benchmark classroom {c}",
+            "curriculum_path": subdir,
+            "glob_pattern": "**/*.txt",
+        }
+    return config
+
+
+def generate_questions(count: int = 200, repeat_ratio: float = 0.3, seed: int = 0) -> list[str]:
+    """
+    Questions drawn from the corpus topics. repeat_ratio of them repeat an earlier
+    question verbatim, roughly like a class asking about the same lesson.
+    """
+    rng = random.Random(seed)
+    topic_names = sorted(_TOPICS)
+    questions = []
+    for _ in range(count):
+        if questions and rng.random() < repeat_ratio:
+            questions.append(rng.choice(questions))
+            continue
+        words = rng.sample(_TOPICS[rng.choice(topic_names)], 3)
+        questions.append(f"What is the relation between {words[0]}, {words[1]} and {words[2]}?")
+    return questions
@@ -0,0 +1,286 @@
+# bench/fakes.py
+# Deterministic, offline stand-ins for the Vertex AI embeddings and LLM clients.
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from typing import Any, Iterator, AsyncIterator
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+EMBEDDING_DIMENSIONS = 768 # Same size as text-embedding-004
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class LatencyModel:
+    """
+    A seeded latency distribution, parsed from a short spec:
+      "0"                  no delay
+      "const:50"           always 50 ms
+      "uniform:20-80"      uniform between 20 and 80 ms
+      "lognormal:50,0.5"   median 50 ms, sigma 0.5 (long right tail, like real APIs)
+    """
+
+    def __init__(self, spec: str = "0", seed: int = 0):
+        self.spec = spec
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        kind, _, args = spec.partition(":")
+        if kind in ("", "0", "none"):
+            self._sample = lambda r: 0.0
+        elif kind == "const":
+            ms = float(args)
+            self._sample = lambda r: ms
+        elif kind == "uniform":
+            low, high = (float(x) for x in args.split("-"))
+            self._sample = lambda r: r.uniform(low, high)
+        elif kind == "lognormal":
+            median, sigma = (float(x) for x in args.split(","))
+            self._sample = lambda r: median * r.lognormvariate(0.0, sigma)
+        else:
+            raise ValueError(f"Unknown latency spec '{spec}' (use const:, uniform: or lognormal:)")
+
+    def sample_seconds(self) -> float:
+        with self._lock:
+            return max(0.0, self._sample(self._random)) / 1000.0
+
+    def sleep(self) -> None:
+        delay = self.sample_seconds()
+        if delay:
+            time.sleep(delay)
+
+    async def asleep(self) -> None:
+        delay = self.sample_seconds()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class FakeBackendError(ConnectionError):
+    """An injected backend failure; code 503 makes it look like Vertex AI's ServiceUnavailable."""
+
+    code = 503
+
+
+class FaultModel:
+    """
+    Seeded fault injection for the fakes, parsed from a short spec (comma separated):
+      "none"                       no faults
+      "error:0.1"                  10% of requests fail with FakeBackendError
+      "hang:0.05"                  5% of requests hang (for hang_ms, default 60000)
+      "error:0.1,hang:0.05,hang_ms:20000"
+    Settings can be changed while a benchmark runs (set()), e.g. to simulate an
+    outage and its recovery.
+    """
+
+    def __init__(self, spec: str = "none", seed: int = 0):
+        self.spec = spec
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.error_rate = 0.0
+        self.hang_rate = 0.0
+        self.hang_ms = 60_000.0
+        self.errors = 0
+        self.hangs = 0
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            if part == "none":
+                continue
+            kind, _, value = part.partition(":")
+            if kind == "error":
+                self.error_rate = float(value)
+            elif kind == "hang":
+                self.hang_rate = float(value)
+            elif kind == "hang_ms":
+                self.hang_ms = float(value)
+            else:
+                raise ValueError(f"Unknown fault spec '{spec}' (use error:, hang: and hang_ms:)")
+
+    def set(self, error_rate: float | None = None, hang_rate: float | None = None) -> None:
+        with self._lock:
+            if error_rate is not None:
+                self.error_rate = error_rate
+            if hang_rate is not None:
+                self.hang_rate = hang_rate
+
+    def _draw(self) -> str | None:
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.error_rate:
+                self.errors += 1
+                return "error"
+            if roll < self.error_rate + self.hang_rate:
+                self.hangs += 1
+                return "hang"
+            return None
+
+    def inject(self) -> None:
+        """Raises or hangs (blocking) if this request draws a fault."""
+        fault = self._draw()
+        if fault == "hang":
+            time.sleep(self.hang_ms / 1000.0)
+        elif fault == "error":
+            raise FakeBackendError("injected backend failure")
+
+    async def ainject(self) -> None:
+        fault = self._draw()
+        if fault == "hang":
+            await asyncio.sleep(self.hang_ms / 1000.0)
+        elif fault == "error":
+            raise FakeBackendError("injected backend failure")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"spec": self.spec, "errors": self.errors, "hangs": self.hangs}
+
+
+def _hashed_vector(text: str) -> np.ndarray:
+    """
+    Feature-hashed bag of words, L2 normalized. Deterministic, and texts sharing
+    words get similar vectors, so retrieval and the semantic answer cache behave
+    roughly like they do with real embeddings.
+    """
+    vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    for token in _TOKEN_RE.findall(text.casefold()):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % EMBEDDING_DIMENSIONS
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Offline replacement for VertexAIEmbeddings. Every request (single query or batch)
+    waits one sample of request_latency plus per_item_ms per text, and may draw an
+    injected fault (see FaultModel).
+    """
+
+    def __init__(self, model_name: str = "text-embedding-004", request_latency: LatencyModel | None = None,
+                 per_item_ms: float = 0.0, faults: FaultModel | None = None):
+        self.model_name = model_name
+        self.request_latency = request_latency or LatencyModel()
+        self.per_item_ms = per_item_ms
+        self.faults = faults or FaultModel()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+
+    def _request(self, texts: list[str]) -> list[list[float]]:
+        with self._lock:
+            self.requests += 1
+            self.texts += len(texts)
+        self.faults.inject()
+        self.request_latency.sleep()
+        if self.per_item_ms:
+            time.sleep(self.per_item_ms * len(texts) / 1000.0)
+        return [_hashed_vector(text).tolist() for text in texts]
+
+    def embed(self, texts: list[str], embeddings_task_type: str | None = None, **kwargs) -> list[list[float]]:
+        # Same batch entry point as VertexAIEmbeddings (used by CachedQueryEmbeddings)
+        return self._request(list(texts))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._request(list(texts))
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._request([text])[0]
+
+
+class FakeLLM(LLM):
+    """
+    Offline replacement for the VertexAI LLM. Waits time_to_first_token, then emits
+    a deterministic answer built from the prompt's context, one word per
+    inter_token_ms. Async calls sleep on the event loop like a real network client.
+    Requests may draw an injected fault before the first token (see FaultModel).
+    """
+
+    model_name: str = "fake-llm"
+    time_to_first_token: Any = None # LatencyModel
+    faults: Any = None # FaultModel
+    inter_token_ms: float = 0.0
+    answer_words: int = 60
+    calls: int = 0
+
+    def _answer_words(self, prompt: str) -> list[str]:
+        context = prompt.split("Context:", 1)[-1]
+        words = _TOKEN_RE.findall(context) or ["No", "context"]
+        seed = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=4).digest(), "little")
+        start = seed % len(words)
+        return [words[(start + i) % len(words)] for i in range(self.answer_words)]
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-llm"
+
+    def _first_token_latency(self) -> LatencyModel:
+        return self.time_to_first_token or LatencyModel()
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs) -> Iterator[GenerationChunk]:
+        self.calls += 1
+        if self.faults:
+            self.faults.inject()
+        self._first_token_latency().sleep()
+        for i, word in enumerate(self._answer_words(prompt)):
+            if i and self.inter_token_ms:
+                time.sleep(self.inter_token_ms / 1000.0)
+            chunk = GenerationChunk(text=word if i == 0 else " " + word)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, prompt: str, stop=None, run_manager=None, **kwargs) -> AsyncIterator[GenerationChunk]:
+        self.calls += 1
+        if self.faults:
+            await self.faults.ainject()
+        await self._first_token_latency().asleep()
+        for i, word in enumerate(self._answer_words(prompt)):
+            if i and self.inter_token_ms:
+                await asyncio.sleep(self.inter_token_ms / 1000.0)
+            chunk = GenerationChunk(text=word if i == 0 else " " + word)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    async def _acall(self, prompt: str, stop=None, run_manager=None, **kwargs) -> str:
+        return "".join([chunk.text async for chunk in self._astream(prompt, stop, run_manager, **kwargs)])
+
+
+# Fault models of the installed fakes, to change faults mid-run (see install_fakes)
+installed_faults = {"embeddings": FaultModel(), "llm": FaultModel()}
+
+
+def install_fakes(embed_latency: str = "lognormal:40,0.4", llm_latency: str = "lognormal:400,0.5",
+                  inter_token_ms: float = 15.0, seed: int = 0, embed_faults: str = "none",
+                  llm_faults: str = "none") -> dict:
+    """
+    Routes backend.api.clients to the fakes, so services (and anything using its
+    shared clients) run without Vertex AI. Faults are injected per the FaultModel
+    specs; their models are kept in installed_faults. Returns the settings used, for reports.
+    """
+    from backend.api import clients
+
+    installed_faults["embeddings"] = FaultModel(embed_faults, seed + 2)
+    installed_faults["llm"] = FaultModel(llm_faults, seed + 3)
+    clients.set_backend_factories(
+        embeddings=lambda model_name: FakeEmbeddings(model_name, LatencyModel(embed_latency, seed),
+                                                     faults=installed_faults["embeddings"]),
+        llm=lambda model_name, temperature, max_output_tokens: FakeLLM(
+            model_name=model_name,
+            time_to_first_token=LatencyModel(llm_latency, seed + 1),
+            inter_token_ms=inter_token_ms,
+            faults=installed_faults["llm"],
+        ),
+    )
+    return {"embed_latency": embed_latency, "llm_latency": llm_latency, "inter_token_ms": inter_token_ms,
+            "embed_faults": embed_faults, "llm_faults": llm_faults, "seed": seed}
@@ -0,0 +1,208 @@
+# bench/load.py
+# Concurrent HTTP load profiles against the FastAPI app.
+import asyncio
+import random
+import time
+
+import httpx
+import numpy as np
+
+# Request mix per profile: (operation, weight)
+PROFILES = {
+    "ask": [("ask", 1.0)],
+    "ask_stream": [("ask_stream", 1.0)],
+    "notes": [("add_note", 0.2), ("list_notes", 0.8)],
+    "mixed": [("ask", 0.7), ("ask_stream", 0.1), ("add_note", 0.1), ("list_notes", 0.1)],
+}
+
+
+def summarize_latencies(samples: list[float]) -> dict:
+    """Latency percentiles in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+class _Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.first_token: list[float] = []
+        self.statuses: dict[str, int] = {}
+
+    def record(self, operation: str, status: int | str, seconds: float) -> None:
+        key = f"{operation}:{status}"
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        if status in (200, 201):
+            self.latencies.setdefault(operation, []).append(seconds)
+
+
+async def _ask(client: httpx.AsyncClient, classroom_id: str, question: str, recorder: _Recorder) -> None:
+    start = time.perf_counter()
+    response = await client.post("/api/ask", json={"query": question, "classroom_id": classroom_id})
+    recorder.record("ask", response.status_code, time.perf_counter() - start)
+
+
+async def _ask_stream(client: httpx.AsyncClient, classroom_id: str, question: str, recorder: _Recorder) -> None:
+    start = time.perf_counter()
+    first_token_at = None
+    async with client.stream("POST", "/api/ask/stream", json={"query": question, "classroom_id": classroom_id}) as response:
+        status = response.status_code
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event == "token" and first_token_at is None:
+                    first_token_at = time.perf_counter()
+                elif event == "error":
+                    status = "sse_error"
+    if first_token_at is not None:
+        recorder.first_token.append(first_token_at - start)
+    recorder.record("ask_stream", status, time.perf_counter() - start)
+
+
+async def _add_note(client: httpx.AsyncClient, classroom_id: str, question: str, recorder: _Recorder) -> None:
+    start = time.perf_counter()
+    response = await client.post(f"/api/classrooms/{classroom_id}/notes", json={"note_text": f"Reminder about: {question}"})
+    recorder.record("add_note", response.status_code, time.perf_counter() - start)
+
+
+async def _list_notes(client: httpx.AsyncClient, classroom_id: str, question: str, recorder: _Recorder) -> None:
+    start = time.perf_counter()
+    response = await client.get(f"/api/classrooms/{classroom_id}/notes", params={"limit": 50})
+    recorder.record("list_notes", response.status_code, time.perf_counter() - start)
+
+
+_OPERATIONS = {"ask": _ask, "ask_stream": _ask_stream, "add_note": _add_note, "list_notes": _list_notes}
+
+
+async def run_profile(client: httpx.AsyncClient, profile: str, classroom_ids: list[str], questions: list[str],
+                      concurrency: int = 16, requests: int = 200, seed: int = 0) -> dict:
+    """
+    Closed-loop load: `concurrency` virtual users each send their next request as
+    soon as the previous one finishes, until `requests` have been sent in total.
+    """
+    mix = PROFILES[profile]
+    operations, weights = [op for op, _ in mix], [w for _, w in mix]
+    rng = random.Random(seed)
+    # Pre-draw the whole schedule so runs are comparable
+    schedule = [
+        (rng.choices(operations, weights)[0], rng.choice(classroom_ids), questions[i % len(questions)])
+        for i in range(requests)
+    ]
+    position = 0
+    recorder = _Recorder()
+
+    async def user():
+        nonlocal position
+        while position < len(schedule):
+            operation, classroom_id, question = schedule[position]
+            position += 1
+            try:
+                await _OPERATIONS[operation](client, classroom_id, question, recorder)
+            except httpx.HTTPError as e:
+                recorder.record(operation, type(e).__name__, 0.0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(len(samples) for samples in recorder.latencies.values())
+    result = {
+        "profile": profile,
+        "concurrency": concurrency,
+        "requests": requests,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(succeeded / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(1 - succeeded / requests, 4) if requests else 0.0,
+        "statuses": dict(sorted(recorder.statuses.items())),
+        "latency": {op: summarize_latencies(samples) for op, samples in sorted(recorder.latencies.items())},
+    }
+    if recorder.first_token:
+        result["time_to_first_token"] = summarize_latencies(recorder.first_token)
+    return result
+
+
+class _QueueStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: asyncio.Queue, task: asyncio.Task):
+        self._chunks = chunks
+        self._task = task
+
+    async def __aiter__(self):
+        while True:
+            chunk = await self._chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self._task.done():
+            self._task.cancel()
+
+
+class StreamingASGITransport(httpx.AsyncBaseTransport):
+    """
+    Calls the ASGI app in-process and hands body chunks to the client as the app sends them.
+    (httpx.ASGITransport buffers the whole body, which hides time to first token.)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": request.method, "scheme": request.url.scheme,
+            "path": request.url.path, "raw_path": request.url.raw_path.split(b"?")[0],
+            "query_string": request.url.query, "root_path": "",
+            "headers": [(k.lower(), v) for k, v in request.headers.raw],
+            "client": ("127.0.0.1", 0), "server": (request.url.host, request.url.port or 80),
+        }
+        request_sent = False
+        response_started = asyncio.get_running_loop().create_future()
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Event().wait() # No disconnects; the task is cancelled instead
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response_started.set_result(message)
+            elif message["type"] == "http.response.body":
+                if message.get("body"):
+                    await chunks.put(message["body"])
+                if not message.get("more_body", False):
+                    await chunks.put(None)
+
+        async def run_app():
+            try:
+                await self.app(scope, receive, send)
+            except Exception as e:
+                if not response_started.done():
+                    response_started.set_exception(e)
+            finally:
+                await chunks.put(None)
+
+        task = asyncio.create_task(run_app())
+        start = await response_started
+        return httpx.Response(start["status"], headers=start.get("headers", []), stream=_QueueStream(chunks, task))
+
+
+def make_client(app=None, base_url: str | None = None, timeout: float = 120.0) -> httpx.AsyncClient:
+    """In-process client for the ASGI app, or an HTTP client for a running server."""
+    if base_url:
+        return httpx.AsyncClient(base_url=base_url, timeout=timeout)
+    return httpx.AsyncClient(transport=StreamingASGITransport(app), base_url="http://bench", timeout=timeout)
@@ -0,0 +1,255 @@
+# bench/run.py
+# Offline benchmark: ingestion throughput and API latency with fake Vertex AI backends.
+#
+#   python -m bench.run                                  # default ingestion + ask/notes/mixed profiles
+#   python -m bench.run --profiles ask --concurrency 32 --requests 500 --output results.json
+#   python -m bench.run --baseline results.json          # fails (exit 1) on regressions
+#   python -m bench.run --profiles ask --llm-faults error:0.2,hang:0.05 --skip-startup
+#
+# Nothing here calls Google Cloud; no GOOGLE_PROJECT_ID or credentials are needed.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .corpus import generate_corpus, generate_questions
+from .fakes import FakeEmbeddings, LatencyModel, install_fakes, installed_faults
+from .load import PROFILES, make_client, run_profile
+from .startup import measure_startup
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Relative change in a metric treated as a regression when comparing to a baseline
+DEFAULT_MAX_REGRESSION = 0.15
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_ingestion(classrooms: dict, embed_latency: str, embed_rpm: int, seed: int) -> dict:
+    """Builds every benchmark classroom from scratch with populate_db.process_classroom."""
+    import populate_db
+
+    populate_db._embed_rate_limiter = populate_db._RateLimiter(embed_rpm)
+    embeddings = FakeEmbeddings(request_latency=LatencyModel(embed_latency, seed))
+    os.makedirs(populate_db.CHROMA_DBS_ROOT, exist_ok=True)
+    results = {}
+    try:
+        for classroom_id, config in classrooms.items():
+            start = time.perf_counter()
+            succeeded = populate_db.process_classroom(classroom_id, config, embeddings)
+            elapsed = time.perf_counter() - start
+            chunks = 0
+            manifest = populate_db._load_manifest(os.path.join(populate_db.CHROMA_DBS_ROOT, classroom_id))
+            if manifest:
+                chunks = sum(len(entry["chunk_ids"]) for entry in manifest["files"].values())
+            results[classroom_id] = {
+                "succeeded": bool(succeeded),
+                "seconds": round(elapsed, 3),
+                "chunks": chunks,
+                "chunks_per_second": round(chunks / elapsed, 1) if elapsed else 0.0,
+            }
+        cold_requests = embeddings.requests
+
+        # Rebuild from scratch: every chunk is in the embedding store now, so none should be re-embedded
+        populate_db.close_shared_vectorstore()
+        shutil.rmtree(populate_db.CHROMA_DBS_ROOT, ignore_errors=True)
+        shutil.rmtree(populate_db.SHARED_INDEX_PATH, ignore_errors=True)
+        os.makedirs(populate_db.CHROMA_DBS_ROOT, exist_ok=True)
+        start = time.perf_counter()
+        rebuilt = all(populate_db.process_classroom(cid, config, embeddings) for cid, config in classrooms.items())
+        rebuild = {
+            "succeeded": rebuilt,
+            "seconds": round(time.perf_counter() - start, 3),
+            "embedding_requests": embeddings.requests - cold_requests,
+        }
+    finally:
+        populate_db.shutdown_parse_pool()
+        populate_db.close_shared_vectorstore()
+    total_chunks = sum(r["chunks"] for r in results.values())
+    total_seconds = sum(r["seconds"] for r in results.values())
+    return {
+        "classrooms": results,
+        "total_chunks": total_chunks,
+        "total_seconds": round(total_seconds, 3),
+        "chunks_per_second": round(total_chunks / total_seconds, 1) if total_seconds else 0.0,
+        "embedding_requests": cold_requests,
+        "rebuild": rebuild,
+        "embedding_store": populate_db.embedding_store.stats(),
+    }
+
+
+async def run_api_profiles(args, classroom_ids: list[str], questions: list[str]) -> dict:
+    from backend.main import app
+    from backend.api import services
+
+    results = {}
+    if not args.base_url:
+        # Measure the cold start of one classroom, then load the rest before the profiles run
+        start = time.perf_counter()
+        services.warm_up_classrooms(classroom_ids[:1])
+        results["cold_start_seconds"] = round(time.perf_counter() - start, 3)
+        services.warm_up_classrooms(classroom_ids[1:])
+
+    async with make_client(app, args.base_url) as client:
+        for profile in args.profiles:
+            print(f"Running profile '{profile}' ({args.requests} requests, concurrency {args.concurrency})...")
+            results[profile] = await run_profile(
+                client, profile, classroom_ids, questions,
+                concurrency=args.concurrency, requests=args.requests, seed=args.seed,
+            )
+    if not args.base_url:
+        results["service_stats"] = services.get_service_stats()
+        results["injected_faults"] = {name: faults.stats() for name, faults in installed_faults.items()}
+        services.close_all_classrooms()
+    return results
+
+
+def compare_to_baseline(current: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Lists metrics that got worse than the baseline by more than max_regression."""
+    regressions = []
+
+    def check(name, new, old, higher_is_better):
+        if not old or new is None:
+            return
+        change = (new - old) / old
+        if (change < -max_regression) if higher_is_better else (change > max_regression):
+            regressions.append(f"{name}: {old} -> {new} ({change:+.1%})")
+
+    old_ingestion, new_ingestion = baseline.get("ingestion") or {}, current.get("ingestion") or {}
+    check("ingestion.chunks_per_second", new_ingestion.get("chunks_per_second"), old_ingestion.get("chunks_per_second"), True)
+    old_startup, new_startup = baseline.get("startup") or {}, current.get("startup") or {}
+    for metric in ("backend_import_seconds", "backend_first_response_seconds", "populate_db_import_seconds"):
+        check(f"startup.{metric}", new_startup.get(metric), old_startup.get(metric), False)
+    for profile, new in (current.get("api") or {}).items():
+        old = (baseline.get("api") or {}).get(profile)
+        if not isinstance(new, dict) or not isinstance(old, dict) or "throughput_rps" not in new:
+            continue
+        check(f"{profile}.throughput_rps", new["throughput_rps"], old.get("throughput_rps"), True)
+        for operation, latency in new["latency"].items():
+            old_latency = old.get("latency", {}).get(operation, {})
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                check(f"{profile}.{operation}.{metric}", latency.get(metric), old_latency.get(metric), False)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load and latency benchmark (fake Vertex AI backends).")
+    parser.add_argument("--profiles", nargs="*", default=["ask", "notes", "mixed"], choices=sorted(PROFILES),
+                        help="API load profiles to run (none to skip the API benchmark).")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent virtual users per profile.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests sent per profile.")
+    parser.add_argument("--classrooms", type=int, default=2)
+    parser.add_argument("--files-per-classroom", type=int, default=10)
+    parser.add_argument("--chars-per-file", type=int, default=20_000)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="Share of repeated questions.")
+    parser.add_argument("--embed-latency", default="lognormal:40,0.4", help="Fake embedding request latency (see LatencyModel).")
+    parser.add_argument("--llm-latency", default="lognormal:400,0.5", help="Fake LLM time to first token.")
+    parser.add_argument("--inter-token-ms", type=float, default=15.0, help="Fake LLM delay between tokens.")
+    parser.add_argument("--embed-faults", default="none", help="Faults injected into query embeddings (see FaultModel).")
+    parser.add_argument("--llm-faults", default="none", help="Faults injected into LLM calls, e.g. error:0.1,hang:0.05.")
+    parser.add_argument("--embed-rpm", type=int, default=0, help="Ingestion embedding rate limit (0 = unlimited).")
+    parser.add_argument("--index-layout", choices=("per_classroom", "shared"), default="per_classroom",
+                        help="Build and search one index per classroom or one shared index (RAG_INDEX_LAYOUT).")
+    parser.add_argument("--no-answer-cache", action="store_true", help="Disable the answer cache during the run.")
+    parser.add_argument("--skip-ingestion", action="store_true", help="Reuse the indexes already in --workdir.")
+    parser.add_argument("--skip-startup", action="store_true", help="Don't measure import / first-response times.")
+    parser.add_argument("--base-url", help="Load an already running server instead of the in-process app.")
+    parser.add_argument("--workdir", help="Directory for the corpus, indexes and notes DB (default: a temp dir).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against.")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # Output and baseline paths are relative to where the benchmark was started
+    output_path = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="llc-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # Backend modules read these at import time and resolve relative paths from the cwd
+    os.chdir(workdir)
+    os.environ["NOTES_DB_PATH"] = os.path.join(workdir, "notes.db")
+    os.environ["EMBEDDING_STORE_PATH"] = os.path.join(workdir, "embedding_store.db")
+    os.environ["INGESTION_JOBS_DB_PATH"] = os.path.join(workdir, "ingestion_jobs.db")
+    os.environ.setdefault("GOOGLE_PROJECT_ID", "offline-benchmark")
+    if args.no_answer_cache:
+        os.environ["ANSWER_CACHE_ENABLED"] = "false"
+    os.environ["RAG_INDEX_LAYOUT"] = args.index_layout
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    fake_settings = install_fakes(args.embed_latency, args.llm_latency, args.inter_token_ms, args.seed,
+                                  embed_faults=args.embed_faults, llm_faults=args.llm_faults)
+    classrooms = generate_corpus(os.path.join(workdir, "documents"), args.classrooms, args.files_per_classroom,
+                                 args.chars_per_file, args.seed)
+    questions = generate_questions(args.questions, args.repeat_ratio, args.seed)
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "workdir": workdir,
+            "fakes": fake_settings,
+            "args": vars(args),
+        },
+    }
+    try:
+        if not args.skip_startup:
+            print("Measuring startup (fresh interpreters)...")
+            results["startup"] = measure_startup()
+        if not args.skip_ingestion:
+            import populate_db
+            populate_db.DOCUMENTS_ROOT = "documents"
+            shutil.rmtree(populate_db.CHROMA_DBS_ROOT, ignore_errors=True)
+            shutil.rmtree(populate_db.SHARED_INDEX_PATH, ignore_errors=True)
+            for suffix in ("", "-wal", "-shm"): # Cold ingestion: nothing embedded yet
+                if os.path.exists(os.environ["EMBEDDING_STORE_PATH"] + suffix):
+                    os.remove(os.environ["EMBEDDING_STORE_PATH"] + suffix)
+            print("Running ingestion benchmark...")
+            results["ingestion"] = run_ingestion(classrooms, args.embed_latency, args.embed_rpm, args.seed)
+        if args.profiles:
+            results["api"] = asyncio.run(run_api_profiles(args, list(classrooms), questions))
+    finally:
+        if not args.workdir:
+            os.chdir(REPO_ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True, default=str)
+    if output_path:
+        with open(output_path, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {output_path}")
+    else:
+        print(output)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.max_regression)
+        if regressions:
+            print("REGRESSIONS against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
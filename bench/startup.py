@@ -0,0 +1,116 @@
+# bench/startup.py
+# Import-time budget check: the backend and the ingestion script must import without
+# LangChain, Chroma or the Vertex AI SDK, and notes/static routes must answer before
+# any RAG component is loaded. Each measurement runs in a fresh interpreter.
+#
+#   python -m bench.startup                   # fails (exit 1) if over budget
+#   python -m bench.startup --budget 0.8 --repeat 5
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds "import backend.main" may take (median of the runs)
+DEFAULT_IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+# Modules that must only be imported once a classroom is built or ingested
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_community", "langchain_google_vertexai",
+                 "langchain_text_splitters", "chromadb", "vertexai", "google.cloud.aiplatform", "pypdf")
+
+# Runs in the child interpreter; prints one JSON object
+_PROBE = """
+import asyncio, json, sys, tempfile, time, os
+os.environ["NOTES_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "notes.db")
+os.environ["INGESTION_JOBS_DB_PATH"] = os.path.join(os.path.dirname(os.environ["NOTES_DB_PATH"]), "ingestion_jobs.db")
+started = time.perf_counter()
+import {module}
+result = {{"import_seconds": time.perf_counter() - started}}
+if {serve}:
+    import httpx
+    from backend.main import app
+
+    async def first_requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            timings = {{}}
+            for name, method, path, body in (
+                ("add_note", "POST", "/api/classrooms/startup-check/notes", {{"note_text": "startup check"}}),
+                ("notes", "GET", "/api/classrooms/startup-check/notes", None),
+                ("index", "GET", "/", None),
+                ("healthz", "GET", "/healthz", None),
+            ):
+                t = time.perf_counter()
+                response = await client.request(method, path, json=body)
+                timings[name] = {{"status": response.status_code, "seconds": time.perf_counter() - t}}
+            return timings
+
+    result["first_requests"] = asyncio.run(first_requests())
+    result["to_first_response_seconds"] = time.perf_counter() - started
+result["heavy_modules_loaded"] = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps(result))
+"""
+
+
+def probe(module: str, serve: bool = False) -> dict:
+    """Imports module in a fresh interpreter (optionally serving a few routes) and reports timings."""
+    code = _PROBE.format(module=module, serve=serve, heavy=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.getenv("PYTHONPATH")])))
+    env.setdefault("GOOGLE_PROJECT_ID", "startup-check")
+    env["RAG_WARM_CLASSROOMS"] = "" # Warm-up would load RAG components on purpose
+    completed = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure_startup(repeat: int = 3) -> dict:
+    """Median import / first-response times of the backend and populate_db.py."""
+    backend = [probe("backend.main", serve=True) for _ in range(repeat)]
+    ingestion = [probe("populate_db") for _ in range(repeat)]
+    return {
+        "backend_import_seconds": round(statistics.median(r["import_seconds"] for r in backend), 3),
+        "backend_first_response_seconds": round(statistics.median(r["to_first_response_seconds"] for r in backend), 3),
+        "backend_first_requests": backend[-1]["first_requests"],
+        "backend_heavy_modules": backend[-1]["heavy_modules_loaded"],
+        "populate_db_import_seconds": round(statistics.median(r["import_seconds"] for r in ingestion), 3),
+        "populate_db_heavy_modules": ingestion[-1]["heavy_modules_loaded"],
+    }
+
+
+def check_budget(results: dict, budget_seconds: float) -> list[str]:
+    """Lists the startup requirements the results violate."""
+    problems = []
+    if results["backend_import_seconds"] > budget_seconds:
+        problems.append(f"import backend.main took {results['backend_import_seconds']}s (budget {budget_seconds}s)")
+    if results["populate_db_import_seconds"] > budget_seconds:
+        problems.append(f"import populate_db took {results['populate_db_import_seconds']}s (budget {budget_seconds}s)")
+    for name in ("backend", "populate_db"):
+        if results[f"{name}_heavy_modules"]:
+            problems.append(f"{name} imported {', '.join(results[f'{name}_heavy_modules'])} at startup")
+    for route, timing in results["backend_first_requests"].items():
+        if timing["status"] >= 300:
+            problems.append(f"first {route} request returned {timing['status']}")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check the backend's and ingestion script's import-time budget.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_IMPORT_BUDGET_SECONDS, help="Import budget in seconds.")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per measurement (median is used).")
+    args = parser.parse_args(argv)
+
+    results = measure_startup(args.repeat)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    problems = check_budget(results, args.budget)
+    if problems:
+        print("STARTUP BUDGET EXCEEDED:")
+        for line in problems:
+            print(f"  {line}")
+        return 1
+    print(f"Startup within budget ({args.budget}s).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
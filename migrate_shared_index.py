@@ -0,0 +1,126 @@
+# migrate_shared_index.py
+# Moves existing per-classroom Chroma indexes (chroma_dbs/<classroom_id>) into the shared
+# index (RAG_SHARED_INDEX_PATH, default chroma_shared/) used with RAG_INDEX_LAYOUT=shared.
+# The stored embeddings are copied, nothing is re-embedded. Each classroom directory is
+# replaced by one holding only its manifest and lexical index, so set RAG_INDEX_LAYOUT=shared
+# for the backend and populate_db.py once every classroom is migrated.
+#
+#   python migrate_shared_index.py                 # every classroom under chroma_dbs/
+#   python migrate_shared_index.py math_g10_tamil
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+from dotenv import load_dotenv
+from langchain_community.vectorstores import Chroma
+
+from backend.api.index_lock import is_swap_artifact, swap_directory
+from backend.api.lexical_index import build_from_collection
+from backend.api.retrieval import close_vectorstore, detach_chroma_path
+from backend.api.shared_index import SHARED_INDEX_PATH, classroom_filter, shared_chunk_id, touch_stamp, write_lock
+
+load_dotenv()
+
+# --- Configuration ---
+CHROMA_DBS_ROOT = "chroma_dbs"
+INDEX_MANIFEST_FILENAME = "index_manifest.json"
+COPY_PAGE_SIZE = 1000
+
+
+def classroom_ids() -> list[str]:
+    """Classroom directories under CHROMA_DBS_ROOT, skipping populate_db.py's staging copies and versions."""
+    if not os.path.isdir(CHROMA_DBS_ROOT):
+        return []
+    return sorted(
+        name for name in os.listdir(CHROMA_DBS_ROOT)
+        if os.path.isdir(os.path.join(CHROMA_DBS_ROOT, name)) and not is_swap_artifact(name)
+    )
+
+
+def _shared_id(classroom_id: str, chunk_id: str, metadata: dict) -> str:
+    # Note IDs ("note-42") are already unique across classrooms and are looked up as they are
+    if metadata.get("source") == "teacher_note":
+        return chunk_id
+    return shared_chunk_id(classroom_id, chunk_id)
+
+
+def migrate_classroom(classroom_id: str, shared) -> bool:
+    path = os.path.join(CHROMA_DBS_ROOT, classroom_id)
+    if not os.path.exists(os.path.join(path, "chroma.sqlite3")):
+        print(f"Skipping {classroom_id}: no per-classroom Chroma index at '{path}'.")
+        return False
+    started = time.monotonic()
+    source = Chroma(persist_directory=path)
+    copied = 0
+    try:
+        offset = 0
+        while True:
+            page = source._collection.get(include=["embeddings", "documents", "metadatas"],
+                                          limit=COPY_PAGE_SIZE, offset=offset)
+            if not page["ids"]:
+                break
+            metadatas = [dict(metadata or {}, classroom_id=classroom_id) for metadata in page["metadatas"]]
+            shared._collection.upsert(
+                ids=[_shared_id(classroom_id, chunk_id, metadata) for chunk_id, metadata in zip(page["ids"], metadatas)],
+                embeddings=page["embeddings"],
+                documents=page["documents"],
+                metadatas=metadatas,
+            )
+            copied += len(page["ids"])
+            offset += len(page["ids"])
+    except Exception as e:
+        print(f"ERROR: Could not copy {classroom_id} into the shared index: {e}")
+        return False
+    finally:
+        close_vectorstore(source)
+
+    # The classroom directory keeps its manifest (chunk IDs as in the shared index) and lexical index
+    staging_path = f"{path}.staging"
+    shutil.rmtree(staging_path, ignore_errors=True)
+    os.makedirs(staging_path)
+    manifest_path = os.path.join(path, INDEX_MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        for entry in manifest.get("files", {}).values():
+            entry["chunk_ids"] = [shared_chunk_id(classroom_id, chunk_id) for chunk_id in entry["chunk_ids"]]
+        manifest.update(layout="shared", updated_at=time.time())
+        with open(os.path.join(staging_path, INDEX_MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+    else:
+        print(f"WARNING: {classroom_id} has no manifest; populate_db.py will rebuild it on its next run.")
+    build_from_collection(shared._collection, where=classroom_filter(classroom_id)).save(staging_path)
+
+    swap_directory(staging_path, path)
+    print(f"Migrated {classroom_id}: {copied} chunks in {time.monotonic() - started:.1f}s.")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move per-classroom Chroma indexes into the shared index.")
+    parser.add_argument("classrooms", nargs="*", help="Classroom IDs (default: all under chroma_dbs/)")
+    args = parser.parse_args()
+
+    ids = args.classrooms or classroom_ids()
+    if not ids:
+        print(f"No classroom indexes found under '{CHROMA_DBS_ROOT}'.")
+        return
+    # Backends add notes to the shared index under the same lock
+    with write_lock():
+        detach_chroma_path(SHARED_INDEX_PATH)
+        shared = Chroma(persist_directory=SHARED_INDEX_PATH)
+        try:
+            failed = [cid for cid in ids if not migrate_classroom(cid, shared)]
+        finally:
+            close_vectorstore(shared)
+            touch_stamp()
+    print(f"Migrated {len(ids) - len(failed)} of {len(ids)} classroom(s) into '{SHARED_INDEX_PATH}'.")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# migrate_vector_index.py
+# Exports existing Chroma classroom indexes as quantized, memory-mapped indexes
+# (chroma_dbs/<classroom_id>/mmap_index) for the backend's RAG_VECTOR_BACKEND=mmap.
+# The stored embeddings are reused, nothing is re-embedded, and the Chroma files stay
+# in place (populate_db.py keeps updating them and rebuilds the export when
+# RAG_VECTOR_BACKEND=mmap is set for it too).
+#
+#   python migrate_vector_index.py                        # every classroom under chroma_dbs/
+#   python migrate_vector_index.py math_g10_tamil --dtype float16
+#   python migrate_vector_index.py --nlist 256            # force IVF partitions
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from langchain_community.vectorstores import Chroma
+
+from backend.api import vector_index
+from backend.api.index_lock import is_swap_artifact
+from backend.api.retrieval import close_vectorstore
+
+load_dotenv()
+
+# --- Configuration ---
+CHROMA_DBS_ROOT = "chroma_dbs"
+INDEX_MANIFEST_FILENAME = "index_manifest.json"
+
+
+def classroom_ids() -> list[str]:
+    """Classroom directories under CHROMA_DBS_ROOT, skipping populate_db.py's staging copies and versions."""
+    if not os.path.isdir(CHROMA_DBS_ROOT):
+        return []
+    return sorted(
+        name for name in os.listdir(CHROMA_DBS_ROOT)
+        if os.path.isdir(os.path.join(CHROMA_DBS_ROOT, name)) and not is_swap_artifact(name)
+    )
+
+
+def migrate_classroom(classroom_id: str, dtype: str, nlist: int | None) -> bool:
+    path = os.path.join(CHROMA_DBS_ROOT, classroom_id)
+    if not os.path.exists(os.path.join(path, "chroma.sqlite3")):
+        print(f"Skipping {classroom_id}: no Chroma index at '{path}'.")
+        return False
+    started = time.monotonic()
+    vectorstore = Chroma(persist_directory=path)
+    try:
+        meta = vector_index.build_from_collection(vectorstore._collection, path, dtype=dtype, nlist=nlist)
+    except Exception as e:
+        print(f"ERROR: Could not migrate {classroom_id}: {e}")
+        return False
+    finally:
+        close_vectorstore(vectorstore)
+
+    # Running backends reload a classroom when its manifest changes
+    manifest_path = os.path.join(path, INDEX_MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        os.utime(manifest_path)
+    size = sum(
+        os.path.getsize(os.path.join(path, vector_index.MMAP_INDEX_DIRNAME, name))
+        for name in os.listdir(os.path.join(path, vector_index.MMAP_INDEX_DIRNAME))
+    )
+    print(f"Migrated {classroom_id}: {meta['count']} vectors, {meta['dim']} dims, {meta['dtype']}, "
+          f"{meta['nlist']} partitions, {size / 1024 / 1024:.1f} MB in {time.monotonic() - started:.1f}s.")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export Chroma classroom indexes as memory-mapped vector indexes.")
+    parser.add_argument("classrooms", nargs="*", help="Classroom IDs (default: all under chroma_dbs/)")
+    parser.add_argument("--dtype", choices=("int8", "float16"), default=vector_index.MMAP_INDEX_DTYPE)
+    parser.add_argument("--nlist", type=int, default=None,
+                        help="IVF partitions (0 = flat scan; default: sqrt(n) for indexes of IVF_MIN_ROWS chunks or more)")
+    args = parser.parse_args()
+
+    ids = args.classrooms or classroom_ids()
+    if not ids:
+        print(f"No classroom indexes found under '{CHROMA_DBS_ROOT}'.")
+        return
+    failed = [cid for cid in ids if not migrate_classroom(cid, args.dtype, args.nlist)]
+    print(f"Migrated {len(ids) - len(failed)} of {len(ids)} classroom(s).")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
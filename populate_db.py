@@ -1,18 +1,35 @@
 # populate_db.py (MVP2 Version - Handles multiple classrooms)
-print("--- Script Start ---") # Diagnostic print
-
 import os
+import json
+import argparse
+import time
+import queue
+import random
 import shutil
+import hashlib
+import threading
+import multiprocessing
+from contextlib import ExitStack
+from typing import TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 from glob import glob # Import glob for finding files
 
 # LangChain components
 # Ensure these are installed in your venv:
-# pip install langchain-google-vertexai langchain-community langchain python-dotenv chromadb pypdf2
-from langchain_google_vertexai import VertexAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import PyPDFLoader, TextLoader # Added TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+# pip install langchain-google-vertexai langchain-community langchain python-dotenv chromadb pypdf
+# They are imported where first used, so configuration errors are reported (and parse
+# workers start) without waiting seconds for the Vertex AI SDK, Chroma and LangChain.
+if TYPE_CHECKING:
+    from langchain_google_vertexai import VertexAIEmbeddings
+
+from backend.api.lexical_index import LEXICAL_INDEX_FILENAME, build_from_collection
+from backend.api.embedding_store import embedding_store, content_key
+from backend.api.index_lock import is_swap_artifact, swap_directory, write_lock as index_write_lock
+from backend.api.shared_index import (
+    RAG_INDEX_LAYOUT, SHARED_INDEX_ENABLED, SHARED_INDEX_PATH,
+    shared_chunk_id, classroom_filter, iter_classroom_pages, touch_stamp, write_lock as shared_write_lock,
+)
 
 # --- Configuration ---
 
@@ -48,11 +65,441 @@ CLASSROOMS = {
 CHUNK_SIZE = 1000 # Size of text chunks (in characters)
 CHUNK_OVERLAP = 200 # Overlap between chunks
 
-def process_classroom(classroom_id: str, config: dict, embeddings: VertexAIEmbeddings):
+# --- Incremental indexing ---
+# Each classroom DB directory holds a manifest of the files and chunks it was built from,
+# so re-runs only embed new/changed chunks and remove chunks of deleted files.
+# With RAG_INDEX_LAYOUT=shared the chunks themselves go into one collection for all
+# classrooms (see backend/api/shared_index.py); the directory keeps the manifest and lexical index.
+MANIFEST_FILENAME = "index_manifest.json"
+MANIFEST_VERSION = 1
+# Number of chunks sent per embedding request / Chroma write
+EMBED_BATCH_SIZE = 100
+
+# --- Parallel ingestion pipeline ---
+# parse (process pool) -> embed (bounded threads, rate limited) -> write (one thread per classroom)
+# Stages are connected by bounded queues, so a slow stage holds the earlier ones back.
+CLASSROOM_CONCURRENCY = 2 # Classrooms processed at the same time
+PARSE_WORKERS = os.cpu_count() or 2 # Processes loading and splitting files
+PARSE_QUEUE_DEPTH = 2 * PARSE_WORKERS # Files in flight in the parse stage
+EMBED_CONCURRENCY = 4 # Embedding requests in flight, across all classrooms
+EMBED_REQUESTS_PER_MINUTE = 300 # Embedding request rate limit (0 = unlimited), match your Vertex AI quota
+EMBED_MAX_RETRIES = 5 # Retries for rate-limited / transient embedding failures
+PIPELINE_QUEUE_DEPTH = 8 # Batches buffered between the embed and write stages
+# PDFs are parsed in page ranges of this size, so peak memory depends on batch sizes,
+# not on how big a textbook is: roughly PARSE_QUEUE_DEPTH page ranges plus
+# 2 * PIPELINE_QUEUE_DEPTH + EMBED_CONCURRENCY batches of EMBED_BATCH_SIZE chunks.
+PAGES_PER_PARSE_JOB = 16
+
+# --- Helpers: files, chunks and manifest ---
+
+def _file_sha256(file_path: str) -> str:
+    """Hashes a file's contents in blocks (keeps memory flat for large PDFs)."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _chunk_id(relative_path: str, text: str) -> str:
+    """Stable Chroma ID for a chunk: hash of its source file and content."""
+    return hashlib.sha256(f"{relative_path}\n{text}".encode("utf-8")).hexdigest()
+
+def _load_manifest(vectorstore_path: str) -> dict | None:
+    """Reads a classroom's manifest, or returns None if missing/unreadable."""
+    manifest_path = os.path.join(vectorstore_path, MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Could not read manifest '{manifest_path}': {e}. A full rebuild will be done.")
+        return None
+
+def _write_manifest(vectorstore_path: str, manifest: dict) -> None:
+    """Writes the manifest atomically (temp file + rename)."""
+    manifest_path = os.path.join(vectorstore_path, MANIFEST_FILENAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def _manifest_matches_settings(manifest: dict, embeddings) -> bool:
+    """A manifest is only reusable if chunks were produced and embedded the same way."""
+    return (
+        manifest.get("version") == MANIFEST_VERSION
+        and manifest.get("embedding_model") == getattr(embeddings, "model_name", None)
+        and manifest.get("chunk_size") == CHUNK_SIZE
+        and manifest.get("chunk_overlap") == CHUNK_OVERLAP
+        and manifest.get("layout", "per_classroom") == RAG_INDEX_LAYOUT
+    )
+
+def _iter_file_sections(file_path: str, page_range: tuple[int, int] | None = None):
+    """
+    Yields a file's sections lazily: PDF pages one at a time (only pages in
+    page_range if given), or the whole text of a TXT file. Nothing else is held in memory.
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    source = os.path.basename(file_path) # Document source metadata (useful for RAG later)
+    if file_ext == ".pdf":
+        from langchain_core.documents import Document
+        from pypdf import PdfReader # Used directly so PDF pages can be read lazily / by range
+        reader = PdfReader(file_path)
+        start, end = page_range or (0, len(reader.pages))
+        for page_number in range(start, end):
+            yield Document(
+                page_content=reader.pages[page_number].extract_text(),
+                metadata={"source": source, "page": page_number},
+            )
+    elif file_ext == ".txt":
+        from langchain_community.document_loaders import TextLoader
+        loader = TextLoader(file_path, encoding='utf-8') # Specify encoding for text
+        for doc in loader.lazy_load():
+            doc.metadata = dict(doc.metadata or {}, source=source)
+            yield doc
+    else:
+        print(f"    Skipping unsupported file type: {file_path}")
+
+def _iter_valid_sections(sections):
+    """Passes through sections with usable content; skips missing, non-string or empty ones."""
+    for i, doc in enumerate(sections):
+        page_meta = doc.metadata.get('page', 'N/A') # Get page number if available
+        source_meta = doc.metadata.get('source', 'N/A') # Get source filename
+
+        # Check if page_content exists, is a string, and is not empty/whitespace
+        if not hasattr(doc, 'page_content') or doc.page_content is None:
+            print(f"DEBUG: Invalid content (None) - Index {i}, Source: {source_meta}, Page: {page_meta}")
+        elif not isinstance(doc.page_content, str):
+            print(f"DEBUG: Invalid content (Non-string: {type(doc.page_content)}) - Index {i}, Source: {source_meta}, Page: {page_meta}")
+        elif not doc.page_content.strip():
+            print(f"DEBUG: Invalid content (Empty/Whitespace) - Index {i}, Source: {source_meta}, Page: {page_meta}")
+        else:
+            yield doc
+
+_text_splitter = None
+
+def _get_text_splitter():
+    """The chunk splitter, created on first use in each process."""
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=len, # Use standard length function
+            is_separator_regex=False, # Standard separators
+        )
+    return _text_splitter
+
+def _iter_chunks(sections):
+    """Splits sections into chunks of CHUNK_SIZE characters, one section at a time."""
+    text_splitter = _get_text_splitter()
+    for doc in sections:
+        yield from text_splitter.split_documents([doc])
+
+def _plan_page_ranges(file_path: str) -> list:
+    """
+    Splits a PDF into page ranges of PAGES_PER_PARSE_JOB so a textbook is parsed
+    in small pieces. Other files (and unreadable PDFs) are one job: [None].
+    """
+    if os.path.splitext(file_path)[1].lower() != ".pdf":
+        return [None]
+    try:
+        from pypdf import PdfReader
+        page_count = len(PdfReader(file_path).pages)
+    except Exception as e:
+        print(f"WARNING: Could not count pages of '{file_path}': {e}")
+        return [None]
+    return [(start, min(start + PAGES_PER_PARSE_JOB, page_count))
+            for start in range(0, page_count, PAGES_PER_PARSE_JOB)] or [None]
+
+def _chunk_file(file_path: str, relative_path: str, page_range: tuple[int, int] | None = None) -> dict[str, object] | None:
+    """
+    Loads, validates and splits one file (or one page range of a PDF) as a stream.
+    Returns {chunk_id: Document} (duplicate chunks collapse to one), or None if loading failed.
+    """
+    pages = f" (pages {page_range[0] + 1}-{page_range[1]})" if page_range else ""
+    print(f"--> Loading file: {file_path}{pages}")
+    try:
+        chunks = {}
+        for chunk in _iter_chunks(_iter_valid_sections(_iter_file_sections(file_path, page_range))):
+            chunks.setdefault(_chunk_id(relative_path, chunk.page_content), chunk)
+        return chunks
+    except Exception as e_file:
+        # Catch errors during loading/processing of a single file
+        print(f"ERROR: Failed to load or process file '{file_path}'{pages}: {e_file}. Skipping this file.")
+        return None
+
+# --- Pipeline stages ---
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all classrooms for CPU-bound PDF parsing and splitting."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # Spawned, not forked: inside the backend (ingestion jobs) other threads may hold
+            # locks (logging, SQLite, gRPC) that a forked child would inherit locked
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown()
+            _parse_pool = None
+
+def _parse_files_in_parallel(jobs: list):
+    """
+    Chunks files in the process pool and yields (job, chunks) as each one finishes.
+    At most PARSE_QUEUE_DEPTH jobs are in flight, so parsed-but-unconsumed
+    results can't pile up if embedding is the slower stage.
+    job is a tuple (file_path, relative_path, page_range).
+    """
+    pool = _get_parse_pool()
+    pending = {}
+    jobs_iter = iter(jobs)
+
+    def submit_next():
+        job = next(jobs_iter, None)
+        if job is not None:
+            pending[pool.submit(_chunk_file, *job)] = job
+
+    for _ in range(PARSE_QUEUE_DEPTH):
+        submit_next()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            job = pending.pop(future)
+            try:
+                chunks = future.result()
+            except Exception as e:
+                print(f"ERROR: Parsing worker failed for '{job[0]}': {e}. Skipping this file.")
+                chunks = None
+            submit_next()
+            yield job, chunks
+
+
+class _RateLimiter:
+    """Thread-safe limiter spacing requests to at most requests_per_minute."""
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_allowed = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self._next_allowed - now
+            self._next_allowed = max(now, self._next_allowed) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+# Shared by all classrooms so the totals stay within quota
+_embed_rate_limiter = _RateLimiter(EMBED_REQUESTS_PER_MINUTE)
+_embed_slots = threading.BoundedSemaphore(EMBED_CONCURRENCY)
+
+def _is_retryable_embedding_error(error: Exception) -> bool:
+    """Quota / rate-limit / transient availability errors are worth retrying."""
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in ("429", "resourceexhausted", "resource exhausted", "quota", "rate limit", "503", "unavailable", "deadline"))
+
+def _embed_with_retries(embeddings, texts: list[str]) -> list[list[float]]:
+    """One rate-limited embedding request, retried with jittered backoff on quota errors."""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        _embed_rate_limiter.acquire()
+        with _embed_slots:
+            try:
+                return embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == EMBED_MAX_RETRIES or not _is_retryable_embedding_error(e):
+                    raise
+                error = e
+        delay = min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+        print(f"    Embedding request throttled ({error}). Retrying in {delay:.1f}s...")
+        time.sleep(delay)
+
+_STAGE_DONE = object() # Sentinel closing a pipeline queue
+
+def _run_embedding_pipeline(chunk_batches, embeddings, collection, label: str = "", on_progress=None) -> tuple[int, int]:
+    """
+    Embeds and writes batches of (chunk_id, Document) pairs.
+    The caller's iterator is the producer; EMBED_CONCURRENCY threads embed, and one
+    writer thread upserts into the Chroma collection. Bounded queues between the
+    stages provide backpressure. Chunks whose text is already in the embedding store
+    (from another classroom or an earlier run) are not sent to the embeddings API.
+    Returns (chunks written, chunks reused from the store); raises the first error
+    from any stage after shutting the pipeline down. on_progress(written, reused) is
+    called from the writer thread after every batch.
+    """
+    embed_queue = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+    write_queue = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+    errors = []
+    failed = threading.Event()
+    written = 0
+    reused = 0
+    reused_lock = threading.Lock()
+    started = time.monotonic()
+
+    def fail(error: Exception):
+        errors.append(error)
+        failed.set()
+
+    def embed_worker():
+        nonlocal reused
+        while True:
+            batch = embed_queue.get()
+            if batch is _STAGE_DONE:
+                return
+            if failed.is_set():
+                continue # Drain without working so the producer never blocks forever
+            try:
+                vectors, hits = embedding_store.get_or_embed(
+                    embeddings.model_name,
+                    [chunk.page_content for _, chunk in batch],
+                    lambda texts: _embed_with_retries(embeddings, texts),
+                )
+                with reused_lock:
+                    reused += hits
+                write_queue.put((batch, vectors))
+            except Exception as e:
+                fail(e)
+
+    def writer():
+        nonlocal written
+        while True:
+            item = write_queue.get()
+            if item is _STAGE_DONE:
+                return
+            if failed.is_set():
+                continue
+            batch, vectors = item
+            try:
+                collection.upsert(
+                    ids=[chunk_id for chunk_id, _ in batch],
+                    embeddings=vectors,
+                    documents=[chunk.page_content for _, chunk in batch],
+                    metadatas=[chunk.metadata for _, chunk in batch],
+                )
+                written += len(batch)
+                rate = written / max(time.monotonic() - started, 1e-6)
+                print(f"    [{label}] Embedded and stored {written} new chunks, {reused} from the embedding store ({rate:.1f} chunks/s)")
+                if on_progress is not None:
+                    on_progress(written, reused)
+            except Exception as e:
+                fail(e)
+
+    embed_threads = [threading.Thread(target=embed_worker, daemon=True) for _ in range(EMBED_CONCURRENCY)]
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    for thread in embed_threads:
+        thread.start()
+    writer_thread.start()
+
+    try:
+        for batch in chunk_batches:
+            if failed.is_set():
+                break
+            embed_queue.put(batch)
+    except Exception as e:
+        fail(e)
+    finally:
+        for _ in embed_threads:
+            embed_queue.put(_STAGE_DONE)
+        for thread in embed_threads:
+            thread.join()
+        write_queue.put(_STAGE_DONE)
+        writer_thread.join()
+
+    if errors:
+        raise errors[0]
+    return written, reused
+
+
+def _swap_into_place(staging_path: str, vectorstore_path: str) -> None:
+    """
+    Replaces the live classroom DB with the staged one in one atomic step (the
+    classroom path is a symlink to a versioned directory, see index_lock.swap_directory),
+    so the backend never reads a half-written or missing directory.
+    """
+    swap_directory(staging_path, vectorstore_path)
+
+
+# --- Shared index (RAG_INDEX_LAYOUT=shared) ---
+# Classrooms write into the shared collection in place (it is too big to stage a copy per
+# classroom). It is opened once per run, holding the cross-process write lock the backend
+# also takes for notes, and closed by close_shared_vectorstore().
+_shared_run = None # (ExitStack releasing the lock, Chroma vector store)
+_shared_run_lock = threading.Lock()
+
+def _open_shared_vectorstore(embeddings):
+    global _shared_run
+    with _shared_run_lock:
+        if _shared_run is None:
+            from langchain_community.vectorstores import Chroma
+            from backend.api.retrieval import detach_chroma_path
+
+            stack = ExitStack()
+            stack.enter_context(shared_write_lock())
+            try:
+                detach_chroma_path(SHARED_INDEX_PATH)
+                vectorstore = Chroma(persist_directory=SHARED_INDEX_PATH, embedding_function=embeddings)
+            except Exception:
+                stack.close()
+                raise
+            _shared_run = (stack, vectorstore)
+        return _shared_run[1]
+
+def close_shared_vectorstore() -> None:
+    """Flushes and closes the shared collection and releases its write lock (no-op if not opened)."""
+    global _shared_run
+    with _shared_run_lock:
+        run, _shared_run = _shared_run, None
+    if run is None:
+        return
+    from backend.api.retrieval import close_vectorstore
+
+    stack, vectorstore = run
+    try:
+        close_vectorstore(vectorstore)
+    finally:
+        stack.close()
+
+def _stale_shared_ids(collection, classroom_id: str, live_ids: set[str]) -> set[str]:
+    """
+    The classroom's chunks in the shared collection that its manifest no longer lists:
+    chunks of removed/changed files, and leftovers of earlier failed runs. Notes are kept.
+    """
+    stale = set()
+    for page in iter_classroom_pages(collection, classroom_id, include=["metadatas"]):
+        for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+            if chunk_id not in live_ids and (metadata or {}).get("source") != "teacher_note":
+                stale.add(chunk_id)
+    return stale
+
+
+def process_classroom(classroom_id: str, config: dict, embeddings: "VertexAIEmbeddings", progress=None):
     """
     Loads, splits, embeds, and stores documents for a single classroom.
+    Incremental: only new or changed chunks are embedded, chunks of deleted or
+    changed files are removed. The update is built in a staging copy and swapped
+    in at the end, so the backend keeps serving the old index until then.
+    With the shared index only the manifest and lexical index are staged; chunks are
+    added to the shared collection first and outdated ones deleted after.
+    progress(**fields), if given, receives the stage and file/chunk counts as they
+    change (used by the backend's ingestion jobs).
     Returns True on success, False on failure for this classroom.
     """
+    from langchain_community.vectorstores import Chroma
+    from backend.api import vector_index
+    from backend.api.retrieval import close_vectorstore
+
+    report = progress or (lambda **fields: None)
     classroom_name = config.get("name", classroom_id)
     curriculum_subdir = config.get("curriculum_path")
     glob_pattern = config.get("glob_pattern", "**/*[.pdf|.txt]") # Default pattern
@@ -68,169 +515,315 @@ def process_classroom(classroom_id: str, config: dict, embeddings: VertexAIEmbed
     source_docs_path = os.path.join(DOCUMENTS_ROOT, curriculum_subdir)
     # Path where the vector database for this classroom will be stored
     vectorstore_path = os.path.join(CHROMA_DBS_ROOT, classroom_id) # Unique DB path per classroom
+    # Updates are written here first, then swapped in
+    staging_path = f"{vectorstore_path}.staging"
 
     if not os.path.isdir(source_docs_path):
         print(f"ERROR: Source document directory not found: '{source_docs_path}'. Skipping classroom.")
         return False
 
-    # --- Load Documents Individually ---
-    documents = [] # Initialize list for loaded document sections/pages
+    # --- Find Files ---
     print(f"Scanning for files in: '{source_docs_path}' using pattern '{glob_pattern}'")
     try:
-        # Construct the search pattern
+        # Construct the search pattern and find all matching files recursively
         file_search_pattern = os.path.join(source_docs_path, glob_pattern)
-        # Find all matching files recursively
-        file_paths = glob(file_search_pattern, recursive=True)
-
-        if not file_paths:
-            print(f"WARNING: No documents found matching pattern in '{source_docs_path}'. Skipping classroom.")
-            return False # Treat as non-fatal for this classroom, but report failure
-
-        print(f"Found {len(file_paths)} files to process.")
-        # Loop through each found file path
-        for file_path in file_paths:
-            try:
-                print(f"--> Loading file: {file_path}")
-                # Select loader based on file extension
-                file_ext = os.path.splitext(file_path)[1].lower()
-                if file_ext == ".pdf":
-                    loader = PyPDFLoader(file_path)
-                elif file_ext == ".txt":
-                    loader = TextLoader(file_path, encoding='utf-8') # Specify encoding for text
-                else:
-                    print(f"    Skipping unsupported file type: {file_path}")
-                    continue # Skip to next file
-
-                # Load returns a list of Documents (pages for PDF, one doc for TXT)
-                file_docs = loader.load()
-
-                if file_docs is None: # Explicitly check if loader returned None
-                     print(f"WARNING: Loader returned None for file: {file_path}. Skipping.")
-                     continue
-
-                # Add document source metadata (useful for RAG later)
-                for doc in file_docs:
-                    # Ensure metadata exists
-                    if not hasattr(doc, 'metadata') or doc.metadata is None:
-                         doc.metadata = {}
-                    doc.metadata["source"] = os.path.basename(file_path)
-
-                documents.extend(file_docs)
-                print(f"    Loaded {len(file_docs)} sections from {os.path.basename(file_path)}. Total sections now: {len(documents)}")
-
-            except Exception as e_file:
-                # Catch errors during loading/processing of a single file
-                print(f"ERROR: Failed to load or process file '{file_path}': {e_file}. Skipping this file.")
-                # Continue processing other files
-
-        # Check if any documents were successfully loaded after the loop
-        if not documents:
-            print(f"ERROR: No documents could be successfully loaded for classroom {classroom_id}. Skipping.")
-            return False
-        print(f"Successfully finished loading files. Total loaded sections: {len(documents)}")
-
+        file_paths = sorted(p for p in glob(file_search_pattern, recursive=True) if os.path.isfile(p))
     except Exception as e_outer:
-         # Catch unexpected errors during the file listing/looping process itself
-         print(f"ERROR: An unexpected error occurred during the document loading loop for {classroom_id}: {e_outer}")
+         print(f"ERROR: An unexpected error occurred while listing files for {classroom_id}: {e_outer}")
          return False
 
-    # --- Filter Problematic Loaded Content ---
-    print("DEBUG: Checking loaded content for validity...")
-    problematic_indices = []
-    valid_documents = [] # Keep track of documents with valid content
-    for i, doc in enumerate(documents):
-        page_meta = doc.metadata.get('page', 'N/A') # Get page number if available
-        source_meta = doc.metadata.get('source', 'N/A') # Get source filename
-
-        is_problematic = False
-        # Check if page_content exists, is a string, and is not empty/whitespace
-        if not hasattr(doc, 'page_content') or doc.page_content is None:
-            print(f"DEBUG: Invalid content (None) - Index {i}, Source: {source_meta}, Page: {page_meta}")
-            is_problematic = True
-        elif not isinstance(doc.page_content, str):
-            print(f"DEBUG: Invalid content (Non-string: {type(doc.page_content)}) - Index {i}, Source: {source_meta}, Page: {page_meta}")
-            is_problematic = True
-        elif not doc.page_content.strip():
-            print(f"DEBUG: Invalid content (Empty/Whitespace) - Index {i}, Source: {source_meta}, Page: {page_meta}")
-            is_problematic = True
-
-        if not is_problematic:
-            valid_documents.append(doc) # Add to list of valid documents
-
-    if len(valid_documents) < len(documents):
-        print(f"DEBUG: Filtered out {len(documents) - len(valid_documents)} problematic sections.")
-    if not valid_documents:
-        print(f"ERROR: No valid content remaining after filtering for classroom {classroom_id}. Skipping.")
-        return False
-    documents = valid_documents # Replace original list with the filtered list
-    print(f"DEBUG: Kept {len(documents)} valid sections for splitting.")
-    # --- End Filtering block ---
+    if not file_paths:
+        print(f"WARNING: No documents found matching pattern in '{source_docs_path}'. Skipping classroom.")
+        return False # Treat as non-fatal for this classroom, but report failure
+    print(f"Found {len(file_paths)} files.")
+
+    # --- Compare Against the Previous Build ---
+    old_manifest = _load_manifest(vectorstore_path) if os.path.isdir(vectorstore_path) else None
+    if old_manifest is not None and not _manifest_matches_settings(old_manifest, embeddings):
+        print("Chunking or embedding settings changed since the last build. Doing a full rebuild.")
+        old_manifest = None
+    if old_manifest is None and os.path.isdir(vectorstore_path):
+        print(f"No usable manifest in '{vectorstore_path}'. Doing a full rebuild.")
+    old_files = old_manifest["files"] if old_manifest else {}
+
+    new_files = {} # relative_path -> manifest entry
+    parse_jobs = [] # (file_path, relative_path, stat, sha256, old manifest entry) for new/changed files
+    stale_ids = set() # chunk ids to delete
+    unchanged_count = 0
+
+    for file_path in file_paths:
+        relative_path = os.path.relpath(file_path, source_docs_path)
+        stat = os.stat(file_path)
+        old_entry = old_files.get(relative_path)
+
+        # Cheap check first: same size and mtime means unchanged
+        if old_entry and old_entry["size"] == stat.st_size and old_entry["mtime"] == stat.st_mtime:
+            new_files[relative_path] = old_entry
+            unchanged_count += 1
+            continue
+
+        file_hash = _file_sha256(file_path)
+        if old_entry and old_entry["sha256"] == file_hash:
+            # Touched but not modified
+            new_files[relative_path] = dict(old_entry, size=stat.st_size, mtime=stat.st_mtime)
+            unchanged_count += 1
+            continue
+
+        parse_jobs.append((file_path, relative_path, stat, file_hash, old_entry))
+
+    # Files that disappeared since the last build
+    current_paths = {os.path.relpath(p, source_docs_path) for p in file_paths}
+    for relative_path, old_entry in old_files.items():
+        if relative_path not in current_paths:
+            print(f"    File removed since last build: {relative_path}")
+            stale_ids.update(old_entry["chunk_ids"])
+
+    print(f"Files unchanged: {unchanged_count}, files to (re)index: {len(parse_jobs)}, chunks of removed files: {len(stale_ids)}")
+    report(stage="scanned", files_total=len(file_paths), files_unchanged=unchanged_count, files_to_index=len(parse_jobs))
+    # Indexes built before lexical search existed are rebuilt once to get their lexical index
+    has_lexical_index = os.path.exists(os.path.join(vectorstore_path, LEXICAL_INDEX_FILENAME))
+    # Likewise when the backend is set to search memory-mapped indexes and this one has none yet
+    # (the shared index is always searched in Chroma)
+    has_mmap_index = (SHARED_INDEX_ENABLED or vector_index.RAG_VECTOR_BACKEND != "mmap"
+                      or vector_index.has_mmap_index(vectorstore_path))
+    if (old_manifest is not None and not parse_jobs and not stale_ids and new_files == old_files
+            and has_lexical_index and has_mmap_index):
+        print(f"Index for classroom {classroom_id} is already up to date.")
+        print(f"--- Successfully processed classroom {classroom_name} (ID: {classroom_id}) ---")
+        return True
 
-    # --- Split Documents ---
-    print("Splitting valid document sections into manageable chunks...")
-    docs_split = None # Initialize
+    # --- Prepare Staging Copy ---
     try:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len, # Use standard length function
-            is_separator_regex=False, # Standard separators
-        )
-        docs_split = text_splitter.split_documents(documents) # Use the filtered 'documents' list
-
-        if not docs_split:
-             # Check if splitting resulted in empty list
-             raise ValueError("Text splitting resulted in zero chunks. Check content and splitter settings.")
-
-        print(f"Split valid sections into {len(docs_split)} chunks.")
-    except Exception as e_split:
-        print(f"ERROR: Failed during text splitting for {classroom_id}: {e_split}")
-        return False # Exit if splitting fails
-
-    # --- Create or Clear Classroom's Chroma DB ---
-    # For MVP simplicity, we clear the DB each time to avoid duplicates if run multiple times
-    if os.path.exists(vectorstore_path):
-        print(f"Clearing existing database for classroom {classroom_id} at '{vectorstore_path}'...")
-        try:
-            shutil.rmtree(vectorstore_path)
-            print(f"Successfully cleared old database.")
-        except Exception as e_rm:
-            print(f"ERROR: Could not remove existing database directory '{vectorstore_path}': {e_rm}")
-            return False # Exit if we can't clear the old DB
-    else:
-         print(f"No existing database found at '{vectorstore_path}'. Creating new.")
-
-
-    print(f"Creating vector database for classroom {classroom_id} at: '{vectorstore_path}'")
-    # Directory will be created by Chroma automatically if it doesn't exist
+        if os.path.exists(staging_path):
+            shutil.rmtree(staging_path) # Left over from an interrupted run
+        if old_manifest is not None:
+            # Start from the current index; the live directory stays untouched. Backend workers
+            # add notes to it under this lock, so the copy never catches a write half done.
+            with index_write_lock(vectorstore_path):
+                shutil.copytree(vectorstore_path, staging_path, symlinks=True)
+        else:
+            os.makedirs(staging_path)
+    except Exception as e_stage:
+        print(f"ERROR: Could not prepare staging directory '{staging_path}': {e_stage}")
+        return False
 
-    # --- Embed and Store Documents ---
+    # Per-file bookkeeping while its page ranges come back from the parse stage (chunk ids only)
+    file_states = {}
+    segment_jobs = []
+    for file_path, relative_path, stat, file_hash, old_entry in parse_jobs:
+        page_ranges = _plan_page_ranges(file_path)
+        file_states[relative_path] = {
+            "stat": stat, "sha256": file_hash, "old_entry": old_entry,
+            "old_ids": set(old_entry["chunk_ids"]) if old_entry else set(),
+            "remaining": len(page_ranges), "failed": False,
+            "chunk_ids": set(), "new_ids": set(),
+        }
+        segment_jobs.extend((file_path, relative_path, page_range) for page_range in page_ranges)
+    report(stage="indexing", files_parsed=0, parse_jobs_total=len(segment_jobs), parse_jobs_done=0,
+           chunks_embedded=0, chunks_reused=0)
+
+    def finish_file(relative_path: str, state: dict):
+        old_entry = state["old_entry"]
+        if state["failed"]:
+            # Could not read it this time; drop any partial chunks, keep what was indexed before
+            stale_ids.update(state["new_ids"])
+            if old_entry:
+                new_files[relative_path] = old_entry
+            return
+        stale_ids.update(state["old_ids"] - state["chunk_ids"])
+        new_files[relative_path] = {
+            "size": state["stat"].st_size,
+            "mtime": state["stat"].st_mtime,
+            "sha256": state["sha256"],
+            "chunk_ids": sorted(state["chunk_ids"]),
+        }
+        print(f"    Parsed {relative_path}: {len(state['chunk_ids'])} chunks ({len(state['new_ids'])} new)")
+        report(files_parsed=sum(1 for s in file_states.values() if s["remaining"] == 0))
+
+    def new_chunk_batches():
+        """
+        Producer stage: parses changed files (page range by page range, in parallel)
+        and yields fixed-size batches of chunks that still need embedding.
+        """
+        batch = []
+        for done, ((file_path, relative_path, page_range), chunks) in enumerate(_parse_files_in_parallel(segment_jobs), 1):
+            report(parse_jobs_done=done)
+            state = file_states[relative_path]
+            state["remaining"] -= 1
+            if chunks is None:
+                state["failed"] = True
+            else:
+                old_ids = state["old_ids"]
+                for chunk_id, chunk in chunks.items():
+                    if SHARED_INDEX_ENABLED:
+                        chunk_id = shared_chunk_id(classroom_id, chunk_id)
+                        chunk.metadata["classroom_id"] = classroom_id
+                    if chunk_id in state["chunk_ids"]:
+                        continue # Same chunk already seen in another page range
+                    state["chunk_ids"].add(chunk_id)
+                    if chunk_id in old_ids:
+                        continue # Already embedded in the current index
+                    state["new_ids"].add(chunk_id)
+                    batch.append((chunk_id, chunk))
+                    if len(batch) >= EMBED_BATCH_SIZE:
+                        yield batch
+                        batch = []
+            if state["remaining"] == 0:
+                finish_file(relative_path, state)
+        if batch:
+            yield batch
+
+    # --- Embed and Store Changes ---
+    vectorstore = None
     try:
-        print("Embedding document chunks and storing them in ChromaDB...")
+        print(f"Updating vector database for classroom {classroom_id} (staged at '{staging_path}')")
         print(f"(Using embedding model: {embeddings.model_name})") # Project ID known globally
-        print("(This step might take a while)...")
-
-        # This function handles embedding generation and storage
-        vectorstore = Chroma.from_documents(
-            documents=docs_split, # Use the split documents
-            embedding=embeddings,
-            persist_directory=vectorstore_path # Tell Chroma to save to disk here
+        if SHARED_INDEX_ENABLED:
+            vectorstore = _open_shared_vectorstore(embeddings)
+            print(f"(Writing chunks into the shared index at '{SHARED_INDEX_PATH}')")
+        else:
+            vectorstore = Chroma(persist_directory=staging_path, embedding_function=embeddings)
+
+        pipeline_started = time.monotonic()
+        embedded_count, reused_count = _run_embedding_pipeline(
+            new_chunk_batches(), embeddings, vectorstore._collection, label=classroom_id,
+            on_progress=lambda written, reused: report(chunks_embedded=written, chunks_reused=reused),
         )
-        print(f"Successfully embedded and stored {len(docs_split)} chunks in '{vectorstore_path}'.")
-        print(f"--- Successfully processed classroom {classroom_name} (ID: {classroom_id}) ---")
-        return True # Indicate success for this classroom
+        report(stage="finalizing")
+        elapsed = time.monotonic() - pipeline_started
+        print(f"Embedded and stored {embedded_count} new chunks in {elapsed:.1f}s ({embedded_count / max(elapsed, 1e-6):.1f} chunks/s).")
+        if embedded_count:
+            print(f"Embedding store: {reused_count} of {embedded_count} chunks reused "
+                  f"({reused_count / embedded_count:.0%} hit rate), {embedded_count - reused_count} sent to the embeddings API.")
+
+        total_chunks = sum(len(entry["chunk_ids"]) for entry in new_files.values())
+        if total_chunks == 0:
+            raise ValueError("No valid content could be loaded; the index would be empty.")
+
+        if SHARED_INDEX_ENABLED:
+            live_ids = {chunk_id for entry in new_files.values() for chunk_id in entry["chunk_ids"]}
+            stale_ids |= _stale_shared_ids(vectorstore._collection, classroom_id, live_ids)
+        if stale_ids:
+            vectorstore.delete(ids=sorted(stale_ids))
+            print(f"Deleted {len(stale_ids)} outdated chunks.")
+
+        # BM25 index over every chunk now in the store, used next to vector search by the backend
+        lexical_started = time.monotonic()
+        where = classroom_filter(classroom_id) if SHARED_INDEX_ENABLED else None
+        lexical_index = build_from_collection(vectorstore._collection, where=where)
+        lexical_index.save(staging_path)
+        print(f"Built lexical index: {lexical_index.size} chunks, {len(lexical_index.terms)} terms in {time.monotonic() - lexical_started:.1f}s.")
+
+        if SHARED_INDEX_ENABLED:
+            # Backends reopen the shared collection when they reload this classroom
+            touch_stamp()
+        elif vector_index.RAG_VECTOR_BACKEND == "mmap":
+            # Read-optimized copy of the vectors for the backend; Chroma stays the store updates are made in
+            meta = vector_index.build_from_collection(vectorstore._collection, staging_path)
+            print(f"Built memory-mapped index: {meta['count']} vectors ({meta['dtype']}, {meta['nlist']} partitions).")
+
+        _write_manifest(staging_path, {
+            "version": MANIFEST_VERSION,
+            "classroom_id": classroom_id,
+            "name": classroom_name,
+            "embedding_model": embeddings.model_name,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "layout": RAG_INDEX_LAYOUT,
+            "updated_at": time.time(),
+            "files": new_files,
+        })
     except Exception as e_embed:
         print(f"ERROR: Failed during embedding or storing documents in ChromaDB for {classroom_id}: {e_embed}")
         print("Troubleshooting suggestions:")
         print("- Check your Google Cloud API quota for Vertex AI Embeddings.")
-        print("- Ensure sufficient disk space and permissions for the '{vectorstore_path}' directory.")
+        print(f"- Ensure sufficient disk space and permissions for the '{staging_path}' directory.")
         print("- Check network connectivity.")
+        print("The existing index (if any) was left unchanged.")
+        if vectorstore is not None and SHARED_INDEX_ENABLED:
+            # Take this run's chunks back out of the shared collection (the next run re-adds them)
+            written_ids = [chunk_id for state in file_states.values() for chunk_id in state["new_ids"]]
+            try:
+                if written_ids:
+                    vectorstore.delete(ids=written_ids)
+            except Exception as e_cleanup:
+                print(f"WARNING: Could not remove this run's chunks from the shared index: {e_cleanup}")
+        elif vectorstore is not None:
+            close_vectorstore(vectorstore)
+        shutil.rmtree(staging_path, ignore_errors=True)
         return False # Indicate failure for this classroom
 
+    # --- Swap the Update In ---
+    report(stage="swapping")
+    try:
+        # Flush and release Chroma before moving its directory
+        if not SHARED_INDEX_ENABLED:
+            close_vectorstore(vectorstore)
+        if vector_index.has_mmap_index(staging_path) and vector_index.has_mmap_index(vectorstore_path):
+            # Notes the backend added to the live index since the staging copy was taken
+            with index_write_lock(vectorstore_path):
+                vector_index.copy_overlay(os.path.join(vectorstore_path, vector_index.MMAP_INDEX_DIRNAME),
+                                          os.path.join(staging_path, vector_index.MMAP_INDEX_DIRNAME))
+        _swap_into_place(staging_path, vectorstore_path)
+    except Exception as e_swap:
+        print(f"ERROR: Could not move updated index into place at '{vectorstore_path}': {e_swap}")
+        return False
+
+    print(f"Index at '{vectorstore_path}' now holds {total_chunks} chunks.")
+    print(f"--- Successfully processed classroom {classroom_name} (ID: {classroom_id}) ---")
+    return True # Indicate success for this classroom
+
+
+def collect_embedding_garbage(default_model_name: str) -> int:
+    """
+    Removes embedding store entries no classroom index references any more (chunks of
+    deleted/changed files, removed classrooms). Marks the content keys of every chunk
+    in the live indexes under CHROMA_DBS_ROOT (and their part of the shared index),
+    then sweeps the rest. Returns the number of entries removed.
+    """
+    from langchain_community.vectorstores import Chroma
+    from backend.api.retrieval import close_vectorstore
+
+    started = time.time()
+    live_keys = set()
+    for name in sorted(os.listdir(CHROMA_DBS_ROOT)):
+        path = os.path.join(CHROMA_DBS_ROOT, name)
+        if not os.path.isdir(path) or is_swap_artifact(name):
+            continue # Skip staging copies and versions of a classroom
+        manifest = _load_manifest(path) or {}
+        model_name = manifest.get("embedding_model") or default_model_name
+        if manifest.get("layout") == "shared":
+            if os.path.isdir(SHARED_INDEX_PATH):
+                shared = _open_shared_vectorstore(embeddings=None)
+                for page in iter_classroom_pages(shared._collection, name, include=["documents"]):
+                    live_keys.update(content_key(model_name, text) for text in page["documents"] if text)
+            continue
+        if not os.path.exists(os.path.join(path, "chroma.sqlite3")):
+            continue
+        vectorstore = Chroma(persist_directory=path)
+        try:
+            offset = 0
+            while True:
+                page = vectorstore._collection.get(include=["documents"], limit=1000, offset=offset)
+                documents = page.get("documents") or []
+                live_keys.update(content_key(model_name, text) for text in documents if text)
+                if len(documents) < 1000:
+                    break
+                offset += len(documents)
+        finally:
+            close_vectorstore(vectorstore)
+    removed = embedding_store.collect_garbage(live_keys, created_before=started)
+    print(f"Embedding store GC: {len(live_keys)} live entries kept, {removed} unreferenced entries removed.")
+    return removed
+
 
 # --- Main Execution Logic ---
 if __name__ == "__main__":
     print("--- Main execution started ---")
+    parser = argparse.ArgumentParser(description="Build or update the classroom vector indexes.")
+    parser.add_argument("--gc", action="store_true",
+                        help="After indexing, remove embedding store entries no classroom index uses any more.")
+    args = parser.parse_args()
     # Load environment variables from .env file at the start
     load_dotenv()
     google_project_id = os.getenv("GOOGLE_PROJECT_ID")
@@ -244,6 +837,7 @@ if __name__ == "__main__":
     embeddings_client = None
     try:
         print("Initializing embeddings model globally...")
+        from langchain_google_vertexai import VertexAIEmbeddings
         embeddings_client = VertexAIEmbeddings(
             model_name="text-embedding-004",
             project=google_project_id
@@ -263,22 +857,41 @@ if __name__ == "__main__":
         exit(1)
 
 
-    # Loop through defined classrooms and process each
+    # Process classrooms in parallel; they share the parse pool and embedding rate limit
     if not CLASSROOMS:
          print("WARNING: No classrooms defined in the CLASSROOMS dictionary. Nothing to process.")
     else:
-        for c_id, c_config in CLASSROOMS.items():
-            if process_classroom(c_id, c_config, embeddings_client):
-                processed_count += 1
+        try:
+            with ThreadPoolExecutor(max_workers=CLASSROOM_CONCURRENCY) as classroom_pool:
+                results = classroom_pool.map(
+                    lambda item: process_classroom(item[0], item[1], embeddings_client),
+                    CLASSROOMS.items(),
+                )
+                for succeeded in results:
+                    if succeeded:
+                        processed_count += 1
+                    else:
+                        failed_count += 1
+        finally:
+            shutdown_parse_pool()
+
+    # A failed classroom may still have its old index in place, so only sweep after a clean run
+    try:
+        if args.gc and embedding_store.enabled:
+            if failed_count:
+                print("Skipping embedding store GC: not every classroom was processed.")
             else:
-                failed_count += 1
+                collect_embedding_garbage(embeddings_client.model_name)
+    finally:
+        close_shared_vectorstore()
 
     print("\n--- Processing Summary ---")
     print(f"Successfully processed: {processed_count} classroom(s)")
     print(f"Failed to process: {failed_count} classroom(s)")
+    store_stats = embedding_store.stats()
+    if store_stats["enabled"]:
+        print(f"Embedding store: {store_stats['hits']} hits, {store_stats['misses']} misses "
+              f"({store_stats['hit_rate']:.0%} hit rate), {store_stats.get('entries', 0)} entries, "
+              f"{store_stats.get('vector_bytes', 0) / 1024 / 1024:.1f} MB of vectors.")
     print("--- Script End ---")
 
-else:
-    # This part likely won't be used if script is run directly
-    print(f"--- Script loaded as module (__name__: {__name__}). Main processing skipped. ---")
-
@@ -12,6 +12,9 @@ if __name__ == "__main__":
     # Define the directory containing the backend code relative to the script dir
     backend_dir = os.path.join(script_dir, 'backend')
 
+    # Pick up edits to frontend/ without a restart (the server otherwise reads it once at startup)
+    os.environ.setdefault("FRONTEND_RELOAD", "true")
+
     print("Starting Uvicorn server...")
     print("Watching for changes in:", backend_dir)
     print("Access API docs at http://127.0.0.1:8000/docs")
@@ -0,0 +1,50 @@
+# run_ingestion_worker.py
+# Dedicated ingestion process: runs the re-indexing jobs queued through the API
+# (INGESTION_JOBS_DB_PATH) so web workers never parse or embed documents themselves.
+# All jobs share this one process's parse pool and embedding rate limit, however many
+# web workers there are. run_production.py starts it next to its workers; web workers
+# notice finished jobs through the job table and swap the new indexes in.
+#
+#   python run_ingestion_worker.py               # INGESTION_WORKERS jobs at once
+#   python run_ingestion_worker.py --jobs 2
+
+import argparse
+import os
+import signal
+import threading
+
+from dotenv import load_dotenv
+
+# Load .env before importing the API modules so their configuration constants see it
+load_dotenv()
+
+from backend.api.ingestion_jobs import INGESTION_WORKERS, JobRunner, job_store
+from backend.api.logging_config import configure_logging
+
+# --- Configuration ---
+# Seconds a running job gets to finish after SIGTERM; after that it is abandoned
+# (the next worker to start marks it failed once its heartbeat is stale)
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued ingestion jobs in this process.")
+    parser.add_argument("--jobs", type=int, default=max(1, INGESTION_WORKERS), help="Jobs to run at once.")
+    args = parser.parse_args()
+
+    configure_logging()
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    runner = JobRunner(job_store, max(1, args.jobs), serving=False)
+    runner.start()
+    print(f"Ingestion worker {runner.worker_id} running up to {runner.workers} job(s) at once")
+    while not stopping.wait(1.0):
+        pass
+    print("Stopping ingestion worker...")
+    runner.stop(timeout=GRACEFUL_SHUTDOWN_SECONDS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# run_production.py
+# Production entry point: several Uvicorn worker processes, no reload watcher.
+# For development use run_backend.py instead.
+#
+#   python run_production.py                      # settings from the environment / .env
+#   python run_production.py --workers 4 --port 8080
+#
+# What the workers share and what they don't:
+# - Notes live in SQLite (NOTES_DB_PATH, WAL mode), so every worker sees every note.
+# - Classroom indexes are read from the same chroma_dbs/ files. Vectors are searched
+#   in the memory-mapped index (RAG_VECTOR_BACKEND defaults to "mmap" here), whose
+#   pages the OS page cache shares between workers, so N workers do not mean N copies.
+#   Classrooms without one fall back to Chroma, which keeps each open HNSW index in
+#   process memory, one copy per worker (build the mmap indexes with
+#   migrate_vector_index.py; jobs run by the ingestion process build them as well).
+#   RAG_TOTAL_CACHE_MEMORY_MB splits one memory budget across the workers to keep
+#   the total bounded.
+# - Answer/embedding caches, the admission limiter (RAG_MAX_CONCURRENCY) and the
+#   /metrics counters are per worker.
+# - Re-indexing jobs run in one separate process (run_ingestion_worker.py, started and
+#   stopped with the workers), so one parse pool and one embedding rate limit serve
+#   them all; the workers only queue jobs and swap finished indexes in.
+#
+# Load balancers should use GET /readyz (200 once a worker's warm-up is done, 503
+# while starting or draining) and GET /healthz for liveness.
+
+import argparse
+import os
+import subprocess
+import sys
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Worker processes; each one loads its own copy of the hot classrooms
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+# Seconds in-flight requests get to finish after SIGTERM before workers exit
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+# Memory budget for cached classrooms across all workers (0 = leave RAG_CACHE_MAX_MEMORY_MB as is)
+RAG_TOTAL_CACHE_MEMORY_MB = int(os.getenv("RAG_TOTAL_CACHE_MEMORY_MB", "0"))
+# Reverse proxies allowed to set X-Forwarded-For / X-Forwarded-Proto
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+# Start run_ingestion_worker.py alongside the workers (false: run it yourself, or not at all)
+INGESTION_PROCESS = os.getenv("INGESTION_PROCESS", "true").lower() == "true"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend with multiple worker processes.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    # Workers are separate processes started with this environment
+    if RAG_TOTAL_CACHE_MEMORY_MB:
+        os.environ["RAG_CACHE_MAX_MEMORY_MB"] = str(max(1, RAG_TOTAL_CACHE_MEMORY_MB // workers))
+    # Preload the most recently indexed classrooms (as many as each worker's cache holds) unless
+    # told otherwise, so workers are ready before traffic arrives
+    os.environ.setdefault("RAG_WARM_CLASSROOMS", "*")
+    # After SIGTERM, report "draining" on /readyz for a few seconds before closing the listeners
+    os.environ.setdefault("READINESS_DRAIN_SECONDS", "5")
+    # Search memory-mapped indexes, shared between workers through the page cache, unless
+    # told otherwise (the ingestion process started below builds them with this setting).
+    # The shared index layout always searches Chroma.
+    if os.getenv("RAG_INDEX_LAYOUT", "per_classroom").lower() != "shared":
+        os.environ.setdefault("RAG_VECTOR_BACKEND", "mmap")
+
+    ingestion = None
+    if INGESTION_PROCESS:
+        ingestion = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   "run_ingestion_worker.py")])
+    # Web workers queue jobs and swap the results in, but run none themselves
+    os.environ["INGESTION_WORKERS"] = "0"
+
+    print(f"Starting {workers} worker(s) on http://{args.host}:{args.port}")
+    try:
+        uvicorn.run(
+            "backend.main:app",
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            reload=False,
+            proxy_headers=True,
+            forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+            timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+            log_level=os.getenv("LOG_LEVEL", "info").lower(),
+        )
+    finally:
+        if ingestion is not None:
+            ingestion.terminate()
+            try:
+                ingestion.wait(GRACEFUL_SHUTDOWN_SECONDS)
+            except subprocess.TimeoutExpired:
+                ingestion.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+# tests/conftest.py
+# Loaded before the test modules import the backend, whose stores open SQLite files
+# named by these settings: keep them out of the working tree.
+import os
+import tempfile
+
+_STATE_DIR = tempfile.mkdtemp(prefix="llc-tests-")
+for _setting, _filename in (("NOTES_DB_PATH", "notes.db"), ("EMBEDDING_STORE_PATH", "embedding_store.db"),
+                            ("INGESTION_JOBS_DB_PATH", "ingestion_jobs.db")):
+    os.environ.setdefault(_setting, os.path.join(_STATE_DIR, _filename))
+os.environ.setdefault("GOOGLE_PROJECT_ID", "tests")
+os.environ.setdefault("RAG_WARM_CLASSROOMS", "")
@@ -0,0 +1,65 @@
+# tests/test_answer_cache.py
+import time
+
+from backend.api.answer_cache import AnswerCache, normalize_query
+from bench.fakes import FakeEmbeddings
+
+
+def _cache(**settings) -> AnswerCache:
+    return AnswerCache(**{"ttl_seconds": 60, "max_entries": 10, "similarity_threshold": 0.9, **settings})
+
+
+def test_normalized_questions_hit_exactly():
+    cache = _cache()
+    cache.store("c1", "What is photosynthesis?", "answer", version=1)
+    assert normalize_query("  what IS   photosynthesis ") == normalize_query("What is photosynthesis?")
+    assert cache.lookup_exact("c1", "what is photosynthesis", version=1) == "answer"
+    assert cache.lookup_exact("c2", "what is photosynthesis", version=1) is None # Per classroom
+
+
+def test_near_duplicates_hit_semantically():
+    embeddings = FakeEmbeddings()
+    cache = _cache(similarity_threshold=0.8)
+    question = "explain how plants make their food from sunlight"
+    cache.store("c1", question, "answer", version=1, query_embedding=embeddings.embed_query(question))
+    similar = embeddings.embed_query("explain how plants make food from sunlight")
+    unrelated = embeddings.embed_query("when did the french revolution begin")
+    assert cache.lookup_similar("c1", similar, version=1) == "answer"
+    assert cache.lookup_similar("c1", unrelated, version=1) is None
+    assert (cache.exact_hits, cache.semantic_hits) == (0, 1)
+
+
+def test_new_index_version_drops_the_classroom_answers():
+    cache = _cache()
+    cache.store("c1", "q", "old answer", version=1)
+    cache.store("c2", "q", "other classroom", version=1)
+    assert cache.lookup_exact("c1", "q", version=2) is None
+    assert cache.lookup_exact("c2", "q", version=1) == "other classroom"
+    assert cache.invalidations == 1
+
+
+def test_late_store_for_an_old_version_is_dropped():
+    cache = _cache()
+    cache.store("c1", "q", "answer", version=1)
+    assert cache.lookup_exact("c1", "other", version=2) is None # A note moved the classroom to version 2
+    cache.store("c1", "q", "answered from version 1", version=1) # Finished after that
+    cache.store("c1", "fresh", "answer", version=2)
+    assert cache.lookup_exact("c1", "q", version=2) is None
+    assert cache.lookup_exact("c1", "fresh", version=2) == "answer"
+    assert cache.invalidations == 1 # The late store did not reset the version
+
+
+def test_expired_answers_are_only_served_stale():
+    cache = _cache(ttl_seconds=0.05, stale_seconds=60)
+    cache.store("c1", "q", "answer", version=1)
+    time.sleep(0.06)
+    assert cache.lookup_exact("c1", "q", version=1) is None
+    assert cache.lookup_stale("c1", "q", None, version=1) == "answer"
+
+
+def test_classroom_keeps_at_most_max_entries():
+    cache = _cache(max_entries=2)
+    for question in ("q1", "q2", "q3"):
+        cache.store("c1", question, question, version=1)
+    assert cache.lookup_exact("c1", "q1", version=1) is None
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,97 @@
+# tests/test_component_cache.py
+import threading
+import time
+
+from backend.api.component_cache import ComponentCache
+
+
+def _tracking_cache(**limits):
+    evicted = []
+    cache = ComponentCache(on_evict=lambda classroom_id, components: evicted.append(classroom_id), **limits)
+    return cache, evicted
+
+
+def test_lru_eviction_by_count_closes_evicted_entries():
+    cache, evicted = _tracking_cache(max_entries=2)
+    cache.put("a", {"id": "a"})
+    cache.put("b", {"id": "b"})
+    cache.get("a") # b is now least recently used
+    cache.put("c", {"id": "c"})
+    assert sorted(cache.keys()) == ["a", "c"]
+    assert evicted == ["b"] and cache.evictions == 1
+
+
+def test_memory_budget_keeps_the_newest_entry():
+    cache, evicted = _tracking_cache(max_memory_bytes=100, size_fn=lambda components: components["size"])
+    cache.put("a", {"size": 60})
+    cache.put("b", {"size": 60})
+    assert cache.keys() == ["b"] and evicted == ["a"]
+    cache.put("c", {"size": 500}) # Over budget on its own, but never evicts itself
+    assert cache.keys() == ["c"]
+
+
+def test_idle_entries_expire():
+    cache, evicted = _tracking_cache(ttl_seconds=0.05)
+    cache.put("a", {})
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert evicted == ["a"]
+
+
+def test_single_flight_build_and_lock_cleanup():
+    cache, _ = _tracking_cache()
+    builds = []
+    started = threading.Event()
+
+    def factory(classroom_id):
+        builds.append(classroom_id)
+        started.set()
+        time.sleep(0.05)
+        return {"id": classroom_id}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("a", factory))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert builds == ["a"]
+    assert all(result is results[0] for result in results)
+    assert (cache.misses, cache.hits) == (1, 7)
+    assert cache._init_locks == {} # Dropped once nobody holds or waits for it
+
+
+def test_failed_build_releases_the_lock_for_the_next_caller():
+    cache, _ = _tracking_cache()
+
+    def failing(classroom_id):
+        raise RuntimeError("no index")
+
+    try:
+        cache.get_or_create("a", failing)
+    except RuntimeError:
+        pass
+    assert cache._init_locks == {}
+    assert cache.get_or_create("a", lambda classroom_id: {"id": classroom_id}) == {"id": "a"}
+
+
+def test_stale_entries_are_rebuilt_and_the_old_one_closed():
+    cache, evicted = _tracking_cache()
+    first = cache.get_or_create("a", lambda classroom_id: {"version": 1})
+    second = cache.get_or_create("a", lambda classroom_id: {"version": 2},
+                                 is_stale=lambda components: components["version"] < 2)
+    assert (first["version"], second["version"]) == (1, 2)
+    assert evicted == ["a"]
+
+
+def test_replace_only_swaps_the_entry_it_was_given():
+    cache, evicted = _tracking_cache()
+    current = {"vectorstore": object(), "index_version": 1}
+    cache.put("a", current)
+    updated = dict(current, index_version=2)
+    assert cache.replace("a", current, updated)
+    assert cache.get("a") is updated
+    # A caller still holding the old components loses to the newer replacement
+    assert not cache.replace("a", current, dict(current, index_version=3))
+    assert not cache.replace("missing", current, updated)
+    assert evicted == [] # Shared resources are not closed
@@ -0,0 +1,115 @@
+# tests/test_concurrency.py
+import asyncio
+
+import pytest
+
+from backend.api.concurrency import ConcurrencyLimiter, RateLimitedError, ServiceOverloadedError
+
+
+async def _run(limiter, classroom_id, order=None, priority=False, hold=0.01):
+    async with limiter.slot(classroom_id, priority=priority):
+        if order is not None:
+            order.append(classroom_id + ("!" if priority else ""))
+        await asyncio.sleep(hold)
+
+
+def test_weighted_fair_queuing_does_not_starve_other_classrooms():
+    async def scenario():
+        limiter = ConcurrencyLimiter(2, 100, 10, wait_slo=0)
+        order = []
+        tasks = [asyncio.create_task(_run(limiter, "a", order)) for _ in range(20)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(_run(limiter, "b", order)) for _ in range(3)]
+        tasks.append(asyncio.create_task(_run(limiter, "a", order, priority=True)))
+        await asyncio.gather(*tasks)
+        return order, limiter
+
+    order, limiter = asyncio.run(scenario())
+    # The teacher's request jumps the queue; b's three are interleaved with a's burst
+    assert order.index("a!") <= 3
+    assert max(i for i, classroom_id in enumerate(order) if classroom_id == "b") < 10
+    assert (limiter.running, limiter.waiting) == (0, 0)
+
+
+def test_weights_share_slots_in_proportion():
+    async def scenario():
+        limiter = ConcurrencyLimiter(1, 100, 10, wait_slo=0, classroom_limits={"heavy": {"weight": 3}})
+        order = []
+        tasks = [asyncio.create_task(_run(limiter, classroom_id, order, hold=0))
+                 for classroom_id in ["light"] * 8 + ["heavy"] * 8]
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(scenario())
+    # Once both are waiting, heavy gets three slots for each one of light's
+    assert order[1:9].count("heavy") >= 5
+
+
+def test_queue_full_is_rejected_at_once():
+    async def scenario():
+        limiter = ConcurrencyLimiter(1, 1, 10, wait_slo=0)
+        holder = asyncio.create_task(_run(limiter, "a", hold=0.1))
+        waiter = asyncio.create_task(_run(limiter, "a"))
+        await asyncio.sleep(0)
+        assert limiter.is_saturated()
+        with pytest.raises(ServiceOverloadedError):
+            await _run(limiter, "b")
+        await asyncio.gather(holder, waiter)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.shed["queue_full"] == 1
+
+
+def test_rate_limit_answers_429_and_refunds_tokens_of_timed_out_requests():
+    async def scenario():
+        limiter = ConcurrencyLimiter(1, 100, 0.05, classroom_limits={"*": {"rate_per_second": 0.5, "burst": 2}})
+        holder = asyncio.create_task(_run(limiter, "other", hold=0.2))
+        await asyncio.sleep(0)
+        # Takes a token, then times out in the queue: the token comes back
+        with pytest.raises(ServiceOverloadedError) as timed_out:
+            await _run(limiter, "x")
+        assert not isinstance(timed_out.value, RateLimitedError)
+        await holder
+        await _run(limiter, "x")
+        await _run(limiter, "x")
+        with pytest.raises(RateLimitedError) as limited:
+            await _run(limiter, "x")
+        return limiter, limited.value
+
+    limiter, error = asyncio.run(scenario())
+    assert error.status_code == 429 and error.retry_after >= 1
+    assert limiter.shed["timeout"] == 1 and limiter.shed["rate_limited"] == 1
+
+
+def test_wait_objective_sheds_classrooms_already_waiting():
+    async def scenario():
+        limiter = ConcurrencyLimiter(1, 100, 5, wait_slo=0.05)
+        holder = asyncio.create_task(_run(limiter, "a", hold=0.2))
+        waiter = asyncio.create_task(_run(limiter, "c"))
+        await asyncio.sleep(0.1)
+        with pytest.raises(ServiceOverloadedError):
+            await _run(limiter, "c")
+        # A classroom with nothing waiting, and teachers, are still admitted
+        admitted = [asyncio.create_task(_run(limiter, "d")), asyncio.create_task(_run(limiter, "c", priority=True))]
+        await asyncio.gather(holder, waiter, *admitted)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.shed["slo"] == 1
+    assert (limiter.running, limiter.waiting) == (0, 0)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = ConcurrencyLimiter(1, 100, 10, wait_slo=0)
+        holder = asyncio.create_task(_run(limiter, "a", hold=0.05))
+        waiter = asyncio.create_task(_run(limiter, "b"))
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        waiter.cancel()
+        await asyncio.gather(holder, waiter, return_exceptions=True)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert (limiter.running, limiter.waiting) == (0, 0)
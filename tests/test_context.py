@@ -0,0 +1,51 @@
+# tests/test_context.py
+from langchain_core.documents import Document
+
+from backend.api.context import ContextAssembler, estimate_tokens
+from bench.corpus import generate_corpus
+
+
+def _docs(*texts):
+    return [Document(page_content=text) for text in texts]
+
+
+def test_token_estimate_counts_other_scripts_denser():
+    assert estimate_tokens("abcd" * 10) == 10
+    assert estimate_tokens("தமிழ்" * 2) == 5
+
+
+def test_context_stays_within_the_token_budget(tmp_path):
+    generate_corpus(str(tmp_path), classrooms=1, files_per_classroom=4, chars_per_file=4000, seed=1)
+    texts = [path.read_text(encoding="utf-8") for path in sorted(tmp_path.rglob("*.txt"))]
+    assembler = ContextAssembler(enabled=True, token_budget=200, min_relevance=0.0)
+    question = texts[0].split(".")[0]
+    context, retrieved, used = assembler.assemble(_docs(*texts), question)
+    assert retrieved > 1000
+    assert used <= 200 and used == estimate_tokens(context)
+    assert question.strip() in context # The best-matching sentence is kept
+    assert assembler.stats()["saved_tokens"] == retrieved - used
+
+
+def test_overlap_and_repeated_sentences_are_removed():
+    shared = "Chlorophyll absorbs red and blue light to drive photosynthesis in leaves."
+    first = "Leaves are green. " + shared
+    second = shared + " Stomata let carbon dioxide into the leaf."
+    assembler = ContextAssembler(enabled=True, token_budget=0, min_relevance=0.0)
+    context, _, _ = assembler.assemble(_docs(first, second), "How do leaves make food?")
+    assert context.count("Chlorophyll absorbs") == 1
+    assert "Stomata let carbon dioxide" in context
+
+
+def test_irrelevant_sentences_are_dropped_and_order_is_kept():
+    docs = _docs("Osmosis moves water across membranes. The school bus leaves at four.",
+                 "Water potential drives osmosis in root cells.")
+    assembler = ContextAssembler(enabled=True, token_budget=0, min_relevance=0.2)
+    context, _, _ = assembler.assemble(docs, "What drives osmosis of water?")
+    assert "school bus" not in context
+    assert context.index("Osmosis moves water") < context.index("Water potential")
+
+
+def test_disabled_assembler_passes_chunks_through():
+    docs = _docs("one.", "two.")
+    context, _, _ = ContextAssembler(enabled=False, token_budget=1, min_relevance=0.5).assemble(docs, "x")
+    assert context == "one.\n\ntwo."
@@ -0,0 +1,46 @@
+# tests/test_fakes.py
+import numpy as np
+import pytest
+
+from bench.fakes import FakeBackendError, FakeEmbeddings, FaultModel, LatencyModel
+
+
+def test_fake_embeddings_are_deterministic_and_normalized():
+    embeddings = FakeEmbeddings()
+    first, again = embeddings.embed_documents(["photosynthesis in plants"]), embeddings.embed_query("photosynthesis in plants")
+    assert first[0] == again
+    assert np.linalg.norm(again) == pytest.approx(1.0, abs=1e-5)
+    assert (embeddings.requests, embeddings.texts) == (2, 2)
+
+
+def test_fake_embeddings_rank_overlapping_texts_closer():
+    embeddings = FakeEmbeddings()
+    query, related, unrelated = (np.array(v) for v in embeddings.embed_documents(
+        ["how do plants make food", "plants make food from sunlight", "the french revolution began in 1789"]))
+    assert query @ related > query @ unrelated
+
+
+def test_latency_specs():
+    assert LatencyModel("0").sample_seconds() == 0.0
+    assert LatencyModel("const:50").sample_seconds() == pytest.approx(0.05)
+    assert 0.02 <= LatencyModel("uniform:20-80", seed=1).sample_seconds() <= 0.08
+    assert LatencyModel("lognormal:50,0.5", seed=1).sample_seconds() > 0
+    with pytest.raises(ValueError):
+        LatencyModel("fixed:5")
+
+
+def test_fault_model_injects_at_the_configured_rate():
+    faults = FaultModel("error:0.25", seed=3)
+    failures = 0
+    for _ in range(2000):
+        try:
+            faults.inject()
+        except FakeBackendError as e:
+            assert e.code == 503
+            failures += 1
+    assert failures == faults.errors
+    assert 400 <= failures <= 600
+    faults.set(error_rate=0.0)
+    faults.inject() # Recovered
+    with pytest.raises(ValueError):
+        FaultModel("drop:0.1")
@@ -0,0 +1,70 @@
+# tests/test_hybrid_retrieval.py
+import pytest
+
+from backend.api.lexical_index import LexicalIndex, tokenize
+from backend.api.retrieval import ClassroomRetriever, search_by_vectors
+from backend.api.vector_index import MmapVectorStore, write_mmap_index
+from bench.fakes import FakeEmbeddings
+
+CHUNKS = {
+    "osmosis": "Osmosis moves water across a membrane from low to high solute concentration.",
+    "section": "Section 3.2.1 lists the laboratory safety rules for handling acids.",
+    "photosynthesis": "Plants make food from sunlight, water and carbon dioxide in photosynthesis.",
+    "respiration": "Cells release energy from food in respiration, using oxygen.",
+    "tamil": "ஒளிச்சேர்க்கை மூலம் தாவரங்கள் உணவு தயாரிக்கின்றன.",
+}
+
+
+@pytest.fixture
+def classroom(tmp_path):
+    embeddings = FakeEmbeddings()
+    ids, texts = list(CHUNKS), list(CHUNKS.values())
+    write_mmap_index(str(tmp_path), ids, texts, [{"source": f"{chunk_id}.pdf"} for chunk_id in ids],
+                     embeddings.embed_documents(texts), nlist=0)
+    vectorstore = MmapVectorStore(str(tmp_path), embedding_function=embeddings)
+    yield vectorstore, embeddings, LexicalIndex.build(CHUNKS.items())
+    vectorstore.close()
+
+
+def test_tokenizer_keeps_section_numbers_and_tamil_words():
+    assert "3.2.1" in tokenize("See Section 3.2.1.")
+    assert tokenize("ஒளிச்சேர்க்கை மூலம்") == ["ஒளிச்சேர்க்கை", "மூலம்"]
+
+
+def test_bm25_ranks_matching_chunks_and_survives_a_reload(tmp_path):
+    index = LexicalIndex.build(CHUNKS.items())
+    hits = index.search("food from sunlight", top_n=3)
+    assert hits[0][0] == "photosynthesis"
+    assert "respiration" in {chunk_id for chunk_id, _ in hits}
+    assert index.search("quantum chromodynamics", top_n=3) == []
+    index.save(str(tmp_path))
+    assert LexicalIndex.load(str(tmp_path)).search("food from sunlight", top_n=3) == hits
+
+
+def test_fusion_ranks_agreement_first_and_fetches_lexical_only_hits(classroom):
+    vectorstore, embeddings, lexical_index = classroom
+    retriever = ClassroomRetriever.create(vectorstore, embeddings, k=2, lexical_index=lexical_index)
+    docs = vectorstore.get_by_ids(list(CHUNKS))
+    query = "laboratory safety rules of section 3.2.1" # Only the section chunk has these words
+
+    # Third in the vector ranking, first in BM25: fusion puts it first
+    fused = retriever._fuse(query, [docs["osmosis"], docs["photosynthesis"], docs["section"]])
+    assert [doc.id for doc in fused] == ["section", "osmosis"]
+
+    # Missing from the vector ranking altogether: still found, its text fetched from the store
+    fused = retriever._fuse(query, [docs["osmosis"]])
+    assert [doc.id for doc in fused] == ["osmosis", "section"]
+    assert fused[1].page_content == CHUNKS["section"]
+
+    # A chunk both rankings put first stays first
+    question = "how do plants make food from sunlight"
+    assert retriever.search_many([question], [embeddings.embed_query(question)])[0][0].id == "photosynthesis"
+
+
+def test_without_a_lexical_index_results_are_the_vector_ranking(classroom):
+    vectorstore, embeddings, _ = classroom
+    retriever = ClassroomRetriever.create(vectorstore, embeddings, k=2)
+    query_embedding = embeddings.embed_query("cells release energy using oxygen")
+    expected = [doc.id for doc in search_by_vectors(vectorstore, [query_embedding], 2)[0]]
+    assert [doc.id for doc in retriever.search_many(["q"], [query_embedding])[0]] == expected
+    assert expected[0] == "respiration"
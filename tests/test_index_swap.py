@@ -0,0 +1,47 @@
+# tests/test_index_swap.py
+import os
+
+from backend.api.index_lock import is_swap_artifact, swap_directory
+
+
+def _directory(path, content: str) -> str:
+    os.makedirs(path)
+    with open(os.path.join(path, "data"), "w") as f:
+        f.write(content)
+    return str(path)
+
+
+def _read(path) -> str:
+    with open(os.path.join(path, "data")) as f:
+        return f.read()
+
+
+def test_swap_replaces_a_plain_directory_with_a_versioned_link(tmp_path):
+    live = _directory(tmp_path / "classroom", "old")
+    swap_directory(_directory(tmp_path / "classroom.staging", "new"), live)
+    assert os.path.islink(live) and _read(live) == "new"
+    assert sorted(os.listdir(tmp_path)) == ["classroom", os.readlink(live)]
+
+
+def test_repeated_swaps_keep_only_the_current_version(tmp_path):
+    live = str(tmp_path / "classroom")
+    for version in ("1", "2", "3"):
+        swap_directory(_directory(tmp_path / "classroom.staging", version), live)
+    assert _read(live) == "3"
+    assert sorted(os.listdir(tmp_path)) == ["classroom", os.readlink(live)]
+
+
+def test_an_open_version_stays_readable_after_a_swap(tmp_path):
+    live = str(tmp_path / "classroom")
+    swap_directory(_directory(tmp_path / "classroom.staging", "old"), live)
+    with open(os.path.join(live, "data")) as reader: # Opened before the swap, like a mapped index
+        swap_directory(_directory(tmp_path / "classroom.staging", "new"), live)
+        assert reader.read() == "old"
+    assert _read(live) == "new"
+
+
+def test_swap_artifacts_are_not_classrooms():
+    assert not is_swap_artifact("math_g10_tamil")
+    for name in ("math_g10_tamil.staging", "math_g10_tamil.v-1792194104379898748",
+                 "math_g10_tamil.link-tmp", "math_g10_tamil.old-1700000000"):
+        assert is_swap_artifact(name)
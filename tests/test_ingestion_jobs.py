@@ -0,0 +1,51 @@
+# tests/test_ingestion_jobs.py
+import pytest
+
+from backend.api import ingestion_jobs
+from backend.api.ingestion_jobs import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def test_one_active_job_per_classroom(store):
+    job, created = store.enqueue("a", {"name": "A"})
+    again, created_again = store.enqueue("a", {"name": "A"})
+    assert created and not created_again and again["id"] == job["id"]
+
+
+def test_only_the_owning_worker_updates_a_running_job(store):
+    store.enqueue("a", {})
+    job = store.claim_next("worker-1")
+    assert job["state"] == "running" and job["heartbeat_at"] is not None
+    assert not store.update_progress(job["id"], "worker-2", {"stage": "parsing"})
+    assert store.update_progress(job["id"], "worker-1", {"stage": "parsing"})
+    assert store.heartbeat("worker-1") == 1 and store.heartbeat("worker-2") == 0
+    assert not store.finish(job["id"], "worker-2", True, {})
+    assert store.finish(job["id"], "worker-1", True, {})
+    assert store.get(job["id"])["state"] == "succeeded"
+
+
+def test_reaped_job_cannot_be_finished_by_its_old_worker(store, monkeypatch):
+    store.enqueue("a", {})
+    job = store.claim_next("worker-1")
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_STALE_JOB_SECONDS", -1) # Every heartbeat is stale
+    assert store.claim_next("worker-2") is None
+    assert store.get(job["id"])["state"] == "failed"
+    assert not store.finish(job["id"], "worker-1", True, {})
+    assert store.get(job["id"])["error"] == "Worker stopped responding"
+
+
+def test_queued_job_waits_while_its_classroom_has_one_running(store):
+    store.enqueue("a", {})
+    running = store.claim_next("worker-1")
+    # A row the enqueue check would not allow, as left by an older version or a reaped job's retry
+    store._connection().execute(
+        "INSERT INTO ingestion_jobs (classroom_id, config, state, created_at) VALUES ('a', '{}', 'queued', 0)")
+    store.enqueue("b", {})
+    assert store.claim_next("worker-2")["classroom_id"] == "b"
+    assert store.claim_next("worker-3") is None
+    store.finish(running["id"], "worker-1", True, {})
+    assert store.claim_next("worker-3")["classroom_id"] == "a"
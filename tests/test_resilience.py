@@ -0,0 +1,135 @@
+# tests/test_resilience.py
+import asyncio
+import time
+
+import pytest
+
+from backend.api.resilience import CallPolicy, CircuitBreaker, CircuitOpenError, is_transient
+from bench.fakes import FakeBackendError, FakeEmbeddings, FaultModel
+
+
+def _policy(retries=2, timeout=1.0, **breaker_settings) -> CallPolicy:
+    breaker = CircuitBreaker("test", **{"min_failures": 3, "failure_ratio": 0.5, "window": 10,
+                                        "reset_seconds": 0.1, **breaker_settings})
+    return CallPolicy("test", timeout=timeout, retries=retries, breaker=breaker, base_delay=0.0, max_delay=0.0)
+
+
+def test_transient_errors_are_an_allowlist():
+    assert is_transient(TimeoutError())
+    assert is_transient(FakeBackendError("down"))
+    assert is_transient(type("ServiceUnavailable", (Exception,), {})())
+    assert not is_transient(ValueError("bad request"))
+    assert not is_transient(KeyError("bug"))
+    assert not is_transient(CircuitOpenError("llm", 5))
+
+
+def test_breaker_opens_half_opens_and_closes():
+    breaker = CircuitBreaker("test", min_failures=3, failure_ratio=0.5, window=10, reset_seconds=0.05)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as rejected:
+        breaker.before_call()
+    assert rejected.value.retry_after >= 1
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call() # The one trial call
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call() # No second trial while the first is out
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert (breaker.opened, breaker.rejected) == (1, 2)
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker("test", min_failures=1, failure_ratio=0.0, window=5, reset_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opened == 2
+
+
+def test_call_retries_transient_failures_of_the_fake_backend():
+    faults = FaultModel("error:1.0")
+    embeddings = FakeEmbeddings(faults=faults)
+    policy = _policy(retries=2)
+    calls = []
+
+    def embed():
+        calls.append(1)
+        if len(calls) == 3:
+            faults.set(error_rate=0.0) # Recovers in time for the last retry
+        return embeddings.embed_query("question")
+
+    assert len(policy.call(embed)) > 0
+    assert (policy.retried, policy.failures, len(calls)) == (2, 2, 3)
+
+
+def test_call_does_not_retry_permanent_errors():
+    policy = _policy(retries=3)
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        policy.call(broken)
+    assert len(calls) == 1
+    assert policy.breaker.state == CircuitBreaker.CLOSED # The backend answered
+
+
+def test_call_times_out_hung_backend_and_trips_the_breaker():
+    embeddings = FakeEmbeddings(faults=FaultModel("hang:1.0,hang_ms:300"))
+    policy = _policy(retries=0, timeout=0.05)
+    for _ in range(3):
+        with pytest.raises(TimeoutError):
+            policy.call(lambda: embeddings.embed_query("question"))
+    with pytest.raises(CircuitOpenError):
+        policy.call(lambda: embeddings.embed_query("question"))
+    assert policy.timeouts == 3 and policy.breaker.rejected == 1
+
+
+def test_acall_hedges_slow_attempts():
+    policy = _policy(retries=0, timeout=1.0)
+    policy.hedge, policy.hedge_min_samples = True, 1
+    policy._latencies.append(0.01) # Hedge after 10 ms
+    started = []
+
+    async def request():
+        started.append(time.monotonic())
+        await asyncio.sleep(0.5 if len(started) == 1 else 0.01) # The first attempt is slow
+        return len(started)
+
+    async def scenario():
+        began = time.monotonic()
+        result = await policy.acall(request)
+        return result, time.monotonic() - began
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == 2 and elapsed < 0.3
+    assert (policy.hedges, policy.hedge_wins) == (1, 1)
+
+
+def test_astream_retries_until_the_first_item_only():
+    policy = _policy(retries=2)
+    attempts = []
+
+    async def stream():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise FakeBackendError("down")
+        yield "first"
+        raise FakeBackendError("dropped mid-stream")
+
+    async def scenario():
+        received = []
+        with pytest.raises(FakeBackendError):
+            async for item in policy.astream(stream):
+                received.append(item)
+        return received
+
+    assert asyncio.run(scenario()) == ["first"]
+    assert len(attempts) == 2 # Not retried once the caller had part of the answer
@@ -0,0 +1,22 @@
+# tests/test_startup.py
+# Import-time budget (see bench/startup.py): each check runs in a fresh interpreter.
+from bench.startup import DEFAULT_IMPORT_BUDGET_SECONDS, check_budget, measure_startup, probe
+
+
+def test_startup_within_budget():
+    results = measure_startup(repeat=1)
+    assert check_budget(results, DEFAULT_IMPORT_BUDGET_SECONDS) == []
+
+
+def test_backend_serves_notes_without_heavy_modules():
+    result = probe("backend.main", serve=True)
+    assert result["heavy_modules_loaded"] == []
+    assert {name: timing["status"] for name, timing in result["first_requests"].items()} == {
+        "add_note": 201, "notes": 200, "index": 200, "healthz": 200,
+    }
+
+
+def test_populate_db_import_is_light():
+    result = probe("populate_db")
+    assert result["heavy_modules_loaded"] == []
+    assert result["import_seconds"] <= DEFAULT_IMPORT_BUDGET_SECONDS